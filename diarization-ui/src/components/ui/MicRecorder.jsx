@@ -13,6 +13,52 @@ import {
 } from "./dropdown-menu";
 import { ChevronDown } from "lucide-react";
 
+const JOB_POLL_INTERVAL_MS = 2000;
+// The live transcription socket expects 16 kHz mono PCM16
+const LIVE_SAMPLE_RATE = 16000;
+
+const formatSegments = (segments) =>
+  segments.map((s) => `${s.speaker}: ${s.text}`).join("\n");
+
+const toPcm16 = (samples) => {
+  const pcm = new Int16Array(samples.length);
+  for (let i = 0; i < samples.length; i++) {
+    const s = Math.max(-1, Math.min(1, samples[i]));
+    pcm[i] = s < 0 ? s * 0x8000 : s * 0x7fff;
+  }
+  return pcm.buffer;
+};
+
+// Browsers record at the device rate (often 44.1 or 48 kHz) and Firefox
+// can't connect a microphone to a context at another rate, so the context
+// keeps its default rate and this brings its buffers down to 16 kHz. Each
+// output sample is the mean of the input samples it covers; the leftover
+// input carries over to the next buffer.
+const createResampler = (inputRate, outputRate = LIVE_SAMPLE_RATE) => {
+  const ratio = inputRate / outputRate;
+  let pending = new Float32Array(0);
+  let position = 0;
+  return (samples) => {
+    const input = new Float32Array(pending.length + samples.length);
+    input.set(pending);
+    input.set(samples, pending.length);
+    const count = Math.floor((input.length - position) / ratio);
+    const output = new Float32Array(count);
+    for (let i = 0; i < count; i++) {
+      const start = position + i * ratio;
+      const from = Math.floor(start);
+      const to = Math.max(from + 1, Math.floor(start + ratio));
+      let sum = 0;
+      for (let j = from; j < to; j++) sum += input[j];
+      output[i] = sum / (to - from);
+    }
+    const consumed = position + count * ratio;
+    pending = input.slice(Math.floor(consumed));
+    position = consumed - Math.floor(consumed);
+    return output;
+  };
+};
+
 const MicRecorderComponent = () => {
   const [isRecording, setIsRecording] = useState(false);
   const [audioURL, setAudioURL] = useState(null);
@@ -21,6 +67,7 @@ const MicRecorderComponent = () => {
   const [isComplete, setIsComplete] = useState(false);
   const [transcript, setTranscript] = useState("");
   const [summary, setSummary] = useState("");
+  const [progressMessage, setProgressMessage] = useState("");
   const [selectedOption, setSelectedOption] = useState("Summary");
   const [interactionType, setInteractionType] = useState("Doctor-Patient");
   const [showWaveformPlayer, setShowWaveformPlayer] = useState(false);
@@ -33,6 +80,11 @@ const MicRecorderComponent = () => {
   const audioCtxRef = useRef(null);
   const sourceRef = useRef(null);
   const audioElementRef = useRef(null);
+  const processorRef = useRef(null);
+  const socketRef = useRef(null);
+  const liveSegmentsRef = useRef([]);
+  const liveFailedRef = useRef(false);
+  const recordedBlobRef = useRef(null);
 
   const waveformRef = useRef(null);
   const togglePlay = () => {
@@ -96,6 +148,14 @@ const MicRecorderComponent = () => {
 
     sourceRef.current.connect(analyserRef.current);
     drawWave();
+    liveFailedRef.current = false;
+    recordedBlobRef.current = null;
+    try {
+      startLiveTranscription();
+    } catch (err) {
+      console.error("Live transcription unavailable:", err);
+      fallBackToUpload();
+    }
 
     mediaRecorderRef.current = new MediaRecorder(stream);
     audioChunksRef.current = [];
@@ -112,10 +172,13 @@ const MicRecorderComponent = () => {
       });
       const url = URL.createObjectURL(audioBlob);
       setAudioURL(url);
+      recordedBlobRef.current = audioBlob;
+      if (liveFailedRef.current) summarize(audioBlob);
 
       setShowWaveformPlayer(true);
 
       cancelAnimationFrame(animationRef.current);
+      if (processorRef.current) processorRef.current.disconnect();
       if (analyserRef.current) analyserRef.current.disconnect();
       if (sourceRef.current) sourceRef.current.disconnect();
       if (audioCtxRef.current) audioCtxRef.current.close();
@@ -125,15 +188,188 @@ const MicRecorderComponent = () => {
     setIsRecording(true);
   };
 
+  // Without live transcription the recording is uploaded like a file once
+  // it stops (right away if it already has).
+  const fallBackToUpload = () => {
+    if (liveFailedRef.current) return;
+    liveFailedRef.current = true;
+    setProgressMessage(
+      "Live transcription unavailable, uploading the recording..."
+    );
+    if (recordedBlobRef.current) summarize(recordedBlobRef.current);
+  };
+
+  // Streams the microphone to /api/live while recording. Finished speech
+  // regions come back with provisional speakers; after stop the server
+  // refines the speakers and the summary follows as a regular job.
+  const startLiveTranscription = () => {
+    const protocol = window.location.protocol === "https:" ? "wss" : "ws";
+    const socket = new WebSocket(
+      `${protocol}://${window.location.host}/api/live?interaction_type=${encodeURIComponent(
+        interactionType
+      )}`
+    );
+    socketRef.current = socket;
+    liveSegmentsRef.current = [];
+    setTranscript("");
+    setSummary("");
+    let finished = false;
+    socket.onclose = () => {
+      if (!finished) fallBackToUpload();
+    };
+
+    const resample = createResampler(audioCtxRef.current.sampleRate);
+    const processor = audioCtxRef.current.createScriptProcessor(4096, 1, 1);
+    processor.onaudioprocess = (e) => {
+      const samples = resample(e.inputBuffer.getChannelData(0));
+      if (socket.readyState === WebSocket.OPEN && samples.length > 0) {
+        socket.send(toPcm16(samples));
+      }
+    };
+    sourceRef.current.connect(processor);
+    // the processor only runs while connected to the output, which stays silent
+    processor.connect(audioCtxRef.current.destination);
+    processorRef.current = processor;
+
+    socket.onmessage = async (message) => {
+      const event = JSON.parse(message.data);
+      if (event.type === "partial") {
+        liveSegmentsRef.current = [...liveSegmentsRef.current, event.segment];
+        setTranscript(formatSegments(liveSegmentsRef.current));
+      } else if (event.type === "progress" && event.event.status === "started") {
+        setProgressMessage(`Refining: running ${event.event.stage}...`);
+      } else if (event.type === "final") {
+        finished = true;
+        socket.close();
+        setTranscript(event.result.transcript);
+        setProgressMessage("Transcript ready, summarizing...");
+        try {
+          const data = await followJob(event.job_id);
+          if (data.summary) setSummary(data.summary);
+          setIsComplete(true);
+        } catch (err) {
+          console.error("Error during summarization:", err);
+        } finally {
+          setIsLoading(false);
+        }
+      } else if (event.type === "error") {
+        // closing falls back to uploading the recording
+        console.error("Live transcription failed:", event.error);
+        socket.close();
+      }
+    };
+  };
+
   const stopRecording = () => {
     if (
       mediaRecorderRef.current &&
       mediaRecorderRef.current.state !== "inactive"
     ) {
       mediaRecorderRef.current.stop();
-      setIsLoading(false);
       setIsComplete(false);
       setIsRecording(false);
+      const socket = socketRef.current;
+      if (socket && socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ type: "stop" }));
+        setIsLoading(true);
+        setProgressMessage("Refining speakers...");
+      } else {
+        // the recording is uploaded once it stopped
+        fallBackToUpload();
+      }
+    }
+  };
+
+  // Follows the job's Server-Sent Events, showing stage progress and the
+  // transcript as soon as it is ready. Falls back to polling on errors.
+  const followJob = (jobId) =>
+    new Promise((resolve, reject) => {
+      const source = new EventSource(`/api/jobs/${jobId}/events`);
+      source.onmessage = (message) => {
+        const event = JSON.parse(message.data);
+        if (event.stage === "job" && event.status === "done") {
+          source.close();
+          resolve(event.result);
+        } else if (event.stage === "job" && event.status === "failed") {
+          source.close();
+          reject(new Error(event.error?.message));
+        } else if (event.stage === "transcript") {
+          setTranscript(event.transcript);
+          setProgressMessage("Transcript ready, summarizing...");
+        } else if (event.stage === "whisper" && event.status === "progress") {
+          setProgressMessage(
+            `Transcribing ${event.processed_seconds}s / ${event.total_seconds}s`
+          );
+        } else if (event.status === "started") {
+          setProgressMessage(`Running ${event.stage}...`);
+        }
+      };
+      source.onerror = () => {
+        source.close();
+        pollJob(jobId).then(resolve, reject);
+      };
+    });
+
+  const pollJob = async (jobId) => {
+    while (true) {
+      const res = await fetch(`/api/jobs/${jobId}`);
+      const job = await res.json();
+      if (job.status === "done") return job.result;
+      if (job.status === "failed") throw new Error(job.error?.message);
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+  };
+
+  // Uploads a recording or file as a regular job and follows it.
+  const summarize = async (blob) => {
+    setIsLoading(true);
+    setIsComplete(false);
+
+    try {
+      const formData = new FormData();
+      formData.append("audio", blob, "recording.webm");
+      console.log("Interaction type being sent:", interactionType);
+      formData.append("interaction_type", interactionType);
+
+      const res = await fetch("/api/diarize", {
+        method: "POST",
+        body: formData,
+      });
+
+      if (res.status === 429) {
+        const retryAfter = res.headers.get("Retry-After");
+        throw new Error(
+          `Server is busy, try again in ${retryAfter} seconds.`
+        );
+      }
+
+      // Cached uploads are answered right away, others are polled
+      const submitted = await res.json();
+      if (submitted.result?.transcript) {
+        setTranscript(submitted.result.transcript);
+      }
+      const data =
+        submitted.status === "done"
+          ? submitted.result
+          : await followJob(submitted.job_id);
+      console.log("Diarization filename:", data.filename);
+      console.log("Transcript:", data.transcript);
+      console.log("Summary:", data.summary);
+
+      if (data.transcript) {
+        setTranscript(data.transcript);
+      }
+      if (data.summary) {
+        setSummary(data.summary);
+      }
+
+      setIsLoading(false);
+      setIsComplete(true);
+    } catch (err) {
+      console.error("Error during diarization:", err);
+      setIsLoading(false);
+      setIsComplete(false);
+      alert("Diarization failed. Check console for error.");
     }
   };
 
@@ -151,6 +387,11 @@ const MicRecorderComponent = () => {
     return () => {
       if (animationRef.current) cancelAnimationFrame(animationRef.current);
       if (audioCtxRef.current) audioCtxRef.current.close();
+      if (socketRef.current) {
+        // leaving the page isn't a failure to upload for
+        socketRef.current.onclose = null;
+        socketRef.current.close();
+      }
     };
   }, []);
 
@@ -159,7 +400,11 @@ const MicRecorderComponent = () => {
       <h2 className="text-xl font-bold">
         Mic Recorder for Conversation Summarization!! Update?
       </h2>
-      <StatusBanner isLoading={isLoading} isComplete={isComplete} />
+      <StatusBanner
+        isLoading={isLoading}
+        isComplete={isComplete}
+        message={progressMessage}
+      />
       <div className="rounded border w-full max-w-full">
         {!showWaveformPlayer ? (
           <canvas
@@ -257,42 +502,9 @@ const MicRecorderComponent = () => {
             if (!audioURL)
               return alert("Please record or upload an audio file first.");
 
-            setIsLoading(true);
-            setIsComplete(false);
-
-            try {
-              const response = await fetch(audioURL);
-              const blob = await response.blob();
-              const formData = new FormData();
-              formData.append("audio", blob, "recording.webm");
-              console.log("Interaction type being sent:", interactionType);
-              formData.append("interaction_type", interactionType);
-
-              const res = await fetch("/api/diarize", {
-                method: "POST",
-                body: formData,
-              });
-
-              const data = await res.json();
-              console.log("Diarization filename:", data.filename);
-              console.log("Transcript:", data.transcript);
-              console.log("Summary:", data.summary);
-
-              if (data.transcript) {
-                setTranscript(data.transcript);
-              }
-              if (data.summary) {
-                setSummary(data.summary);
-              }
-
-              setIsLoading(false);
-              setIsComplete(true);
-            } catch (err) {
-              console.error("Error during diarization:", err);
-              setIsLoading(false);
-              setIsComplete(false);
-              alert("Diarization failed. Check console for error.");
-            }
+            setProgressMessage("");
+            const response = await fetch(audioURL);
+            summarize(await response.blob());
           }}
           className="bg-blue-500 text-white px-4 py-2 rounded mt-0"
         >
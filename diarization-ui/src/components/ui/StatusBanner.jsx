@@ -2,12 +2,12 @@
 
 import React from "react";
 
-const StatusBanner = ({ isLoading, isComplete }) => {
+const StatusBanner = ({ isLoading, isComplete, message }) => {
   return (
     <div className="w-full text-center my-4">
       {isLoading && (
         <div className="text-blue-600 font-semibold animate-pulse">
-          Diarization in progress...
+          {message || "Diarization in progress..."}
         </div>
       )}
       {isComplete && (
@@ -7,7 +7,8 @@ export default defineConfig({
   server: {
     port: 5173,
     proxy: {
-      "/api": "http://localhost:5001",
+      // ws: the live transcription socket at /api/live
+      "/api": { target: "http://localhost:5001", ws: true },
     },
     host: "0.0.0.0",
     allowedHosts: ["maxklema-mie-diarization-main.opensource.mieweb.org"],
@@ -1,14 +1,347 @@
+import json
 import os
+import queue
+import threading
 import uuid
-import subprocess
-import requests
-from flask import Flask, jsonify, request
+from concurrent.futures import Future
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
 from dotenv import load_dotenv
+from cache import ResultCache, hash_file, make_cache_key
+from jobs import JobQueue, QueueFullError, gather
+from metrics import (
+    CONTENT_TYPE_LATEST,
+    JOBS_IN_FLIGHT,
+    MODEL_LOAD_SECONDS,
+    QUEUE_DEPTH,
+    QUEUE_WAIT_SECONDS,
+    REGISTRY,
+    observe_pipeline_result,
+)
+from probe import probe_duration
+from summarize import OzwellClient, SummaryService
+from worker import DiarizationWorker, LiveWorker, WorkerError
 load_dotenv()
 OZWELL_API_KEY = os.getenv("OZWELL_API_KEY")
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "http://localhost:5173"}})
+sock = Sock(app)
+
+MEDICAL_SYSTEM_MESSAGE = """You are a helpful medical assistant. Given a doctor-patient conversation transcript, generate a clear, concise summary understandable to both doctor and patient.
+
+Your summary must include as many of the following as possible, based only on what is actually mentioned in the conversation:
+- Patient's main complaint or condition.
+- Any relevant history or self-treatment the patient attempted.
+- Possible causes or contributing factors discussed.
+- Diagnostic steps or assessments performed by the doctor.
+- The doctor’s explanation of the condition (if any).
+- Clearly state the treatment plan or advice.
+- Any follow-up instructions or prognosis.
+- Any advice or lifestyle recommendations.
+- Be easy for patient and doctor to understand.
+- Be complete but not unnecessarily verbose.
+
+Do not guess or hallucinate missing information. Use simple language. Organize as short paragraphs or bullet points. Be complete but not verbose.
+
+Start with: **Patient Summary:**
+
+If any item is not covered, skip it politely.
+"""
+
+GENERAL_SYSTEM_MESSAGE = "You are a helpful, general-purpose assistant. Summarize this conversation clearly and concisely for any reader. Do not assume any medical context. Avoid disclaimers."
+
+
+def get_system_message(interaction_type):
+    if interaction_type.lower() == "general":
+        return GENERAL_SYSTEM_MESSAGE
+    return MEDICAL_SYSTEM_MESSAGE
+
+
+ozwell_client = OzwellClient(
+    OZWELL_API_KEY,
+    base_url=os.getenv("OZWELL_BASE_URL", "https://ai.bluehive.com/api/v1"),
+)
+summary_service = SummaryService(
+    ozwell_client,
+    cache=ResultCache(
+        os.getenv("SUMMARY_CACHE_DIR", os.path.join("cache", "summaries")),
+        max_bytes=int(os.getenv("SUMMARY_CACHE_MAX_MB", "64")) * 1024 * 1024,
+    ),
+    max_workers=int(os.getenv("SUMMARY_WORKERS", "2")),
+    chunk_chars=int(os.getenv("SUMMARY_CHUNK_CHARS", "12000")),
+    chunk_concurrency=int(os.getenv("SUMMARY_CHUNK_CONCURRENCY", "4")),
+)
+
+
+def parse_stemming(value):
+    """The STEMMING setting as the pipeline takes it: "auto", True or False."""
+    value = value.strip().lower()
+    if value == "auto":
+        return "auto"
+    if value in ("true", "1", "yes"):
+        return True
+    if value in ("false", "0", "no"):
+        return False
+    raise ValueError(f"STEMMING must be auto, true or false, got {value!r}")
+
+
+def parse_alignment(value):
+    """The WORD_ALIGNMENT setting, "ctc" or "whisper"."""
+    value = value.strip().lower()
+    if value not in ("ctc", "whisper"):
+        raise ValueError(f"WORD_ALIGNMENT must be ctc or whisper, got {value!r}")
+    return value
+
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "medium.en")
+PIPELINE_OPTIONS = {
+    "stemming": parse_stemming(os.getenv("STEMMING", "auto")),
+    "suppress_numerals": False,
+    "language": None,
+    # recordings longer than this are diarized in windows with bounded memory
+    "window_seconds": float(os.getenv("LONG_FORM_WINDOW_SECONDS", "0")) or None,
+    # "whisper" takes word timings from Whisper instead of the CTC alignment
+    "alignment": parse_alignment(os.getenv("WORD_ALIGNMENT", "ctc")),
+}
+
+result_cache = ResultCache(
+    os.getenv("RESULT_CACHE_DIR", os.path.join("cache", "results")),
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_MB", "512")) * 1024 * 1024,
+)
+
+
+def get_transcription_cache_key(audio_path):
+    return make_cache_key(hash_file(audio_path), model_name=WHISPER_MODEL, **PIPELINE_OPTIONS)
+
+
+def start_summary(filename, transcription, interaction_type, cached, **extra):
+    """
+    Queue the Ozwell summary on the summarization pool. Returns the partial
+    result (transcript only) and a Future of the complete result.
+    """
+    result = {
+        "message": "Diarization done, summarization in progress",
+        "filename": filename,
+        "transcript": transcription["transcript"],
+        "summary": None,
+        "timings": transcription["timings"],
+        "cached": cached,
+        **extra
+    }
+    job_future = Future()
+
+    def on_summary(summary_future):
+        ozwell_summary = "Could not get summary."
+        try:
+            ozwell_summary = summary_future.result()
+            # Save the summary to a new file
+            summary_file = os.path.join("uploads", os.path.splitext(filename)[0] + "_summary.txt")
+            with open(summary_file, "w", encoding="utf-8") as f:
+                f.write(ozwell_summary)
+        except Exception as e:
+            print("Error getting Ozwell summary:", str(e))
+        job_future.set_result({
+            **result,
+            "message": "Diarization and summarization done",
+            "summary": ozwell_summary
+        })
+
+    summary_service.submit(
+        transcription["transcript"], get_system_message(interaction_type)
+    ).add_done_callback(on_summary)
+    return dict(result), job_future
+
+
+def publish_transcript(job, partial_result):
+    # Let pollers and event streams show the transcript before the summary is ready
+    job.result = partial_result
+    job.publish({"stage": "transcript", "status": "finished", "transcript": partial_result["transcript"]})
+    job.publish({"stage": "summary", "status": "started"})
+
+
+def load_transcription(result):
+    """The cacheable part of a pipeline result, the texts come with it."""
+    return {
+        "transcript": result["transcript"],
+        "srt": result["srt"],
+        "words": result["words"],
+        "sentences": result["sentences"],
+        "speakers": result["speakers"],
+        "rttm": result["rttm"],
+        "language": result["language"],
+        "timings": result["timings"],
+    }
+
+
+def observe_worker_result(result, worker):
+    observe_pipeline_result(result)
+    for model, seconds in (worker.load_timings or {}).items():
+        MODEL_LOAD_SECONDS.set(seconds, model=model)
+
+
+def run_job(job, worker):
+    QUEUE_WAIT_SECONDS.observe(job.queue_wait)
+    if "files" in job.params:
+        return run_batch_job(job, worker)
+    return run_diarization_job(job, worker)
+
+
+def run_diarization_job(job, worker):
+    filename = job.params["filename"]
+    cache_key = job.params["cache_key"]
+
+    # An identical upload may have finished while this job was queued
+    transcription = result_cache.get(cache_key)
+    if transcription is not None:
+        partial_result, job_future = start_summary(
+            filename, transcription, job.params["interaction_type"], cached=True
+        )
+        publish_transcript(job, partial_result)
+        return job_future
+
+    result = worker.run(os.path.join("uploads", filename), progress=job.publish, **PIPELINE_OPTIONS)
+    print("Diarization timings:", result["timings"])
+    observe_worker_result(result, worker)
+
+    transcription = load_transcription(result)
+    result_cache.put(cache_key, transcription)
+
+    # The summary finishes the job on the summarization pool, freeing this worker
+    partial_result, job_future = start_summary(
+        filename,
+        transcription,
+        job.params["interaction_type"],
+        cached=False,
+        cold_start=result["cold_start"],
+        model_load_timings=worker.load_timings
+    )
+    publish_transcript(job, partial_result)
+    return job_future
+
+
+def run_batch_job(job, worker):
+    """
+    Diarize all files of a batch upload in one worker pass so their Whisper
+    chunks share GPU batches. Every file is published and summarized as soon
+    as it is done; the job finishes once all summaries are in.
+    """
+    interaction_type = job.params["interaction_type"]
+    files = job.params["files"]
+    partial_results = [{"filename": file["filename"], "status": "queued"} for file in files]
+    futures = [None] * len(files)
+    job.result = {"files": partial_results}
+
+    def finish_file(index, transcription=None, error=None, **extra):
+        filename = files[index]["filename"]
+        if error is not None:
+            print(f"Diarization of {filename} failed:", str(error))
+            partial_results[index] = {
+                "filename": filename,
+                "status": "failed",
+                "error": {"message": str(error), "details": getattr(error, "details", None)},
+            }
+            futures[index] = Future()
+            futures[index].set_result(partial_results[index])
+            job.publish({"stage": "file", "status": "failed", **partial_results[index]})
+            return
+
+        partial_results[index], futures[index] = start_summary(
+            filename, transcription, interaction_type, **extra
+        )
+        job.publish({
+            "stage": "file",
+            "status": "finished",
+            "filename": filename,
+            "transcript": transcription["transcript"],
+        })
+
+    pending = []
+    for index, file in enumerate(files):
+        transcription = result_cache.get(file["cache_key"])
+        if transcription is not None:
+            finish_file(index, transcription, cached=True)
+        else:
+            pending.append(index)
+
+    def on_result(audio_path, result, error):
+        index = pending[paths.index(audio_path)]
+        if error is not None:
+            finish_file(index, error=error)
+            return
+        observe_worker_result(result, worker)
+        transcription = load_transcription(result)
+        result_cache.put(files[index]["cache_key"], transcription)
+        finish_file(index, transcription, cached=False, cold_start=result["cold_start"])
+
+    paths = [os.path.join("uploads", files[index]["filename"]) for index in pending]
+    if paths:
+        try:
+            worker.run_batch(paths, on_result, progress=job.publish, **PIPELINE_OPTIONS)
+        except Exception as e:
+            # files the worker never got to fail with the worker's error
+            for index in pending:
+                if futures[index] is None:
+                    finish_file(index, error=e)
+
+    job.publish({"stage": "summary", "status": "started"})
+    job_future = Future()
+    gather(futures).add_done_callback(
+        lambda f: job_future.set_result({
+            "message": "Diarization and summarization done",
+            "files": f.result(),
+            "model_load_timings": worker.load_timings,
+        })
+    )
+    return job_future
+
+
+def get_worker_kwargs():
+    return dict(
+        model_name=WHISPER_MODEL,
+        hf_token=os.getenv("HF_TOKEN"),
+        parallel_stages=os.getenv("DIARIZATION_PARALLEL_STAGES", "0") == "1",
+        stem_cache_dir=os.getenv("STEM_CACHE_DIR", os.path.join("cache", "stems")),
+        stem_cache_max_bytes=int(os.getenv("STEM_CACHE_MAX_MB", "2048")) * 1024 * 1024,
+    )
+
+
+# Started lazily so the Flask reloader's parent process doesn't load the models
+job_queue = None
+live_worker = None
+live_worker_lock = threading.Lock()
+
+
+def get_job_queue():
+    global job_queue
+    if job_queue is None:
+        job_queue = JobQueue(
+            run_job,
+            worker_factory=lambda: DiarizationWorker(
+                **get_worker_kwargs(), alignment=PIPELINE_OPTIONS["alignment"]
+            ),
+            num_workers=int(os.getenv("DIARIZATION_WORKERS", "1")),
+            max_queue_size=int(os.getenv("DIARIZATION_QUEUE_SIZE", "8")),
+            aging_rate=float(os.getenv("DIARIZATION_AGING_RATE", "1.0")),
+        )
+    return job_queue
+
+
+def get_live_worker():
+    global live_worker
+    with live_worker_lock:
+        if live_worker is None:
+            live_worker = LiveWorker(**get_worker_kwargs())
+    return live_worker
+
+
+QUEUE_DEPTH.set_function(lambda: job_queue.depth if job_queue is not None else 0)
+JOBS_IN_FLIGHT.set_function(lambda: job_queue.in_flight if job_queue is not None else 0)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.generate_latest(), mimetype=CONTENT_TYPE_LATEST)
 
 @app.route('/api/test', methods=['GET'])
 def test():
@@ -32,98 +365,228 @@ def diarize_audio():
     interaction_type = request.form.get("interaction_type", "medical")
     print("Received interactionType:", interaction_type)
 
+    # Re-uploads of the same recording skip the pipeline entirely
+    cache_key = get_transcription_cache_key(save_path)
+    transcription = result_cache.get(cache_key)
+    if transcription is not None:
+        partial_result, job_future = start_summary(
+            filename, transcription, interaction_type, cached=True
+        )
+        job = get_job_queue().track(
+            job_future, result=partial_result, filename=filename, interaction_type=interaction_type
+        )
+        return jsonify({
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/api/jobs/{job.id}",
+            "result": job.result
+        }), 200
+
     try:
-        result = subprocess.run(
-            ['python3', 'diarize.py', '-a', os.path.join('uploads', filename)],
-            capture_output=True,
-            text=True,
-            check=True
+        job = get_job_queue().submit(
+            cost=probe_duration(save_path),
+            filename=filename,
+            interaction_type=interaction_type,
+            cache_key=cache_key,
         )
+    except QueueFullError as e:
+        os.remove(save_path)
+        response = jsonify({"error": "Server is busy, try again later"})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
 
-        # Path to transcript file
-        transcript_file = os.path.join("uploads", os.path.splitext(filename)[0] + ".txt")
-        with open(transcript_file, "r", encoding="utf-8") as f:
-            transcript_text = f.read().lstrip('\ufeff')
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}"
+    }), 202
 
-        # Prepare Ozwell summarization request
-        ozwell_url = "https://ai.bluehive.com/api/v1/completion"
-        headers = {
-                    "Authorization": f"Bearer {OZWELL_API_KEY}",
-                    "Content-Type": "application/json"
-                    }
 
-        if interaction_type.lower() == "general":
-            system_message = "You are a helpful, general-purpose assistant. Summarize this conversation clearly and concisely for any reader. Do not assume any medical context. Avoid disclaimers."
-        else:
-            system_message = """You are a helpful medical assistant. Given a doctor-patient conversation transcript, generate a clear, concise summary understandable to both doctor and patient.
+@app.route('/api/diarize/batch', methods=['POST'])
+def diarize_batch():
+    audio_files = [f for f in request.files.getlist('audio') if f.filename != '']
+    if not audio_files:
+        return jsonify({"error": "No audio files provided"}), 400
 
-Your summary must include as many of the following as possible, based only on what is actually mentioned in the conversation:
-- Patient's main complaint or condition.
-- Any relevant history or self-treatment the patient attempted.
-- Possible causes or contributing factors discussed.
-- Diagnostic steps or assessments performed by the doctor.
-- The doctor’s explanation of the condition (if any).
-- Clearly state the treatment plan or advice.
-- Any follow-up instructions or prognosis.
-- Any advice or lifestyle recommendations.
-- Be easy for patient and doctor to understand.
-- Be complete but not unnecessarily verbose.
+    os.makedirs("uploads", exist_ok=True)
+    files = []
+    for audio_file in audio_files:
+        extension = os.path.splitext(audio_file.filename)[1] or ".webm"
+        filename = f"{uuid.uuid4().hex}{extension}"
+        save_path = os.path.join("uploads", filename)
+        audio_file.save(save_path)
+        files.append({
+            "filename": filename,
+            "original_filename": audio_file.filename,
+            "cache_key": get_transcription_cache_key(save_path),
+            "duration": probe_duration(save_path),
+        })
 
-Do not guess or hallucinate missing information. Use simple language. Organize as short paragraphs or bullet points. Be complete but not verbose.
+    interaction_type = request.form.get("interaction_type", "medical")
+    print(f"Received batch of {len(files)} files, interactionType:", interaction_type)
 
-Start with: **Patient Summary:**
+    try:
+        job = get_job_queue().submit(
+            cost=sum(file["duration"] for file in files),
+            files=files,
+            interaction_type=interaction_type,
+        )
+    except QueueFullError as e:
+        for file in files:
+            os.remove(os.path.join("uploads", file["filename"]))
+        response = jsonify({"error": "Server is busy, try again later"})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
 
-If any item is not covered, skip it politely.
-"""
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "files": [
+            {"filename": file["filename"], "original_filename": file["original_filename"]}
+            for file in files
+        ],
+    }), 202
 
-        payload = {
-            "prompt": f"Provide a clear, concise summary of the following conversation:\n\n{transcript_text}",
-            "systemMessage": system_message,
-            "temperature": 0.0,
-            "maxTokens": 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+
+    def generate():
+        for event in job.follow():
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"data: {json.dumps(event)}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@sock.route('/api/live')
+def live_session(ws):
+    """
+    Live transcription of a recording in progress. The client sends 16 kHz
+    mono PCM16 as binary messages and `{"type": "stop"}` once the recording
+    ends. It gets a `{"type": "partial", "segment": ...}` message for every
+    finished speech region with a provisional speaker, then `{"type": "final",
+    "job_id": ..., "result": ...}` once the full diarization has refined them;
+    the summary follows on `/api/jobs/<job_id>/events` as for uploads.
+    """
+    interaction_type = request.args.get("interaction_type", "medical")
+    session_id = uuid.uuid4().hex
+    filename = f"live_{session_id}.wav"
+    os.makedirs("uploads", exist_ok=True)
+    outbox = queue.Queue()
+    worker = get_live_worker()
+    try:
+        worker.open(
+            session_id,
+            outbox.put,
+            language=PIPELINE_OPTIONS["language"],
+            suppress_numerals=PIPELINE_OPTIONS["suppress_numerals"],
+        )
+    except WorkerError as e:
+        ws.send(json.dumps({"type": "error", "error": {"message": str(e), "details": e.details}}))
+        return
+
+    def finish(result):
+        observe_worker_result(result, worker)
+        transcription = load_transcription(result)
+        partial_result, job_future = start_summary(
+            filename,
+            transcription,
+            interaction_type,
+            cached=False,
+            cold_start=result["cold_start"],
+            model_load_timings=worker.load_timings,
+        )
+        job = get_job_queue().track(
+            job_future, result=partial_result, filename=filename, interaction_type=interaction_type
+        )
+        return {
+            "type": "final",
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/api/jobs/{job.id}",
+            "result": job.result,
         }
 
-        ozwell_response = requests.post(ozwell_url, headers=headers, json=payload)
-        ozwell_summary = "Could not get summary."
-        if ozwell_response.ok:
+    def forward():
+        # the only thread sending on the socket until the session is over
+        while True:
+            message = outbox.get()
+            status = message["status"]
             try:
-                ozwell_summary = ozwell_response.json()["choices"][0]["message"]["content"]
-                # Save the summary to a new file
-                summary_file = os.path.join("uploads", os.path.splitext(filename)[0] + "_summary.txt")
-                with open(summary_file, "w", encoding="utf-8") as f:
-                    f.write(ozwell_summary)
-            except Exception as e:
-                print("Error parsing Ozwell summary:", str(e))
-        
-            
-
-        return jsonify({
-            "message": "Diarization and summarization done",
-            "filename": filename,
-            "transcript": transcript_text,
-            "summary": ozwell_summary
-        }), 200
-    except subprocess.CalledProcessError as e:
-        return jsonify({
-            "error": "Diarization failed",
-            "details": e.stderr
-        }), 500
+                if status == "partial":
+                    ws.send(json.dumps({"type": "partial", "segment": message["segment"]}))
+                elif status == "progress":
+                    ws.send(json.dumps({"type": "progress", "event": message["event"]}))
+                elif status == "done":
+                    ws.send(json.dumps(finish(message["result"])))
+                    return
+                elif status == "client_error":
+                    ws.send(json.dumps({"type": "error", "error": {"message": message["message"]}}))
+                elif status == "cancelled":
+                    return
+                else:
+                    print("Live session failed:", message["error"])
+                    ws.send(json.dumps({"type": "error", "error": {"message": "Live transcription failed"}}))
+                    return
+            except ConnectionClosed:
+                return
 
+    forwarder = threading.Thread(target=forward, daemon=True)
+    forwarder.start()
+    stopped = False
+    try:
+        while True:
+            data = ws.receive()
+            if isinstance(data, bytes):
+                worker.send_audio(session_id, data)
+                continue
+            try:
+                message_type = json.loads(data).get("type")
+            except (TypeError, ValueError, AttributeError):
+                # a bad control message is the client's problem, keep recording
+                outbox.put(
+                    {"status": "client_error", "message": "Control messages must be JSON objects"}
+                )
+                continue
+            if message_type == "stop":
+                break
+        worker.stop(session_id, os.path.join("uploads", filename))
+        stopped = True
+    except (ConnectionClosed, WorkerError):
+        # the client went away mid-recording
+        pass
+    finally:
+        # whatever ended the session early, drop it in the worker too
+        if not stopped:
+            worker.cancel(session_id)
+            outbox.put({"status": "cancelled"})
+    if stopped:
+        forwarder.join()
 
 
 @app.route('/api/test_ozwell', methods=['GET'])
 def test_ozwell():
     try:
-        headers = {
-            "Authorization": f"Bearer {OZWELL_API_KEY}",
-            "Content-Type": "application/json"
-        }
-
         # This URL is for testing credentials only
-        response = requests.post(
-            "https://ai.bluehive.com/api/v1/test-credentials",
-            headers=headers
-        )
+        response = ozwell_client.post("test-credentials")
 
         print("Ozwell Response:", response.text)
         return jsonify({"ozwell_reply": response.json()}), response.status_code
@@ -139,21 +602,12 @@ def ozwell_chat():
         if not user_input:
             return jsonify({"error": "No message provided"}), 400
 
-        headers = {
-            "Authorization": f"Bearer {OZWELL_API_KEY}",
-            "Content-Type": "application/json"
-        }
-
         payload = {
             "prompt": user_input,
             "systemMessage": "You are a helpful assistant."
         }
 
-        response = requests.post(
-            "https://ai.bluehive.com/api/v1/completion",
-            headers=headers,
-            json=payload
-        )
+        response = ozwell_client.post("completion", json=payload)
 
         print("Ozwell Chat Status Code:", response.status_code)
         print("Ozwell Chat Raw Response:", response.text)
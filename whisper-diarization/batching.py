@@ -0,0 +1,260 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import torch
+
+# what one batch item is assumed to need until a batch on CUDA measures it
+DEFAULT_ITEM_BYTES = {"whisper": 256 * 2**20, "alignment": 128 * 2**20}
+# share of the free memory a batch may fill
+MEMORY_HEADROOM = 0.8
+# full batches in a row before a larger size is tried
+GROW_AFTER = 4
+# seconds until a size that ran out of memory may be tried again, what
+# other processes hold on the device changes
+CEILING_TTL = 6 * 3600
+
+
+def is_oom(error):
+    """Whether `error` is torch's or CTranslate2's out-of-memory error."""
+    if isinstance(error, (torch.cuda.OutOfMemoryError, MemoryError)):
+        return True
+    return isinstance(error, RuntimeError) and "out of memory" in str(error).lower()
+
+
+def free_memory(device):
+    """Free VRAM on a CUDA device or available RAM, None if unknown."""
+    if str(device).startswith("cuda"):
+        free, _ = torch.cuda.mem_get_info(torch.device(device))
+        return free
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def merge_state(saved, ours):
+    """A model's state in the file combined with this process's."""
+    merged = dict(ours)
+    if not saved:
+        return merged
+    # the most recent out of memory error wins
+    if (saved.get("ceiling_at") or 0) > (ours.get("ceiling_at") or 0):
+        merged["ceiling"] = saved.get("ceiling")
+        merged["ceiling_at"] = saved["ceiling_at"]
+    merged["item_bytes"] = ours.get("item_bytes") or saved.get("item_bytes")
+    return merged
+
+
+class AdaptiveBatchSize:
+    """
+    The batch size of one model on one device, see `BatchSizer`. `state`
+    is this model's entry in the sizer's saved state.
+    """
+
+    def __init__(self, sizer, kind, device, state):
+        self.sizer = sizer
+        self.kind = kind
+        self.device = str(device)
+        self.state = state
+        self.current = state["best"] or sizer.initial
+        self.streak = 0
+
+    def size(self):
+        """The current size, capped by what fits in free memory."""
+        with self.sizer.lock:
+            size = self.current
+            item_bytes = self.state["item_bytes"] or DEFAULT_ITEM_BYTES.get(self.kind)
+        free = free_memory(self.device)
+        if free is not None and item_bytes:
+            size = min(size, max(1, int(free * MEMORY_HEADROOM // item_bytes)))
+        return max(1, min(size, self.sizer.maximum))
+
+    def _ceiling(self):
+        """The smallest size that ran out of memory, None once it expired."""
+        ceiling_at = self.state.get("ceiling_at") or 0
+        if self.state["ceiling"] is not None and time.time() - ceiling_at > CEILING_TTL:
+            self.state["ceiling"] = None
+        return self.state["ceiling"]
+
+    def succeeded(self, size, item_bytes=None):
+        with self.sizer.lock:
+            self.state["best"] = max(self.state["best"] or 0, size)
+            if item_bytes:
+                self.state["item_bytes"] = int(item_bytes)
+            if size < self.current:
+                return
+            self.streak += 1
+            grown = min(2 * self.current, self.sizer.maximum)
+            ceiling = self._ceiling()
+            if ceiling is not None:
+                grown = min(grown, ceiling - 1)
+            if self.streak >= GROW_AFTER and grown > self.current:
+                self.current = grown
+                self.streak = 0
+
+    def failed(self, size):
+        """Back off after `size` ran out of memory."""
+        with self.sizer.lock:
+            ceiling = self._ceiling()
+            self.state["ceiling"] = size if ceiling is None else min(ceiling, size)
+            self.state["ceiling_at"] = time.time()
+            self.current = max(1, size // 2)
+            if self.state["best"] is not None and self.state["best"] >= size:
+                self.state["best"] = self.current
+            self.streak = 0
+        print(
+            f"[INFO] {self.kind} ran out of memory at batch size {size} on "
+            f"{self.device}, retrying with {self.current}"
+        )
+        if self.device.startswith("cuda"):
+            torch.cuda.empty_cache()
+        self.sizer.save()
+
+    def run(self, items, fn):
+        """
+        Call `fn` on consecutive slices of `items` of the current size and
+        return its results in order. A slice that runs out of memory is
+        retried at half the size; on CUDA, the peak memory of each slice
+        updates the estimated cost per item.
+        """
+        measure = self.device.startswith("cuda")
+        results = []
+        start = 0
+        while start < len(items):
+            batch = items[start : start + self.size()]
+            if measure:
+                torch.cuda.reset_peak_memory_stats(self.device)
+                allocated = torch.cuda.memory_allocated(self.device)
+            try:
+                result = fn(batch)
+            except Exception as error:
+                if not is_oom(error) or len(batch) == 1:
+                    raise
+                self.failed(len(batch))
+                continue
+            item_bytes = None
+            if measure:
+                peak = torch.cuda.max_memory_allocated(self.device)
+                item_bytes = (peak - allocated) / len(batch)
+            self.succeeded(len(batch), item_bytes)
+            results.append(result)
+            start += len(batch)
+        return results
+
+
+class BatchSizer:
+    """
+    Batch sizes for Whisper and the CTC emissions that adapt to the memory
+    at hand instead of one static `--batch-size`.
+
+    Each model and device starts at the largest size that worked on an
+    earlier run (or `initial`) and never goes above what fits in the
+    device's free memory, at an estimated cost per item that batches on
+    CUDA replace with the measured one. After a few full batches the size
+    doubles, staying below the smallest size that ran out of memory in the
+    last `CEILING_TTL` seconds; running out of memory halves it and the
+    failed batch is retried (see `AdaptiveBatchSize.run`). The best sizes
+    are kept in the JSON file at `path` across runs, which processes
+    sharing it merge into under a lock.
+    """
+
+    def __init__(
+        self,
+        path=os.path.join("cache", "batch_sizes.json"),
+        initial=8,
+        maximum=64,
+    ):
+        self.path = path
+        self.initial = initial
+        self.maximum = maximum
+        self.lock = threading.Lock()
+        self._state = self._read()
+        self._sizes = {}
+
+    def _read(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, kind, **params):
+        """The `AdaptiveBatchSize` of the model `ModelRegistry` loads for `params`."""
+        key = f"{kind}:{json.dumps(params, sort_keys=True, default=str)}"
+        with self.lock:
+            if key not in self._sizes:
+                state = self._state.setdefault(
+                    key,
+                    {
+                        "best": None,
+                        "ceiling": None,
+                        "ceiling_at": None,
+                        "item_bytes": None,
+                    },
+                )
+                self._sizes[key] = AdaptiveBatchSize(
+                    self, kind, params.get("device", "cpu"), state
+                )
+            return self._sizes[key]
+
+    def save(self):
+        """
+        Merge the state of the sizes used here into the file, keeping what
+        other processes wrote there since it was read.
+        """
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            saved = self._read()
+            with self.lock:
+                for key, state in saved.items():
+                    if key in self._sizes:
+                        # the sizes in use keep their dict
+                        self._state[key].update(merge_state(state, self._state[key]))
+                    else:
+                        self._state[key] = state
+                state = json.dumps(self._state, indent=2, sort_keys=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(state)
+            os.replace(tmp_path, self.path)
+
+    def stats(self):
+        with self.lock:
+            return {
+                key: {**state, "current": self._sizes[key].current}
+                for key, state in self._state.items()
+                if key in self._sizes
+            }
+
+
+class AdaptiveForward:
+    """
+    Wraps a Hugging Face CTC model so that each batch `generate_emissions`
+    passes in is split by `sizes` and survives running out of memory.
+    """
+
+    def __init__(self, model, sizes):
+        self.model = model
+        self.sizes = sizes
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __call__(self, batch):
+        parts = self.sizes.run(batch, lambda part: self.model(part).logits)
+        return SimpleNamespace(logits=torch.cat(parts, dim=0))
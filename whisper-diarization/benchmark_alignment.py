@@ -0,0 +1,178 @@
+"""
+Compare Whisper's cross-attention word timings (`--alignment whisper`) with
+the wav2vec2 CTC alignment (`--alignment ctc`) on the same transcripts.
+
+For every file, after an untimed warm-up run of each variant, Whisper
+decodes the VAD chunks without and with word timings, alternating, and the
+CTC emissions and alignment run over the transcript; every step is timed
+`--repeats` times and the median is reported. Speed is the extra time each
+way of getting word timings costs on top of plain decoding; accuracy is the
+start/end difference of the words both agree on, taking CTC as the
+reference.
+
+    python benchmark_alignment.py -a audio.wav --whisper-model medium.en
+"""
+
+import argparse
+import difflib
+import json
+import re
+import time
+
+import faster_whisper
+import numpy as np
+import torch
+
+from helpers import process_language_arg
+from pipeline import DiarizationPipeline
+
+
+def normalize(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def compare_words(whisper_words, ctc_words):
+    """Timing differences (ms) of the words matched between both alignments."""
+    a = [normalize(word["text"]) for word in whisper_words]
+    b = [normalize(word["text"]) for word in ctc_words]
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    start_diffs, end_diffs = [], []
+    for i, j, size in matcher.get_matching_blocks():
+        for k in range(size):
+            start_diffs.append(abs(whisper_words[i + k]["start"] - ctc_words[j + k]["start"]))
+            end_diffs.append(abs(whisper_words[i + k]["end"] - ctc_words[j + k]["end"]))
+    if not start_diffs:
+        return {"matched_words": 0}
+    start_diffs = np.array(start_diffs) * 1000
+    end_diffs = np.array(end_diffs) * 1000
+    return {
+        "matched_words": len(start_diffs),
+        "match_ratio": round(len(start_diffs) / max(len(a), len(b)), 3),
+        "start_mean_ms": round(float(start_diffs.mean()), 1),
+        "start_median_ms": round(float(np.median(start_diffs)), 1),
+        "start_p90_ms": round(float(np.percentile(start_diffs, 90)), 1),
+        "end_mean_ms": round(float(end_diffs.mean()), 1),
+        "end_median_ms": round(float(np.median(end_diffs)), 1),
+        **{
+            f"start_within_{ms}ms": round(float((start_diffs <= ms).mean()), 3)
+            for ms in (50, 100, 200)
+        },
+    }
+
+
+def timed_call(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return result, time.perf_counter() - start
+
+
+def median_seconds(samples):
+    return round(float(np.median(samples)), 3)
+
+
+def benchmark_file(pipeline, audio_path, language, repeats=3):
+    waveform = faster_whisper.decode_audio(audio_path)
+    vad_segments = pipeline._detect_speech(waveform)
+
+    def transcribe(word_timestamps):
+        file = {"waveform": waveform, "vad_segments": vad_segments}
+        [transcription] = pipeline._transcribe_files(
+            [file], language, False, word_timestamps=word_timestamps
+        )
+        return transcription
+
+    def align(transcript, file_language):
+        emissions, emissions_seconds = timed_call(pipeline._generate_emissions, waveform)
+        ctc_words, align_seconds = timed_call(
+            pipeline._align, emissions, transcript, file_language
+        )
+        return ctc_words, emissions_seconds, align_seconds
+
+    # warm-up, so model initialization, cuDNN autotuning and the page cache
+    # aren't charged to whichever variant happens to run first
+    transcribe(False)
+    transcript, file_language, _ = transcribe(True)
+    align(transcript, file_language)
+
+    samples = {"whisper": [], "whisper_with_words": [], "emissions": [], "alignment": []}
+    for repeat in range(repeats):
+        # alternate the order, drift over the run hits both variants alike
+        for word_timestamps in (False, True) if repeat % 2 == 0 else (True, False):
+            transcription, seconds = timed_call(transcribe, word_timestamps)
+            samples["whisper_with_words" if word_timestamps else "whisper"].append(seconds)
+            if word_timestamps:
+                transcript, file_language, whisper_words = transcription
+        ctc_words, emissions_seconds, align_seconds = align(transcript, file_language)
+        samples["emissions"].append(emissions_seconds)
+        samples["alignment"].append(align_seconds)
+    seconds = {step: median_seconds(values) for step, values in samples.items()}
+
+    return {
+        "audio": audio_path,
+        "audio_seconds": round(waveform.shape[0] / 16000, 2),
+        "language": file_language,
+        "words": {"whisper": len(whisper_words), "ctc": len(ctc_words)},
+        "repeats": repeats,
+        # medians over the repeats
+        "seconds": seconds,
+        # what word timings cost on top of plain decoding, each way
+        "word_timing_seconds": {
+            "whisper": round(seconds["whisper_with_words"] - seconds["whisper"], 3),
+            "ctc": round(seconds["emissions"] + seconds["alignment"], 3),
+        },
+        "accuracy": compare_words(whisper_words, ctc_words),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-a", "--audio", nargs="+", required=True)
+    parser.add_argument("--whisper-model", dest="model_name", default="medium.en")
+    parser.add_argument("--batch-size", type=int, dest="batch_size", default=8)
+    parser.add_argument("--language", default=None)
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=3, help="timed runs per step, the median is reported"
+    )
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    # no checkpoints, every run computes every stage
+    pipeline = DiarizationPipeline(
+        model_name=args.model_name,
+        device=args.device,
+        batch_size=max(args.batch_size, 1),
+        artifact_dir=None,
+        stem_cache_dir=None,
+    )
+    language = process_language_arg(args.language, args.model_name)
+    # load outside of the timed calls, the load times are reported separately
+    for kind in ("whisper", "alignment", "vad"):
+        pipeline._model(kind)
+
+    results = []
+    for audio_path in args.audio:
+        result = benchmark_file(pipeline, audio_path, language, max(args.repeats, 1))
+        print(json.dumps(result, indent=2))
+        results.append(result)
+
+    summary = {
+        "load_seconds": pipeline.load_timings,
+        "word_timing_seconds": {
+            way: round(sum(r["word_timing_seconds"][way] for r in results), 3)
+            for way in ("whisper", "ctc")
+        },
+        "audio_seconds": round(sum(r["audio_seconds"] for r in results), 2),
+    }
+    print(f"[INFO] Summary: {summary}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"files": results, "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
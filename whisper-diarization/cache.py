@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """SHA-256 of a file's bytes, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(content_hash, **params):
+    """Combine a content hash with the parameters that affect the output."""
+    encoded = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(f"{content_hash}:{encoded}".encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk store of pipeline results.
+
+    Each entry is a JSON document in `<root>/<key[:2]>/<key>.json`. Reads
+    refresh the entry's mtime, and once the store grows beyond `max_bytes`
+    the least recently used entries are evicted.
+
+    The size of the store is kept as a running total, so only a put that
+    takes it over `max_bytes` walks the directory. Other processes may
+    write to the same directory, so every `rescan_every` puts the total is
+    recounted as well.
+    """
+
+    suffix = ".json"
+    rescan_every = 64
+
+    def __init__(self, root="cache/results", max_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # unknown until the first put walks the directory
+        self._total = None
+        self._puts = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}{self.suffix}")
+
+    def _load(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _dump(self, entry, f):
+        f.write(json.dumps(entry).encode("utf-8"))
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            entry = self._load(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry
+
+    def put(self, key, entry):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            self._dump(entry, f)
+            size = f.tell()
+        with self._lock:
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            self._puts += 1
+            if self._total is not None:
+                self._total += size - replaced
+            if (
+                self._total is None
+                or self._total > self.max_bytes
+                or self._puts >= self.rescan_every
+            ):
+                self._evict()
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.root, ignore_errors=True)
+            os.makedirs(self.root, exist_ok=True)
+            self._total = 0
+
+    def _evict(self):
+        """Recount the store and evict down to `max_bytes`, holding `_lock`."""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.endswith(self.suffix):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._total = total
+        self._puts = 0
+
+
+class ArrayCache(ResultCache):
+    """
+    `ResultCache` for numpy arrays, stored as `.npy` files. Entries may also
+    be dicts of arrays, which are stored in `.npz` format.
+    """
+
+    suffix = ".npy"
+
+    def _load(self, path):
+        entry = np.load(path, allow_pickle=False)
+        if isinstance(entry, np.lib.npyio.NpzFile):
+            with entry:
+                return dict(entry)
+        return entry
+
+    def _dump(self, entry, f):
+        if isinstance(entry, dict):
+            np.savez(f, **entry)
+        else:
+            np.save(f, entry, allow_pickle=False)
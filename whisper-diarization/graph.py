@@ -0,0 +1,78 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class StageGraph:
+    """
+    Runs pipeline stages as soon as the stages they depend on are done.
+
+    Each stage is a callable that gets the results of its dependencies as
+    positional arguments, in the order they were listed. Independent
+    branches run concurrently on `executor`; with a single-worker executor
+    the graph simply runs in order. `spans` holds every stage's start and
+    end, from which `critical_path` tells which chain gated the total time.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.stages = {}
+        self.results = {}
+        self.spans = {}
+
+    def add(self, name, fn, deps=()):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+        self.stages[name] = (fn, tuple(deps))
+
+    def _call(self, name, fn, args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.spans[name] = (start, time.perf_counter())
+
+    def run(self):
+        """Run every stage and return their results by name."""
+        pending = dict(self.stages)
+        running = {}
+        error = None
+        while pending or running:
+            if error is None:
+                for name, (fn, deps) in list(pending.items()):
+                    if all(dep in self.results for dep in deps):
+                        args = [self.results[dep] for dep in deps]
+                        running[self.executor.submit(self._call, name, fn, args)] = name
+                        del pending[name]
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    self.results[name] = future.result()
+                except Exception as e:
+                    # let the other branch finish before bailing out, it may
+                    # still be using the job's workspace
+                    error = error or e
+        if error is not None:
+            raise error
+        return self.results
+
+    def critical_path(self):
+        """
+        The chain of stages that ended last, as `[(stage, seconds), ...]`.
+        At every step it follows the dependency that finished last, i.e.
+        the one the stage actually had to wait for.
+        """
+        if not self.spans:
+            return []
+        name = max(self.spans, key=lambda n: self.spans[n][1])
+        path = []
+        while name is not None:
+            start, end = self.spans[name]
+            path.append((name, round(end - start, 3)))
+            deps = [dep for dep in self.stages[name][1] if dep in self.spans]
+            name = max(deps, key=lambda n: self.spans[n][1]) if deps else None
+        return path[::-1]
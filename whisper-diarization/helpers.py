@@ -1,8 +1,13 @@
 import json
 import os
 import shutil
+import tempfile
+import time
+import wave
+from contextlib import contextmanager
 
 import nltk
+import numpy as np
 import wget
 
 from omegaconf import OmegaConf
@@ -249,7 +254,7 @@ langs_to_iso = {
 }
 
 
-def create_config(output_dir):
+def create_config(output_dir, uniq_id="mono_file"):
     DOMAIN_TYPE = "telephonic"
     CONFIG_LOCAL_DIRECTORY = "nemo_msdd_configs"
     CONFIG_FILE_NAME = f"diar_infer_{DOMAIN_TYPE}.yaml"
@@ -265,7 +270,7 @@ def create_config(output_dir):
     os.makedirs(data_dir, exist_ok=True)
 
     meta = {
-        "audio_filepath": os.path.join(output_dir, "mono_file.wav"),
+        "audio_filepath": os.path.join(output_dir, f"{uniq_id}.wav"),
         "offset": 0,
         "duration": None,
         "label": "infer",
@@ -303,6 +308,19 @@ def create_config(output_dir):
     return config
 
 
+def read_speaker_timestamps(rttm_path):
+    """Read an RTTM file into a list of [start_ms, end_ms, speaker_idx]."""
+    speaker_ts = []
+    with open(rttm_path, "r") as f:
+        lines = f.readlines()
+        for line in lines:
+            line_list = line.split(" ")
+            s = int(float(line_list[5]) * 1000)
+            e = s + int(float(line_list[8]) * 1000)
+            speaker_ts.append([s, e, int(line_list[11].split("_")[-1])])
+    return speaker_ts
+
+
 def get_word_ts_anchor(s, e, option="start"):
     if option == "end":
         return e
@@ -311,6 +329,23 @@ def get_word_ts_anchor(s, e, option="start"):
     return s
 
 
+def whisper_word_timestamps(words):
+    """
+    Whisper's `{word, start, end, probability}` words (seconds) as the
+    `{text, start, end, score}` dicts the CTC alignment produces.
+    """
+    return [
+        {
+            "text": word["word"].strip(),
+            "start": round(word["start"], 3),
+            "end": round(word["end"], 3),
+            "score": word["probability"],
+        }
+        for word in words
+        if word["word"].strip()
+    ]
+
+
 def get_words_speaker_mapping(wrd_ts, spk_ts, word_anchor_option="start"):
     s, e, sp = spk_ts[0]
     wrd_pos, turn_idx = 0, 0
@@ -329,7 +364,13 @@ def get_words_speaker_mapping(wrd_ts, spk_ts, word_anchor_option="start"):
             if turn_idx == len(spk_ts) - 1:
                 e = get_word_ts_anchor(ws, we, option="end")
         wrd_spk_mapping.append(
-            {"word": wrd, "start_time": ws, "end_time": we, "speaker": sp}
+            {
+                "word": wrd,
+                "start_time": ws,
+                "end_time": we,
+                "speaker": sp,
+                "score": wrd_dict.get("score"),
+            }
         )
     return wrd_spk_mapping
 
@@ -433,6 +474,7 @@ def get_realigned_ws_mapping_with_punctuation(
 
 
 def get_sentences_speaker_mapping(word_speaker_mapping, spk_ts):
+    """Group words into sentences, also stores each word's sentence index in it."""
     sentence_checker = nltk.tokenize.PunktSentenceTokenizer().text_contains_sentbreak
     s, e, spk = spk_ts[0]
     prev_spk = spk
@@ -454,6 +496,7 @@ def get_sentences_speaker_mapping(word_speaker_mapping, spk_ts):
         else:
             snt["end_time"] = e
         snt["text"] += wrd + " "
+        wrd_dict["sentence"] = len(snts)
         prev_spk = spk
 
     snts.append(snt)
@@ -576,6 +619,17 @@ def filter_missing_timestamps(
     return result
 
 
+def create_job_workspace(root: str = None):
+    """
+    Create an isolated scratch directory for a single pipeline run so that
+    concurrent jobs never share intermediate files. The directory name
+    doubles as the job's NeMo `uniq_id`.
+    """
+    root = root or os.path.join(os.getcwd(), "temp_outputs")
+    os.makedirs(root, exist_ok=True)
+    return tempfile.mkdtemp(prefix="job_", dir=root)
+
+
 def cleanup(path: str):
     """path could either be relative or absolute."""
     # check if file or directory exists
@@ -589,6 +643,26 @@ def cleanup(path: str):
         raise ValueError(f"Path {path} is not a file or dir.")
 
 
+def write_wav(path: str, waveform, sample_rate: int = 16000):
+    """Write a mono float waveform in [-1, 1] as a 16-bit PCM WAV file."""
+    pcm = (np.clip(waveform, -1.0, 1.0) * 32767).astype("<i2")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+@contextmanager
+def timed(timings: dict, key: str):
+    """Store the wall-clock duration of the enclosed block in timings[key]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[key] = round(time.perf_counter() - start, 3)
+
+
 def process_language_arg(language: str, model_name: str):
     """
     Process the language argument to make sure it's valid
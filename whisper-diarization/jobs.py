@@ -0,0 +1,271 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Future
+
+
+class QueueFullError(RuntimeError):
+    """Raised by `JobQueue.submit` when no more jobs can be accepted."""
+
+    def __init__(self, retry_after):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+def gather(futures):
+    """Return a `Future` of the results of `futures`, in order."""
+    futures = list(futures)
+    gathered = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            gathered.set_result([future.result() for future in futures])
+        except Exception as e:
+            gathered.set_exception(e)
+
+    if not futures:
+        gathered.set_result([])
+    for future in futures:
+        future.add_done_callback(on_done)
+    return gathered
+
+
+class Job:
+    def __init__(self, params, cost=0):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.cost = cost
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.events = []
+        self._events_changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    @property
+    def queue_wait(self):
+        """Seconds the job spent queued before a worker picked it up."""
+        if self.started_at is None:
+            return None
+        return round(self.started_at - self.submitted_at, 3)
+
+    def publish(self, event, status=None):
+        """
+        Record a progress event and wake up any `follow` iterators. A new
+        `status` is applied together with the event so followers never see
+        a finished job without its final event.
+        """
+        with self._events_changed:
+            if status is not None:
+                self.status = status
+            self.events.append({**event, "time": time.time()})
+            self._events_changed.notify_all()
+
+    def follow(self, timeout=15):
+        """
+        Yield the job's events from the beginning, blocking for new ones until
+        the job has finished. Yields None every `timeout` seconds without
+        news so callers can send keep-alives.
+        """
+        index = 0
+        while True:
+            with self._events_changed:
+                if index == len(self.events) and not self.finished:
+                    self._events_changed.wait(timeout)
+                new_events = self.events[index:]
+                finished = self.finished
+            index += len(new_events)
+            if not new_events and not finished:
+                yield None
+            yield from new_events
+            if finished and index == len(self.events):
+                return
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queue_wait": self.queue_wait,
+        }
+
+
+class JobQueue:
+    """
+    Bounded job queue drained by a fixed pool of worker threads.
+
+    Jobs are scheduled shortest-first by their expected `cost` (e.g. audio
+    seconds), so short uploads don't wait behind a long dictation. To keep
+    long jobs from starving, every second spent waiting lowers a job's
+    priority by `aging_rate` cost units.
+
+    Every thread creates its own context with `worker_factory` (e.g. a
+    `DiarizationWorker` process) and calls `handler(job, context)` for each
+    job it pulls, storing the return value as the job result. A handler may
+    instead return a `Future` to finish the job elsewhere (e.g. on the
+    summarization pool) and free the thread right away. Finished jobs are
+    kept for `job_ttl` seconds so clients can poll them.
+    """
+
+    def __init__(
+        self,
+        handler,
+        worker_factory=None,
+        num_workers=1,
+        max_queue_size=8,
+        job_ttl=3600,
+        aging_rate=1.0,
+    ):
+        self.handler = handler
+        self.worker_factory = worker_factory
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self.job_ttl = job_ttl
+        self.aging_rate = aging_rate
+        # (priority, sequence, job); aging is linear and the same for every
+        # job, so `cost + aging_rate * submitted_at` orders the heap the same
+        # way `cost - aging_rate * waited` would at any point in time
+        self._queue = []
+        self._sequence = itertools.count()
+        self._queue_changed = threading.Condition()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._avg_job_seconds = None
+        self._in_flight = 0
+        self._threads = [
+            threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, cost=0, **params):
+        """
+        Queue a job with expected `cost` and return it; raises
+        `QueueFullError` when saturated.
+        """
+        self._prune()
+        job = Job(params, cost=cost)
+        with self._queue_changed:
+            if len(self._queue) >= self.max_queue_size:
+                raise QueueFullError(self.retry_after())
+            with self._lock:
+                self._jobs[job.id] = job
+            priority = cost + self.aging_rate * job.submitted_at
+            heapq.heappush(self._queue, (priority, next(self._sequence), job))
+            self._queue_changed.notify()
+        return job
+
+    def track(self, future, result=None, **params):
+        """
+        Register a job that runs outside the queue and completes with
+        `future`. `result` is exposed as the partial result until then.
+        """
+        self._prune()
+        job = Job(params)
+        job.started_at = job.submitted_at
+        job.result = result
+        job.status = "running"
+        with self._lock:
+            self._jobs[job.id] = job
+            self._in_flight += 1
+        future.add_done_callback(lambda f: self._complete(job, f))
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    @property
+    def in_flight(self):
+        """Jobs that have started but not finished yet."""
+        return self._in_flight
+
+    def retry_after(self):
+        """Rough number of seconds until a queue slot frees up."""
+        if self._avg_job_seconds is None:
+            return 30
+        return max(1, math.ceil(self._avg_job_seconds / self.num_workers))
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        with self._lock:
+            for job_id in [
+                job_id
+                for job_id, job in self._jobs.items()
+                if job.finished and job.finished_at < cutoff
+            ]:
+                del self._jobs[job_id]
+
+    def _run(self):
+        context = self.worker_factory() if self.worker_factory else None
+        while True:
+            with self._queue_changed:
+                while not self._queue:
+                    self._queue_changed.wait()
+                _, _, job = heapq.heappop(self._queue)
+            job.started_at = time.time()
+            with self._lock:
+                self._in_flight += 1
+            job.publish(
+                {"stage": "job", "status": "running", "queue_wait": job.queue_wait},
+                status="running",
+            )
+            try:
+                result = self.handler(job, context)
+                if isinstance(result, Future):
+                    result.add_done_callback(lambda f, job=job: self._complete(job, f))
+                else:
+                    self._finish(job, result)
+            except Exception as e:
+                traceback.print_exc()
+                self._finish(job, error=e)
+            finally:
+                duration = time.time() - job.started_at
+                self._avg_job_seconds = (
+                    duration
+                    if self._avg_job_seconds is None
+                    else 0.8 * self._avg_job_seconds + 0.2 * duration
+                )
+
+    def _complete(self, job, future):
+        try:
+            self._finish(job, future.result())
+        except Exception as e:
+            traceback.print_exc()
+            self._finish(job, error=e)
+
+    def _finish(self, job, result=None, error=None):
+        job.finished_at = time.time()
+        with self._lock:
+            self._in_flight -= 1
+        if error is None:
+            job.result = result
+            job.publish({"stage": "job", "status": "done", "result": result}, status="done")
+        else:
+            job.error = {"message": str(error), "details": getattr(error, "details", None)}
+            job.publish({"stage": "job", "status": "failed", "error": job.error}, status="failed")
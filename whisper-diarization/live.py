@@ -0,0 +1,162 @@
+import numpy as np
+
+from helpers import find_numeral_symbol_tokens, write_wav
+from longform import SpeakerLinker
+
+SAMPLE_RATE = 16000
+
+
+class LiveSession:
+    """
+    Incremental transcription of a recording that is still going on.
+
+    Audio arrives as 16 kHz mono PCM16 bytes. Every `step_seconds` of new
+    audio, VAD runs over the audio after the last finished speech region.
+    Regions followed by `min_silence` seconds of silence (or cut at 30 s by
+    the VAD merge) are finished: Whisper transcribes them and `SpeakerLinker`
+    gives each one a provisional speaker from its embedding.
+
+    `finish` runs alignment, MSDD and punctuation over the whole recording
+    with the transcript and VAD segments collected so far, so only those
+    stages are left once the recording stops.
+    """
+
+    def __init__(
+        self,
+        pipeline,
+        language=None,
+        suppress_numerals=False,
+        step_seconds=2.0,
+        min_silence=0.6,
+    ):
+        self.pipeline = pipeline
+        self.language = language
+        self.suppress_tokens = (
+            find_numeral_symbol_tokens(pipeline.whisper_model.hf_tokenizer)
+            if suppress_numerals
+            else [-1]
+        )
+        self.step = int(step_seconds * SAMPLE_RATE)
+        self.min_silence = min_silence
+        self.audio = np.zeros(60 * SAMPLE_RATE, dtype=np.float32)
+        self.samples = 0
+        # audio before this belongs to finished regions
+        self.processed_until = 0
+        self.last_step = 0
+        self.segments = []
+        self.vad_segments = []
+        self.linker = SpeakerLinker()
+        self.last_speaker = None
+
+    def add_audio(self, pcm):
+        """Append PCM16 audio, returns the segments that got finished."""
+        chunk = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768
+        if self.samples + chunk.shape[0] > self.audio.shape[0]:
+            # grow geometrically, a visit can last an hour
+            grown = np.zeros(
+                max(2 * self.audio.shape[0], self.samples + chunk.shape[0]),
+                dtype=np.float32,
+            )
+            grown[: self.samples] = self.audio[: self.samples]
+            self.audio = grown
+        self.audio[self.samples : self.samples + chunk.shape[0]] = chunk
+        self.samples += chunk.shape[0]
+
+        if self.samples - self.last_step < self.step:
+            return []
+        self.last_step = self.samples
+        return self._process(final=False)
+
+    def _process(self, final):
+        offset = self.processed_until
+        tail = self.audio[offset : self.samples]
+        if tail.shape[0] < SAMPLE_RATE // 2:
+            return []
+        tail_seconds = tail.shape[0] / SAMPLE_RATE
+        regions = self.pipeline._detect_speech(tail)
+
+        finished = []
+        for index, region in enumerate(regions):
+            is_open = (
+                index == len(regions) - 1
+                and region["end"] > tail_seconds - self.min_silence
+            )
+            if is_open and not final:
+                break
+            finished.append(self._finish_region(region, tail, offset / SAMPLE_RATE))
+            self.processed_until = offset + int(region["end"] * SAMPLE_RATE)
+        else:
+            # nothing is being said, don't run VAD over this silence again
+            self.processed_until = max(
+                self.processed_until,
+                self.samples - int(self.min_silence * SAMPLE_RATE),
+            )
+        return finished
+
+    def _finish_region(self, region, tail, offset):
+        audio = tail[int(region["start"] * SAMPLE_RATE) : int(region["end"] * SAMPLE_RATE)]
+        segments, info = self.pipeline.whisper_model.transcribe(
+            audio,
+            self.language,
+            suppress_tokens=self.suppress_tokens,
+            vad_filter=False,
+            condition_on_previous_text=False,
+            # the end of the previous region as context
+            initial_prompt=self.segments[-1]["text"] if self.segments else None,
+        )
+        text = "".join(segment.text for segment in segments).strip()
+        if self.language is None:
+            self.language = info.language
+
+        [(_, embedding)] = self.pipeline._speaker_embeddings(
+            audio, [[0, audio.shape[0] * 1000 // SAMPLE_RATE, 0]]
+        )
+        if embedding is not None:
+            speaker = self.linker.link({0: np.array(embedding)}, [])[0]
+        elif self.last_speaker is not None:
+            speaker = self.last_speaker
+        else:
+            speaker = self.linker.link({0: None}, [])[0]
+        self.last_speaker = speaker
+
+        self.vad_segments.append(
+            {
+                "start": offset + region["start"],
+                "end": offset + region["end"],
+                "segments": [
+                    [offset + start, offset + end] for start, end in region["segments"]
+                ],
+            }
+        )
+        segment = {
+            "start": round(offset + region["start"], 2),
+            "end": round(offset + region["end"], 2),
+            "speaker": f"Speaker {speaker}",
+            "text": text,
+        }
+        self.segments.append(segment)
+        return segment
+
+    def finish(self, audio_path, progress=None, word_anchor="start"):
+        """
+        Transcribe what is left, write the recording to `audio_path` and
+        refine the speakers with the full pipeline. Returns the remaining
+        segments and the result of `DiarizationPipeline.diarize_transcribed`.
+        """
+        remaining = self._process(final=True)
+        transcript = " ".join(segment["text"] for segment in self.segments if segment["text"])
+        if not transcript:
+            raise ValueError("No speech was recorded")
+
+        audio = self.audio[: self.samples]
+        write_wav(audio_path, audio, SAMPLE_RATE)
+        result = self.pipeline.diarize_transcribed(
+            audio_path,
+            audio,
+            transcript,
+            self.language,
+            vad_segments=self.vad_segments,
+            progress=progress,
+            word_anchor=word_anchor,
+        )
+        return remaining, result
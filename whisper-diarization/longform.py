@@ -0,0 +1,168 @@
+import av
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+def decode_stream(audio_path):
+    """Decode `audio_path` as a stream of 16 kHz mono float32 chunks."""
+    resampler = av.audio.resampler.AudioResampler(
+        format="flt", layout="mono", rate=SAMPLE_RATE
+    )
+    with av.open(audio_path, metadata_errors="ignore") as container:
+        for frame in container.decode(audio=0):
+            for resampled in resampler.resample(frame):
+                yield resampled.to_ndarray()[0]
+        for resampled in resampler.resample(None):
+            yield resampled.to_ndarray()[0]
+
+
+def iter_windows(chunks, window_seconds, overlap_seconds):
+    """
+    Cut a stream of 16 kHz chunks into windows of `window_seconds` that
+    overlap by `overlap_seconds`. Yields `(start_seconds, waveform, is_last)`;
+    at most the current window, the next one and one chunk are held at once.
+    """
+    window = int(window_seconds * SAMPLE_RATE)
+    hop = window - int(overlap_seconds * SAMPLE_RATE)
+    # chunks are copied once, into the window being filled
+    buffer = np.zeros(window, dtype=np.float32)
+    filled = 0
+    start = 0
+    pending = None
+    for chunk in chunks:
+        while chunk.shape[0]:
+            taken = min(window - filled, chunk.shape[0])
+            buffer[filled : filled + taken] = chunk[:taken]
+            filled += taken
+            chunk = chunk[taken:]
+            if filled < window:
+                break
+            if pending is not None:
+                yield pending[0] / SAMPLE_RATE, pending[1], False
+            pending = (start, buffer)
+            # the next window starts with this one's overlap
+            buffer = np.zeros(window, dtype=np.float32)
+            filled = window - hop
+            buffer[:filled] = pending[1][hop:]
+            start += hop
+    buffer = buffer[:filled]
+    # what is left after the last full window is its overlap, unless
+    # there was no full window at all or the recording goes on past it
+    if pending is not None and buffer.shape[0] <= window - hop:
+        yield pending[0] / SAMPLE_RATE, pending[1], True
+        return
+    if pending is not None:
+        yield pending[0] / SAMPLE_RATE, pending[1], False
+    if buffer.shape[0]:
+        yield start / SAMPLE_RATE, buffer, True
+
+
+def owned_range(start, duration, overlap_seconds, is_first, is_last):
+    """
+    The part of a window whose words and speaker turns it keeps, in absolute
+    seconds. Neighbouring windows split their overlap in the middle, where
+    both had the most context.
+    """
+    half = overlap_seconds / 2
+    own_start = start if is_first else start + half
+    own_end = float("inf") if is_last else start + duration - half
+    return own_start, own_end
+
+
+def merge_turns(turns):
+    """Join consecutive `[start_ms, end_ms, speaker]` turns of the same speaker."""
+    merged = []
+    for start, end, speaker in sorted(turns):
+        if merged and merged[-1][2] == speaker and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end, speaker])
+    return merged
+
+
+def to_rttm(speaker_ts, uniq_id):
+    """Render `[start_ms, end_ms, speaker]` turns in NeMo's RTTM layout."""
+    return "".join(
+        f"SPEAKER {uniq_id} 1   {start / 1000:.3f}   {(end - start) / 1000:.3f} "
+        f"<NA> <NA> speaker_{speaker} <NA> <NA>\n"
+        for start, end, speaker in speaker_ts
+    )
+
+
+class SpeakerLinker:
+    """
+    Maps the speakers MSDD finds independently in each window onto labels
+    that are consistent across the recording.
+
+    Every global speaker keeps the running mean of its (unit) embeddings.
+    A window's speakers are matched to them greedily, most similar pair
+    first, and a match needs a cosine similarity of at least `threshold`;
+    the others become new speakers. Speakers with too little audio for an
+    embedding go to whichever global speaker they overlap most with in the
+    region shared with the previous window.
+    """
+
+    def __init__(self, threshold=0.6):
+        self.threshold = threshold
+        self.sums = []
+        self.previous_turns = []
+
+    def _new_speaker(self):
+        self.sums.append(None)
+        return len(self.sums) - 1
+
+    def link(self, embeddings, local_turns):
+        """
+        `embeddings` maps each local speaker to its embedding or None and
+        `local_turns` are the window's turns in absolute ms. Returns the
+        local to global speaker mapping.
+        """
+        mapping = {}
+        vectors = {
+            local: embedding / np.linalg.norm(embedding)
+            for local, embedding in embeddings.items()
+            if embedding is not None
+        }
+        pairs = sorted(
+            (
+                (float(vector @ total) / np.linalg.norm(total), local, speaker)
+                for local, vector in vectors.items()
+                for speaker, total in enumerate(self.sums)
+                if total is not None
+            ),
+            reverse=True,
+        )
+        for similarity, local, speaker in pairs:
+            if similarity < self.threshold:
+                break
+            if local in mapping or speaker in mapping.values():
+                continue
+            mapping[local] = speaker
+
+        for local in embeddings:
+            if local in mapping:
+                continue
+            speaker = None
+            if local not in vectors:
+                speaker = self._overlapping_speaker(local, local_turns)
+            mapping[local] = speaker if speaker is not None else self._new_speaker()
+
+        for local, vector in vectors.items():
+            total = self.sums[mapping[local]]
+            self.sums[mapping[local]] = vector if total is None else total + vector
+        self.previous_turns = [
+            [start, end, mapping[local]] for start, end, local in local_turns
+        ]
+        return mapping
+
+    def _overlapping_speaker(self, local, local_turns):
+        overlap = {}
+        for start, end, speaker in local_turns:
+            if speaker != local:
+                continue
+            for prev_start, prev_end, prev_speaker in self.previous_turns:
+                shared = min(end, prev_end) - max(start, prev_start)
+                if shared > 0:
+                    overlap[prev_speaker] = overlap.get(prev_speaker, 0) + shared
+        return max(overlap, key=overlap.get) if overlap else None
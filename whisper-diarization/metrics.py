@@ -0,0 +1,250 @@
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        for value in labels.values()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in self._samples():
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing value, e.g. requests or seconds processed."""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only be incremented")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down. Use `set_function` for values that are
+    cheaper to read at scrape time than to keep up to date.
+    """
+
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            return [({}, self._function())]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative `le` buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for labels, (counts, total) in self._samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = _format_labels({**labels, "le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+    def _samples(self):
+        with self._lock:
+            return [
+                (dict(zip(self.labelnames, key)), (list(counts), total))
+                for key, (counts, total) in self._values.items()
+            ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"Duplicate metric {metric.name}")
+            self._metrics.append(metric)
+
+    def generate_latest(self):
+        """Render every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = Histogram(
+    "diarization_stage_seconds",
+    "Time spent in each pipeline stage.",
+    ["stage"],
+)
+JOB_SECONDS = Histogram(
+    "diarization_job_seconds",
+    "End-to-end pipeline time per file.",
+)
+AUDIO_SECONDS = Counter(
+    "diarization_audio_seconds_total",
+    "Seconds of audio run through the pipeline.",
+)
+REAL_TIME_FACTOR = Histogram(
+    "diarization_real_time_factor",
+    "Pipeline time divided by audio duration per file.",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5),
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "diarization_model_load_seconds",
+    "Load time of each model in the most recently started worker.",
+    ["model"],
+)
+MODEL_CACHE_LOOKUPS = Gauge(
+    "diarization_model_cache_lookups",
+    "Model registry hits, misses and evictions in the most recent worker.",
+    ["model", "result"],
+)
+MODEL_CACHE_RESIDENT_BYTES = Gauge(
+    "diarization_model_cache_resident_bytes",
+    "Estimated memory held by cached models, by pool (ram or vram).",
+    ["pool"],
+)
+QUEUE_DEPTH = Gauge(
+    "diarization_queue_depth",
+    "Jobs waiting for a diarization worker.",
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "diarization_queue_wait_seconds",
+    "Time jobs spent queued before a worker picked them up.",
+)
+JOBS_IN_FLIGHT = Gauge(
+    "diarization_jobs_in_flight",
+    "Jobs that have started but not finished, including their summaries.",
+)
+STEMMING_DECISIONS = Counter(
+    "diarization_stemming_decisions_total",
+    "Stemming decisions by mode, outcome and reason.",
+    ["mode", "separated", "reason"],
+)
+OZWELL_REQUEST_SECONDS = Histogram(
+    "ozwell_request_seconds",
+    "Latency of Ozwell API calls, including retries.",
+    ["path"],
+)
+OZWELL_ERRORS = Counter(
+    "ozwell_errors_total",
+    "Failed Ozwell API attempts by reason.",
+    ["path", "reason"],
+)
+
+
+def observe_pipeline_result(result):
+    """Record the stage timings, audio duration and RTF of a pipeline result."""
+    timings = dict(result["timings"])
+    total = timings.pop("total", None)
+    # time shared with the other files of a batch, not a stage
+    timings.pop("batch_total", None)
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    if total is not None:
+        JOB_SECONDS.observe(total)
+
+    stemming = result.get("stemming")
+    if stemming:
+        STEMMING_DECISIONS.inc(
+            mode=stemming["mode"],
+            separated=stemming["separated"],
+            reason=stemming.get("reason", ""),
+        )
+
+    model_cache = result.get("model_cache")
+    if model_cache:
+        for model, stats in model_cache["models"].items():
+            for name in ("hits", "misses", "evictions"):
+                MODEL_CACHE_LOOKUPS.set(stats[name], model=model, result=name)
+        for pool, size in model_cache["resident_bytes"].items():
+            MODEL_CACHE_RESIDENT_BYTES.set(size, pool=pool)
+
+    audio_seconds = result.get("audio_seconds")
+    if audio_seconds:
+        AUDIO_SECONDS.inc(audio_seconds)
+        if total is not None:
+            REAL_TIME_FACTOR.observe(total / audio_seconds)
@@ -0,0 +1,255 @@
+import collections
+import itertools
+import os
+import threading
+import time
+
+import torch
+from ctc_forced_aligner import load_alignment_model
+from deepmultilingualpunctuation import PunctuationModel
+from nemo.collections.asr.models import EncDecSpeakerLabelModel
+from nemo.collections.asr.models.msdd_models import NeuralDiarizer
+
+from helpers import cleanup, create_config, create_job_workspace
+from separation import VocalSeparator
+from whisperx.asr import WhisperModel
+from whisperx.vads.pyannote import Pyannote
+
+mtypes = {"cpu": "int8", "cuda": "float16"}
+# loader arguments that are never logged
+SECRET_PARAMS = {"hf_token"}
+VAD_ONSET = 0.5
+VAD_OFFSET = 0.363
+
+
+def load_whisper(model_name, device):
+    # whisperx's subclass adds the batched decoding the pipeline runs
+    return WhisperModel(model_name, device=device, compute_type=mtypes[device])
+
+
+def load_alignment(device):
+    return load_alignment_model(
+        device, dtype=torch.float16 if device == "cuda" else torch.float32
+    )
+
+
+def load_vad(device, hf_token=None):
+    return Pyannote(
+        device=device,
+        use_auth_token=hf_token,
+        vad_onset=VAD_ONSET,
+        vad_offset=VAD_OFFSET,
+    )
+
+
+def load_msdd(device):
+    # out_dir and manifest are pointed at each job's workspace before use
+    config_dir = create_job_workspace()
+    try:
+        return NeuralDiarizer(cfg=create_config(config_dir)).to(device)
+    finally:
+        cleanup(config_dir)
+
+
+def load_speaker_embedding(device, model_name="titanet_large"):
+    # the same speaker model MSDD clusters with, see `create_config`
+    return EncDecSpeakerLabelModel.from_pretrained(model_name, map_location=device).eval()
+
+
+def load_punctuation(model_name):
+    return PunctuationModel(model=model_name)
+
+
+def load_demucs(device, model_name="htdemucs"):
+    return VocalSeparator(device, model_name=model_name)
+
+
+LOADERS = {
+    "whisper": load_whisper,
+    "alignment": load_alignment,
+    "vad": load_vad,
+    "msdd": load_msdd,
+    "speaker_embedding": load_speaker_embedding,
+    "punctuation": load_punctuation,
+    "demucs": load_demucs,
+}
+
+
+def _module_bytes(model, depth=3, seen=None):
+    """Bytes of the torch parameters and buffers reachable from `model`."""
+    seen = set() if seen is None else seen
+    if id(model) in seen or depth < 0:
+        return 0
+    seen.add(id(model))
+    if isinstance(model, torch.nn.Module):
+        return sum(
+            t.numel() * t.element_size()
+            for t in itertools.chain(model.parameters(), model.buffers())
+        )
+    if isinstance(model, (tuple, list)):
+        children = model
+    else:
+        children = getattr(model, "__dict__", {}).values()
+    return sum(_module_bytes(child, depth - 1, seen) for child in children)
+
+
+def _memory_in_use(pool):
+    """Current VRAM or resident RAM use of the process, None if unknown."""
+    if pool == "vram":
+        free, total = torch.cuda.mem_get_info()
+        return total - free
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _loggable(params):
+    return {
+        name: "<redacted>" if name in SECRET_PARAMS and value else value
+        for name, value in params.items()
+    }
+
+
+def _env_bytes(name):
+    value = os.getenv(name)
+    return int(value) * 1024 * 1024 if value else None
+
+
+class ModelRegistry:
+    """
+    Loads models on first use and shares them between pipelines.
+
+    A model is identified by its kind (see `LOADERS`) and the arguments of
+    its loader, so pipelines asking for the same Whisper size on the same
+    device get the same instance. Each model also gets a lock for callers
+    whose use of it isn't thread-safe (e.g. MSDD, which is reconfigured for
+    every job).
+
+    Models on CUDA count against `max_vram_bytes`, the others against
+    `max_ram_bytes`. A model's size is the memory the process gained while
+    loading it (at least its torch parameters, since CTranslate2 Whisper
+    has none). When a load goes over budget, the least recently used models
+    in that pool are evicted. `stats()` reports hits, misses, evictions and
+    load times.
+    """
+
+    def __init__(self, max_ram_bytes=None, max_vram_bytes=None):
+        self.budgets = {"ram": max_ram_bytes, "vram": max_vram_bytes}
+        # key -> model, least recently used first
+        self._models = collections.OrderedDict()
+        self._sizes = {}
+        self._locks = {}
+        self._load_locks = {}
+        self._load_timings = {}
+        self._stats = collections.defaultdict(
+            lambda: {"hits": 0, "misses": 0, "evictions": 0, "load_seconds": 0.0}
+        )
+        self._lock = threading.Lock()
+
+    def _key(self, kind, params):
+        return kind, tuple(sorted(params.items()))
+
+    def _pool(self, key):
+        return "vram" if dict(key[1]).get("device") == "cuda" else "ram"
+
+    def lock(self, kind, **params):
+        """Lock to hold while using a model that isn't thread-safe."""
+        key = self._key(kind, params)
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, kind, **params):
+        key = self._key(kind, params)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self._stats[kind]["hits"] += 1
+                return self._models[key]
+        # one lock per model, so loading Whisper doesn't block a cached MSDD
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                if key in self._models:
+                    self._stats[kind]["hits"] += 1
+                    return self._models[key]
+            return self._load(key, kind, params)
+
+    def _load(self, key, kind, params):
+        pool = self._pool(key)
+        before = _memory_in_use(pool)
+        start = time.perf_counter()
+        model = LOADERS[kind](**params)
+        seconds = round(time.perf_counter() - start, 3)
+        after = _memory_in_use(pool)
+        size = _module_bytes(model)
+        if before is not None and after is not None:
+            size = max(size, after - before)
+
+        with self._lock:
+            self._models[key] = model
+            self._sizes[key] = size
+            self._load_timings[key] = seconds
+            self._stats[kind]["misses"] += 1
+            self._stats[kind]["load_seconds"] += seconds
+            evicted = self._evict(pool, keep=key)
+        print(
+            f"[INFO] Loaded {kind} {_loggable(params)} in {seconds}s, "
+            f"~{size / 2**20:.0f} MB {pool}"
+            + (f", evicted {[k for k, _ in evicted]}" if evicted else "")
+        )
+        if evicted and pool == "vram":
+            torch.cuda.empty_cache()
+        return model
+
+    def _evict(self, pool, keep):
+        budget = self.budgets[pool]
+        if budget is None:
+            return []
+        evicted = []
+        in_pool = [key for key in self._models if self._pool(key) == pool]
+        used = sum(self._sizes[key] for key in in_pool)
+        for key in in_pool:
+            if used <= budget:
+                break
+            if key == keep:
+                continue
+            self._models.pop(key)
+            used -= self._sizes.pop(key)
+            self._load_timings.pop(key, None)
+            self._stats[key[0]]["evictions"] += 1
+            evicted.append(key)
+        return evicted
+
+    def load_time(self, kind, **params):
+        """Seconds it took to load the model, None if it isn't loaded."""
+        return self._load_timings.get(self._key(kind, params))
+
+    def unload(self, kind, **params):
+        key = self._key(kind, params)
+        with self._lock:
+            self._models.pop(key, None)
+            self._sizes.pop(key, None)
+            self._load_timings.pop(key, None)
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def stats(self):
+        """Per-kind cache statistics and the bytes resident in each pool."""
+        with self._lock:
+            resident = {"ram": 0, "vram": 0}
+            for key, size in self._sizes.items():
+                resident[self._pool(key)] += size
+            return {
+                "models": {kind: dict(stats) for kind, stats in self._stats.items()},
+                "resident_bytes": resident,
+                "budget_bytes": dict(self.budgets),
+            }
+
+
+default_registry = ModelRegistry(
+    max_ram_bytes=_env_bytes("MODEL_CACHE_RAM_MB"),
+    max_vram_bytes=_env_bytes("MODEL_CACHE_VRAM_MB"),
+)
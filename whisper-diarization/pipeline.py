@@ -0,0 +1,1503 @@
+import collections
+import inspect
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import faster_whisper
+import numpy as np
+import torch
+from ctc_forced_aligner import (
+    generate_emissions,
+    get_alignments,
+    get_spans,
+    postprocess_results,
+    preprocess_text,
+)
+from faster_whisper.tokenizer import Tokenizer
+
+from batching import AdaptiveForward, BatchSizer, is_oom
+from cache import ArrayCache, ResultCache, hash_file, make_cache_key
+from graph import StageGraph
+from helpers import (
+    cleanup,
+    create_job_workspace,
+    find_numeral_symbol_tokens,
+    get_realigned_ws_mapping_with_punctuation,
+    get_sentences_speaker_mapping,
+    get_speaker_aware_transcript,
+    get_words_speaker_mapping,
+    langs_to_iso,
+    process_language_arg,
+    punct_model_langs,
+    read_speaker_timestamps,
+    timed,
+    whisper_word_timestamps,
+    write_srt,
+    write_wav,
+)
+from longform import (
+    SpeakerLinker,
+    decode_stream,
+    iter_windows,
+    merge_turns,
+    owned_range,
+    to_rttm,
+)
+from models import VAD_OFFSET, VAD_ONSET, ModelRegistry, default_registry
+from probe import probe_duration
+from result import DiarizationResult
+from separation import detect_background
+from whisperx.asr import (
+    detect_chunk_language,
+    get_transcription_options,
+    transcribe_batches,
+)
+from whisperx.audio import SAMPLE_RATE
+from whisperx.vads.pyannote import Pyannote
+
+
+@contextmanager
+def run_stage(timings, name, progress=None):
+    """Time a pipeline stage and report its start and end to `progress`."""
+    if progress is not None:
+        progress({"stage": name, "status": "started"})
+    with timed(timings, name):
+        yield
+    if progress is not None:
+        progress({"stage": name, "status": "finished", "seconds": timings[name]})
+
+
+class DiarizationPipeline:
+    """
+    Whisper + NeMo speaker diarization with every model kept resident.
+
+    Models come from a `ModelRegistry` (the process-wide `default_registry`
+    unless one is given). They are loaded on first use, or all at once with
+    `load_models`, and shared with every other pipeline using the same
+    registry, so each call to `diarize` only pays for inference.
+    `load_timings` holds the per-model load cost and every job reports its
+    own per-stage timings and the registry's cache statistics.
+
+    Stages run as a `StageGraph`. With `parallel_stages` the transcription
+    branch (Whisper, alignment) and the speaker branch (MSDD) run at the
+    same time after VAD, whose chunks batched Whisper decodes, which needs
+    enough VRAM to run both models at once.
+
+    `alignment` is the default of `diarize`'s option of the same name; with
+    "whisper", `load_models` leaves the CTC alignment model out.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "medium.en",
+        device: str = None,
+        batch_size: int = 8,
+        hf_token: str = None,
+        parallel_stages: bool = False,
+        stem_cache_dir: str = os.path.join("cache", "stems"),
+        stem_cache_max_bytes: int = 2 * 1024 * 1024 * 1024,
+        punct_model_name: str = "kredor/punctuate-all",
+        artifact_dir: str = os.path.join("cache", "artifacts"),
+        artifact_max_bytes: int = 2 * 1024 * 1024 * 1024,
+        registry: ModelRegistry = None,
+        max_batch_size: int = 64,
+        batch_state_path: str = os.path.join("cache", "batch_sizes.json"),
+        alignment: str = "ctc",
+    ):
+        self.model_name = model_name
+        self.punct_model_name = punct_model_name
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.batch_size = batch_size
+        self.alignment = alignment
+        # `batch_size` is where Whisper and the CTC emissions start out,
+        # see `BatchSizer`; 0 still means unbatched Whisper
+        self.batch_sizer = BatchSizer(
+            batch_state_path,
+            initial=max(batch_size, 1),
+            maximum=max(max_batch_size, batch_size),
+        )
+        self.stage_executor = ThreadPoolExecutor(
+            max_workers=2 if parallel_stages else 1, thread_name_prefix="stage"
+        )
+        self.jobs_processed = 0
+        # stage checkpoints, see `_diarize_transcript`
+        self.artifacts = self.array_artifacts = None
+        if artifact_dir:
+            self.artifacts = ResultCache(
+                os.path.join(artifact_dir, "json"), max_bytes=artifact_max_bytes // 2
+            )
+            self.array_artifacts = ArrayCache(
+                os.path.join(artifact_dir, "arrays"), max_bytes=artifact_max_bytes // 2
+            )
+
+        self.stem_cache = (
+            ArrayCache(stem_cache_dir, max_bytes=stem_cache_max_bytes)
+            if stem_cache_dir
+            else None
+        )
+
+        self.registry = registry if registry is not None else default_registry
+        self.model_params = {
+            "whisper": {"model_name": model_name, "device": self.device},
+            "demucs": {"device": self.device},
+            "alignment": {"device": self.device},
+            "vad": {"device": self.device, "hf_token": hf_token},
+            "msdd": {"device": self.device},
+            "speaker_embedding": {"device": self.device},
+            "punctuation": {"model_name": punct_model_name},
+        }
+
+    def _model(self, kind):
+        return self.registry.get(kind, **self.model_params[kind])
+
+    def _batch_sizes(self, kind):
+        return self.batch_sizer.get(kind, **self.model_params[kind])
+
+    @property
+    def whisper_model(self):
+        return self._model("whisper")
+
+    @property
+    def separator(self):
+        return self._model("demucs")
+
+    @property
+    def alignment_model(self):
+        return self._model("alignment")[0]
+
+    @property
+    def alignment_tokenizer(self):
+        return self._model("alignment")[1]
+
+    @property
+    def vad_pipeline(self):
+        return self._model("vad")
+
+    @property
+    def msdd_model(self):
+        return self._model("msdd")
+
+    @property
+    def speaker_model(self):
+        return self._model("speaker_embedding")
+
+    @property
+    def punct_model(self):
+        return self._model("punctuation")
+
+    def load_models(self):
+        """Load every model now instead of on first use, e.g. to warm up a worker."""
+        for kind in self.model_params:
+            if kind == "alignment" and self.alignment == "whisper":
+                # only needed for `diarize_transcribed` then, loaded on first use
+                continue
+            self._model(kind)
+        return self.load_timings
+
+    @property
+    def load_timings(self):
+        """Load time of each of this pipeline's models that is loaded."""
+        timings = {}
+        for kind, params in self.model_params.items():
+            seconds = self.registry.load_time(kind, **params)
+            if seconds is not None:
+                timings[kind] = seconds
+        timings["total"] = round(sum(timings.values()), 3)
+        return timings
+
+    def diarize(
+        self,
+        audio_path: str,
+        stemming=True,
+        suppress_numerals: bool = False,
+        language: str = None,
+        progress=None,
+        word_anchor: str = "start",
+        window_seconds: float = None,
+        overlap_seconds: float = 30,
+        alignment: str = None,
+    ) -> dict:
+        """
+        Diarize `audio_path` and write `<audio>.txt` and `<audio>.srt` next to it.
+
+        Returns a `DiarizationResult` with the transcript and SRT text and
+        paths, the detected language, the words (with timings, alignment
+        score, speaker and sentence index) and sentences, the speaker turns,
+        the RTTM, the per-stage timings of this job and its critical path.
+        `cold_start` is True for the first job served by this pipeline
+        instance. If given, `progress` is called with a dict for every stage
+        start/end and Whisper batch. Intermediate files live in a private
+        workspace that is removed afterwards, so concurrent jobs are safe.
+
+        `stemming` is True, False or "auto", which only separates vocals
+        when `detect_background` finds music or heavy noise. `word_anchor`
+        is the word point ("start", "mid" or "end") matched to speaker turns.
+        `alignment` is where word timings come from: "ctc" aligns the
+        transcript with the wav2vec2 model, "whisper" takes them from
+        Whisper's cross-attention and skips the alignment model altogether.
+        It defaults to the pipeline's `alignment`.
+
+        Recordings longer than `window_seconds` (if given) are processed in
+        overlapping windows with bounded memory, see `_diarize_windowed`.
+        """
+        job_start = time.perf_counter()
+        timings = {}
+        language = process_language_arg(language, self.model_name)
+        alignment = alignment or self.alignment
+        if alignment not in ("ctc", "whisper"):
+            raise ValueError(f"alignment must be ctc or whisper, got {alignment!r}")
+        if window_seconds and probe_duration(audio_path) > window_seconds:
+            return self._diarize_windowed(
+                audio_path,
+                stemming,
+                suppress_numerals,
+                language,
+                progress,
+                word_anchor,
+                window_seconds,
+                overlap_seconds,
+                alignment,
+            )
+        word_timestamps = alignment == "whisper"
+        workspace = create_job_workspace()
+        try:
+            input_key = self._input_key(audio_path, stemming)
+            whisper_key = self._whisper_key(
+                input_key,
+                language,
+                suppress_numerals,
+                batched=self.batch_size > 0,
+                word_timestamps=word_timestamps,
+            )
+            audio_waveform, stemming_info = self._prepare(
+                audio_path, timings, stemming, progress
+            )
+            vad_segments = None
+            if self.batch_size > 0:
+                # batched Whisper decodes the VAD chunks, as in `diarize_batch`
+                with run_stage(timings, "vad", progress):
+                    vad_segments = self._checkpoint(
+                        self._vad_key(input_key),
+                        lambda: self._detect_speech(audio_waveform),
+                    )
+
+            def transcribe():
+                def run():
+                    full_transcript, transcript_language, words = self._transcribe(
+                        audio_waveform,
+                        language,
+                        suppress_numerals,
+                        audio_path,
+                        progress,
+                        word_timestamps=word_timestamps,
+                        vad_segments=vad_segments,
+                    )
+                    if word_timestamps:
+                        return full_transcript, transcript_language, words
+                    return full_transcript, transcript_language
+
+                with run_stage(timings, "whisper", progress):
+                    return tuple(self._checkpoint(whisper_key, run))
+
+            result = self._diarize_transcript(
+                audio_path,
+                workspace,
+                timings,
+                audio_waveform,
+                transcribe,
+                progress,
+                {"input": input_key, "whisper": whisper_key},
+                word_anchor=word_anchor,
+                vad_segments=vad_segments,
+                alignment=alignment,
+            )
+        finally:
+            cleanup(workspace)
+
+        result["stemming"] = stemming_info
+        return self._finish_job(result, timings, job_start)
+
+    def diarize_transcribed(
+        self,
+        audio_path: str,
+        audio_waveform,
+        transcript: str,
+        language: str,
+        vad_segments=None,
+        progress=None,
+        word_anchor: str = "start",
+    ) -> dict:
+        """
+        Diarize audio whose transcript is already known, e.g. transcribed
+        incrementally by a `LiveSession`: only alignment, MSDD, punctuation
+        and VAD (unless `vad_segments` are given) are left to run. Returns
+        what `diarize` returns, with the outputs written next to `audio_path`.
+        """
+        job_start = time.perf_counter()
+        timings = {}
+        workspace = create_job_workspace()
+        try:
+            input_key = self._input_key(audio_path, False)
+            result = self._diarize_transcript(
+                audio_path,
+                workspace,
+                timings,
+                audio_waveform,
+                lambda: (transcript, language),
+                progress,
+                {
+                    "input": input_key,
+                    "whisper": make_cache_key(
+                        input_key, stage="transcript", transcript=transcript
+                    ),
+                },
+                word_anchor=word_anchor,
+                vad_segments=vad_segments,
+            )
+        finally:
+            cleanup(workspace)
+
+        result["stemming"] = {"mode": "false", "separated": False}
+        return self._finish_job(result, timings, job_start)
+
+    def diarize_batch(
+        self,
+        audio_paths,
+        stemming=True,
+        suppress_numerals: bool = False,
+        language: str = None,
+        progress=None,
+        word_anchor: str = "start",
+        window_seconds: float = None,
+        overlap_seconds: float = 30,
+        alignment: str = None,
+    ):
+        """
+        Diarize many files with the models loaded once.
+
+        Each stage runs across all files before the next one starts, and
+        Whisper decodes VAD chunks from different files in shared batches so
+        short recordings still fill the GPU. Yields `(audio_path, result)` as
+        each file finishes, where `result` is what `diarize` returns or the
+        exception that file failed with. Files longer than `window_seconds`
+        go through the windowed mode of `diarize` one at a time instead.
+
+        A result's `total` timing is that file's own stages plus the shared
+        Whisper stage; `batch_total` is the time since the batch started.
+        """
+        batch_start = time.perf_counter()
+        language = process_language_arg(language, self.model_name)
+        alignment = alignment or self.alignment
+        if alignment not in ("ctc", "whisper"):
+            raise ValueError(f"alignment must be ctc or whisper, got {alignment!r}")
+        long_paths = []
+        if window_seconds:
+            long_paths = [
+                path for path in audio_paths if probe_duration(path) > window_seconds
+            ]
+            audio_paths = [path for path in audio_paths if path not in long_paths]
+        if audio_paths:
+            yield from self._diarize_files(
+                audio_paths,
+                stemming,
+                suppress_numerals,
+                language,
+                progress,
+                word_anchor,
+                batch_start,
+                alignment,
+            )
+        for audio_path in long_paths:
+            try:
+                result = self.diarize(
+                    audio_path,
+                    stemming=stemming,
+                    suppress_numerals=suppress_numerals,
+                    language=language,
+                    progress=progress,
+                    word_anchor=word_anchor,
+                    window_seconds=window_seconds,
+                    overlap_seconds=overlap_seconds,
+                    alignment=alignment,
+                )
+            except Exception as e:
+                yield audio_path, e
+                continue
+            yield audio_path, result
+
+    def _diarize_files(
+        self,
+        audio_paths,
+        stemming,
+        suppress_numerals,
+        language,
+        progress,
+        word_anchor,
+        batch_start,
+        alignment="ctc",
+    ):
+        """The shared-batch part of `diarize_batch`."""
+        word_timestamps = alignment == "whisper"
+        files = []
+        try:
+            for audio_path in audio_paths:
+                file_start = time.perf_counter()
+                file = {
+                    "audio_path": audio_path,
+                    "workspace": create_job_workspace(),
+                    "timings": {},
+                }
+                files.append(file)
+                try:
+                    file["input_key"] = self._input_key(audio_path, stemming)
+                    file["whisper_key"] = self._whisper_key(
+                        file["input_key"],
+                        language,
+                        suppress_numerals,
+                        batched=True,
+                        word_timestamps=word_timestamps,
+                    )
+                    file["waveform"], file["stemming"] = self._prepare(
+                        audio_path, file["timings"], stemming, progress
+                    )
+                    with run_stage(file["timings"], "vad", progress):
+                        file["vad_segments"] = self._checkpoint(
+                            self._vad_key(file["input_key"]),
+                            lambda: self._detect_speech(file["waveform"]),
+                        )
+                except Exception as e:
+                    file["error"] = e
+                # the time spent on this file alone, the shared Whisper
+                # stage is added below
+                file["seconds"] = time.perf_counter() - file_start
+
+            pending = []
+            for file in files:
+                if "error" in file:
+                    continue
+                transcription = (
+                    self.artifacts.get(file["whisper_key"])
+                    if self.artifacts is not None
+                    else None
+                )
+                if transcription is None:
+                    pending.append(file)
+                else:
+                    file["transcription"] = tuple(transcription)
+
+            whisper_timings = {}
+            with run_stage(whisper_timings, "whisper", progress):
+                transcripts = self._transcribe_files(
+                    pending,
+                    language,
+                    suppress_numerals,
+                    progress,
+                    word_timestamps=word_timestamps,
+                )
+            for file, transcription in zip(pending, transcripts):
+                # the words are only kept when they replace the CTC alignment
+                file["transcription"] = transcription if word_timestamps else transcription[:2]
+                file["timings"]["whisper"] = whisper_timings["whisper"]
+                file["seconds"] += whisper_timings["whisper"]
+                if self.artifacts is not None:
+                    self.artifacts.put(file["whisper_key"], list(file["transcription"]))
+
+            for file in files:
+                if "error" in file:
+                    yield file["audio_path"], file["error"]
+                    continue
+                # so that `total` counts the time so far plus the stages below
+                file_start = time.perf_counter() - file["seconds"]
+                try:
+                    result = self._diarize_transcript(
+                        file["audio_path"],
+                        file["workspace"],
+                        file["timings"],
+                        file["waveform"],
+                        lambda file=file: file["transcription"],
+                        progress,
+                        {"input": file["input_key"], "whisper": file["whisper_key"]},
+                        word_anchor=word_anchor,
+                        vad_segments=file["vad_segments"],
+                        alignment=alignment,
+                    )
+                except Exception as e:
+                    yield file["audio_path"], e
+                    continue
+                finally:
+                    cleanup(file["workspace"])
+                    del file["waveform"]
+                result["stemming"] = file["stemming"]
+                file["timings"]["batch_total"] = round(
+                    time.perf_counter() - batch_start, 3
+                )
+                yield file["audio_path"], self._finish_job(
+                    result, file["timings"], file_start
+                )
+        finally:
+            for file in files:
+                if os.path.isdir(file["workspace"]):
+                    cleanup(file["workspace"])
+
+    def _finish_job(self, result, timings, job_start):
+        timings["total"] = round(time.perf_counter() - job_start, 3)
+        cold_start = self.jobs_processed == 0
+        self.jobs_processed += 1
+        print(f"[INFO] Job timings ({'cold' if cold_start else 'warm'}): {timings}")
+        self.batch_sizer.save()
+
+        return DiarizationResult(
+            result,
+            timings=timings,
+            cold_start=cold_start,
+            model_cache=self.registry.stats(),
+            batch_sizes=self.batch_sizer.stats(),
+        )
+
+    def _prepare(self, audio_path, timings, stemming, progress):
+        """
+        Decode the (vocal stem of the) audio into the 16 kHz mono float32
+        waveform that every later stage reads from. This is the only decode
+        of the job, unless "auto" stemming decides to separate after looking
+        at the decoded audio. Returns the waveform and the stemming decision.
+        """
+        stemming_info = {"mode": str(stemming).lower(), "separated": bool(stemming)}
+        if stemming == "auto":
+            with run_stage(timings, "decode", progress):
+                audio_waveform = faster_whisper.decode_audio(audio_path)
+            with run_stage(timings, "stem_detect", progress):
+                separate, reason, stats = detect_background(audio_waveform)
+            stemming_info.update(separated=separate, reason=reason, stats=stats)
+            print(
+                f"[INFO] Auto stemming: {'separating' if separate else 'skipping'} "
+                f"({reason}, {stats}), decided in {timings['stem_detect']}s"
+            )
+            if not separate:
+                return audio_waveform, stemming_info
+
+        if stemming:
+            with run_stage(timings, "demucs", progress):
+                try:
+                    return (
+                        self.separator.separate(audio_path, cache=self.stem_cache),
+                        stemming_info,
+                    )
+                except Exception as e:
+                    logging.warning(
+                        f"Source splitting failed ({e}), using original audio file. "
+                        "Use --no-stem argument to disable it."
+                    )
+            stemming_info["separated"] = False
+            if stemming == "auto":
+                return audio_waveform, stemming_info
+
+        with run_stage(timings, "decode", progress):
+            return faster_whisper.decode_audio(audio_path), stemming_info
+
+    def _diarize_windowed(
+        self,
+        audio_path,
+        stemming,
+        suppress_numerals,
+        language,
+        progress,
+        word_anchor,
+        window_seconds,
+        overlap_seconds,
+        alignment="ctc",
+    ):
+        """
+        Long-form mode of `diarize`. The recording is decoded (or separated)
+        as a stream and Whisper, alignment, VAD and MSDD run per window of
+        `window_seconds` overlapping by `overlap_seconds`, so memory follows
+        the window size instead of the recording length. Each window keeps
+        the words and turns of its half of the overlaps, and `SpeakerLinker`
+        matches its speakers to the ones seen before by embedding similarity.
+        Only punctuation and the output files see the whole transcript.
+        """
+        job_start = time.perf_counter()
+        timings = {}
+        input_key = self._input_key(audio_path, stemming)
+        workspace = create_job_workspace()
+        linker = SpeakerLinker()
+        words, turns = [], []
+        audio_seconds = 0.0
+        try:
+            chunks, stemming_info = self._stream(audio_path, stemming, timings, progress)
+            windows = iter_windows(chunks, window_seconds, overlap_seconds)
+            for index, (start, waveform, is_last) in enumerate(windows):
+                if progress is not None:
+                    progress(
+                        {
+                            "stage": "window",
+                            "status": "progress",
+                            "window": index + 1,
+                            "start_seconds": round(start, 2),
+                        }
+                    )
+                key = make_cache_key(
+                    input_key,
+                    stage="window",
+                    index=index,
+                    window_seconds=window_seconds,
+                    overlap_seconds=overlap_seconds,
+                    model=self.model_name,
+                    language=language,
+                    suppress_numerals=suppress_numerals,
+                    batch_size=self.batch_size,
+                    alignment=alignment,
+                )
+                window_timings = {}
+                window = self._checkpoint(
+                    key,
+                    lambda waveform=waveform: self._diarize_window(
+                        waveform,
+                        language,
+                        suppress_numerals,
+                        create_job_workspace(workspace),
+                        window_timings,
+                        progress,
+                        alignment,
+                    ),
+                )
+                for stage, seconds in window_timings.items():
+                    timings[stage] = round(timings.get(stage, 0) + seconds, 3)
+                # later windows keep the language detected in the first one
+                language = window["language"]
+                duration = waveform.shape[0] / SAMPLE_RATE
+                audio_seconds = start + duration
+
+                own_start, own_end = owned_range(
+                    start, duration, overlap_seconds, index == 0, is_last
+                )
+                offset = int(start * 1000)
+                local_turns = [
+                    [turn_start + offset, turn_end + offset, speaker]
+                    for turn_start, turn_end, speaker in window["speaker_ts"]
+                ]
+                mapping = linker.link(
+                    {
+                        speaker: None if embedding is None else np.array(embedding)
+                        for speaker, embedding in window["embeddings"]
+                    },
+                    local_turns,
+                )
+                for turn_start, turn_end, speaker in local_turns:
+                    turn_start = max(turn_start, own_start * 1000)
+                    turn_end = min(turn_end, own_end * 1000)
+                    if turn_start < turn_end:
+                        turns.append([int(turn_start), int(turn_end), mapping[speaker]])
+
+                if window["words"]:
+                    # a window without speaker turns goes to the last speaker
+                    default = turns[-1][2] if turns else 0
+                    wsm = get_words_speaker_mapping(
+                        window["words"],
+                        window["speaker_ts"] or [[0, float("inf"), None]],
+                        word_anchor,
+                    )
+                    for word in wsm:
+                        word["start_time"] += offset
+                        word["end_time"] += offset
+                        word["speaker"] = mapping.get(word["speaker"], default)
+                        if own_start * 1000 <= word["start_time"] < own_end * 1000:
+                            words.append(word)
+                del waveform, window
+
+            if not turns:
+                raise ValueError(f"No speech found in {audio_path}")
+            speaker_ts = merge_turns(turns)
+            with run_stage(timings, "punctuation", progress):
+                words = self._restore_punctuation(words, language)
+            with run_stage(timings, "write", progress):
+                outputs = self._write_outputs(audio_path, words, speaker_ts)
+        finally:
+            cleanup(workspace)
+
+        print(f"[INFO] Linked {len(linker.sums)} speakers across {index + 1} windows")
+        result = {
+            **outputs,
+            "language": language,
+            "speakers": [
+                {"speaker": f"Speaker {speaker}", "start_time": start, "end_time": end}
+                for start, end, speaker in speaker_ts
+            ],
+            "speaker_ts": speaker_ts,
+            "rttm": to_rttm(speaker_ts, os.path.basename(workspace)),
+            "audio_seconds": round(audio_seconds, 3),
+            "critical_path": [],
+            "windows": index + 1,
+            "stemming": stemming_info,
+        }
+        return self._finish_job(result, timings, job_start)
+
+    def _stream(self, audio_path, stemming, timings, progress):
+        """
+        Streaming counterpart of `_prepare` for the windowed mode: returns
+        an iterator of 16 kHz mono chunks and the stemming decision. "auto"
+        decides from the first minute of the recording. The time spent
+        decoding or separating is added up under "decode" or "demucs".
+        """
+        stemming_info = {"mode": str(stemming).lower(), "separated": bool(stemming)}
+        if stemming == "auto":
+            with run_stage(timings, "stem_detect", progress):
+                head, head_samples = [], 0
+                stream = decode_stream(audio_path)
+                for chunk in stream:
+                    head.append(chunk)
+                    head_samples += chunk.shape[0]
+                    if head_samples >= 60 * SAMPLE_RATE:
+                        break
+                stream.close()
+                separate, reason, stats = detect_background(np.concatenate(head))
+            stemming_info.update(separated=separate, reason=reason, stats=stats)
+            print(
+                f"[INFO] Auto stemming: {'separating' if separate else 'skipping'} "
+                f"({reason}, {stats}) from the first {head_samples / SAMPLE_RATE:.0f}s"
+            )
+            del head
+            stemming = separate
+
+        def timed_stream(chunks, name):
+            timings[name] = 0.0
+            start = time.perf_counter()
+            for chunk in chunks:
+                timings[name] = round(timings[name] + time.perf_counter() - start, 3)
+                yield chunk
+                start = time.perf_counter()
+
+        def vocals():
+            separated = False
+            try:
+                for chunk in self.separator.stream(audio_path):
+                    separated = True
+                    yield chunk
+            except Exception as e:
+                if separated:
+                    raise
+                logging.warning(
+                    f"Source splitting failed ({e}), using original audio file. "
+                    "Use --no-stem argument to disable it."
+                )
+                stemming_info["separated"] = False
+                yield from decode_stream(audio_path)
+
+        if stemming:
+            return timed_stream(vocals(), "demucs"), stemming_info
+        return timed_stream(decode_stream(audio_path), "decode"), stemming_info
+
+    def _diarize_window(
+        self,
+        waveform,
+        language,
+        suppress_numerals,
+        workspace,
+        timings,
+        progress,
+        alignment="ctc",
+    ):
+        """
+        Transcribe, align and diarize one window. Returns its language, the
+        aligned words and speaker turns relative to the window, and an
+        embedding per speaker; everything is JSON so a window can be
+        checkpointed.
+        """
+        word_timestamps = alignment == "whisper"
+
+        def transcribe(segments=None):
+            with run_stage(timings, "whisper", progress):
+                return self._transcribe(
+                    waveform,
+                    language,
+                    suppress_numerals,
+                    None,
+                    progress,
+                    word_timestamps=word_timestamps,
+                    vad_segments=segments,
+                )
+
+        def emissions():
+            with run_stage(timings, "emissions", progress):
+                return self._generate_emissions(waveform)
+
+        def align(transcription, emissions):
+            full_transcript, window_language, _ = transcription
+            if not full_transcript.strip():
+                return []
+            with run_stage(timings, "alignment", progress):
+                return self._align(emissions, full_transcript, window_language)
+
+        def vad():
+            with run_stage(timings, "vad", progress):
+                return self._detect_speech(waveform)
+
+        def msdd(segments):
+            if not segments:
+                return []
+            with run_stage(timings, "msdd", progress):
+                return self._diarize_speakers(waveform, segments, workspace)[0]
+
+        def embeddings(speaker_ts):
+            with run_stage(timings, "embeddings", progress):
+                return self._speaker_embeddings(waveform, speaker_ts)
+
+        graph = StageGraph(self.stage_executor)
+        graph.add("vad", vad)
+        # batched Whisper decodes the VAD chunks
+        graph.add("whisper", transcribe, deps=["vad"] if self.batch_size > 0 else [])
+        if word_timestamps:
+            graph.add("alignment", lambda transcription: transcription[2], deps=["whisper"])
+        else:
+            graph.add("emissions", emissions)
+            graph.add("alignment", align, deps=["whisper", "emissions"])
+        graph.add("msdd", msdd, deps=["vad"])
+        graph.add("embeddings", embeddings, deps=["msdd"])
+        try:
+            results = graph.run()
+        finally:
+            cleanup(workspace)
+        return {
+            "language": results["whisper"][1],
+            "words": results["alignment"],
+            "speaker_ts": results["msdd"],
+            "embeddings": results["embeddings"],
+        }
+
+    def _speaker_embeddings(self, audio_waveform, speaker_ts, max_seconds=30, min_seconds=1):
+        """
+        `[[speaker, embedding], ...]` for the speakers of `speaker_ts`, each
+        from up to `max_seconds` of its longest turns. The embedding is None
+        for speakers with less than `min_seconds` of audio.
+        """
+        turns_by_speaker = {}
+        for start, end, speaker in speaker_ts:
+            turns_by_speaker.setdefault(speaker, []).append((start, end))
+
+        embeddings = []
+        max_samples = max_seconds * SAMPLE_RATE
+        for speaker, speaker_turns in turns_by_speaker.items():
+            audio, samples = [], 0
+            for start, end in sorted(speaker_turns, key=lambda t: t[0] - t[1]):
+                segment = audio_waveform[
+                    start * SAMPLE_RATE // 1000 : end * SAMPLE_RATE // 1000
+                ][: max_samples - samples]
+                audio.append(segment)
+                samples += segment.shape[0]
+                if samples >= max_samples:
+                    break
+            if samples < min_seconds * SAMPLE_RATE:
+                embeddings.append([speaker, None])
+                continue
+            # infer_segment switches the model between train and eval mode
+            with self.registry.lock(
+                "speaker_embedding", **self.model_params["speaker_embedding"]
+            ):
+                embedding, _ = self.speaker_model.infer_segment(np.concatenate(audio))
+            embeddings.append([speaker, embedding[0].float().cpu().tolist()])
+        return embeddings
+
+    def _diarize_transcript(
+        self,
+        audio_path,
+        workspace,
+        timings,
+        audio_waveform,
+        transcribe,
+        progress,
+        checkpoint_keys,
+        word_anchor="start",
+        vad_segments=None,
+        alignment="ctc",
+    ):
+        """
+        Run the rest of the pipeline as a stage graph. `transcribe()` returns
+        `(full_transcript, language)`; it and the alignment form one branch,
+        VAD and MSDD the other, and both join at the word/speaker mapping.
+        With `alignment="whisper"` it returns `(full_transcript, language,
+        words)` and the words replace the CTC emissions and alignment.
+
+        Every stage output is checkpointed under a key chained from the keys
+        of its inputs (`checkpoint_keys` holds the input and Whisper keys),
+        so a rerun resumes after the last stage that finished and a changed
+        parameter only invalidates the stages downstream of it.
+        """
+        keys = {"whisper": checkpoint_keys["whisper"]}
+        keys["emissions"] = make_cache_key(
+            checkpoint_keys["input"], stage="emissions", batch_size=self.batch_size
+        )
+        keys["alignment"] = make_cache_key(
+            f"{keys['whisper']}:{keys['emissions']}", stage="alignment"
+        )
+        if alignment == "whisper":
+            # the words are part of the Whisper checkpoint
+            keys["alignment"] = keys["whisper"]
+        keys["vad"] = self._vad_key(checkpoint_keys["input"])
+        keys["msdd"] = make_cache_key(keys["vad"], stage="msdd")
+        keys["punctuation"] = make_cache_key(
+            f"{keys['alignment']}:{keys['msdd']}",
+            stage="punctuation",
+            word_anchor=word_anchor,
+            model=self.punct_model_name,
+        )
+
+        def emissions():
+            with run_stage(timings, "emissions", progress):
+                return self._checkpoint(
+                    keys["emissions"],
+                    lambda: self._generate_emissions(audio_waveform),
+                    arrays=True,
+                )
+
+        def align(transcription, emissions):
+            full_transcript, language = transcription[:2]
+            with run_stage(timings, "alignment", progress):
+                return self._checkpoint(
+                    keys["alignment"],
+                    lambda: self._align(emissions, full_transcript, language),
+                )
+
+        def vad():
+            if vad_segments is not None:
+                # detected and timed before transcription
+                return vad_segments
+            with run_stage(timings, "vad", progress):
+                return self._checkpoint(
+                    keys["vad"], lambda: self._detect_speech(audio_waveform)
+                )
+
+        def msdd(segments):
+            with run_stage(timings, "msdd", progress):
+                return self._checkpoint(
+                    keys["msdd"],
+                    lambda: self._diarize_speakers(audio_waveform, segments, workspace),
+                )
+
+        def punctuate(transcription, word_timestamps, diarization):
+            speaker_ts, _ = diarization
+
+            def restore_punctuation():
+                wsm = get_words_speaker_mapping(word_timestamps, speaker_ts, word_anchor)
+                return self._restore_punctuation(wsm, transcription[1])
+
+            with run_stage(timings, "punctuation", progress):
+                return self._checkpoint(keys["punctuation"], restore_punctuation)
+
+        def write(wsm, diarization):
+            speaker_ts, _ = diarization
+            with run_stage(timings, "write", progress):
+                return self._write_outputs(audio_path, wsm, speaker_ts)
+
+        graph = StageGraph(self.stage_executor)
+        graph.add("whisper", transcribe)
+        if alignment == "whisper":
+            graph.add("alignment", lambda transcription: transcription[2], deps=["whisper"])
+        else:
+            graph.add("emissions", emissions)
+            graph.add("alignment", align, deps=["whisper", "emissions"])
+        graph.add("vad", vad)
+        graph.add("msdd", msdd, deps=["vad"])
+        graph.add("punctuation", punctuate, deps=["whisper", "alignment", "msdd"])
+        graph.add("write", write, deps=["punctuation", "msdd"])
+        results = graph.run()
+
+        critical_path = graph.critical_path()
+        logging.debug(f"Critical path: {critical_path}")
+        speaker_ts, rttm = results["msdd"]
+        return {
+            **results["write"],
+            "language": results["whisper"][1],
+            "speakers": [
+                {"speaker": f"Speaker {speaker}", "start_time": start, "end_time": end}
+                for start, end, speaker in speaker_ts
+            ],
+            "speaker_ts": speaker_ts,
+            "rttm": rttm,
+            "audio_seconds": round(audio_waveform.shape[0] / SAMPLE_RATE, 3),
+            "critical_path": critical_path,
+        }
+
+    def _diarize_speakers(self, audio_waveform, segments, workspace):
+        """Run MSDD over the VAD `segments`, returns the speaker turns and RTTM."""
+        uniq_id = os.path.basename(workspace)
+        # NeMo only reads audio through manifest file paths, so MSDD
+        # still gets a file; 16-bit PCM is half the size of float32
+        mono_file_path = os.path.join(workspace, f"{uniq_id}.wav")
+        write_wav(mono_file_path, audio_waveform, SAMPLE_RATE)
+        manifest_path = self._write_vad_manifest(
+            segments, mono_file_path, workspace, uniq_id
+        )
+        # the shared model is reconfigured for every job
+        with self.registry.lock("msdd", **self.model_params["msdd"]):
+            self.msdd_model._cfg.diarizer.out_dir = workspace
+            self.msdd_model._cfg.diarizer.manifest_filepath = manifest_path
+            self.msdd_model.diarize()
+        rttm_path = os.path.join(workspace, "pred_rttms", f"{uniq_id}.rttm")
+        with open(rttm_path, "r") as f:
+            rttm = f.read()
+        return read_speaker_timestamps(rttm_path), rttm
+
+    def _write_outputs(self, audio_path, wsm, speaker_ts):
+        """
+        Build the speaker-aware transcript and SRT and write them to
+        `<audio>.txt` and `<audio>.srt`. Returns the texts, their paths and
+        the words (with their sentence index) and sentences.
+        """
+        wsm = get_realigned_ws_mapping_with_punctuation(wsm)
+        ssm = get_sentences_speaker_mapping(wsm, speaker_ts)
+
+        transcript = io.StringIO()
+        get_speaker_aware_transcript(ssm, transcript)
+        srt = io.StringIO()
+        write_srt(ssm, srt)
+
+        outputs = {
+            "transcript_path": f"{os.path.splitext(audio_path)[0]}.txt",
+            "srt_path": f"{os.path.splitext(audio_path)[0]}.srt",
+            "transcript": transcript.getvalue(),
+            "srt": srt.getvalue(),
+        }
+        for kind in ("transcript", "srt"):
+            with open(outputs[f"{kind}_path"], "w", encoding="utf-8-sig") as f:
+                f.write(outputs[kind])
+        return {**outputs, "words": wsm, "sentences": ssm}
+
+    def _transcribe(
+        self,
+        audio_waveform,
+        language,
+        suppress_numerals,
+        audio_path,
+        progress=None,
+        word_timestamps=False,
+        vad_segments=None,
+    ):
+        """
+        Returns the transcript, its language and, with `word_timestamps`, the
+        words in the form `_align` gives them.
+
+        With a batch size, the VAD chunks (`vad_segments`, detected here if
+        not given) go through the batched loop of `_transcribe_files`, the
+        same one `diarize_batch` uses; a batch size of 0 runs faster-whisper
+        unbatched with its own VAD.
+        """
+        if self.batch_size > 0:
+            if vad_segments is None:
+                vad_segments = self._detect_speech(audio_waveform)
+            file = {"waveform": audio_waveform, "vad_segments": vad_segments}
+            [(full_transcript, language, words)] = self._transcribe_files(
+                [file],
+                language,
+                suppress_numerals,
+                progress,
+                word_timestamps=word_timestamps,
+            )
+            transcript_segments = [
+                (chunk["start"], chunk["end"], text)
+                for chunk, text in zip(vad_segments, file["texts"])
+                if text
+            ]
+        else:
+            full_transcript, language, words, transcript_segments = (
+                self._transcribe_unbatched(
+                    audio_waveform, language, suppress_numerals, progress, word_timestamps
+                )
+            )
+        print(f"[DEBUG] Number of segments: {len(transcript_segments)}")
+
+        # Save Whisper segments to file, unless this is one window of a recording
+        if transcript_segments and audio_path is not None:
+            seg_file = f"{os.path.splitext(audio_path)[0]}_whisper_segments.txt"
+            try:
+                with open(seg_file, "w", encoding="utf-8") as f:
+                    for start, end, text in transcript_segments:
+                        f.write(f"{start:.2f} --> {end:.2f}: {text.strip()}\n")
+                print(f"[INFO] Whisper segments saved to {seg_file}")
+            except Exception as e:
+                logging.warning(f"Failed to save Whisper segments: {e}")
+        return full_transcript, language, words
+
+    def _transcribe_unbatched(
+        self, audio_waveform, language, suppress_numerals, progress, word_timestamps
+    ):
+        """`_transcribe` without a batch size, also returns the segments."""
+        suppress_tokens = (
+            find_numeral_symbol_tokens(self.whisper_model.hf_tokenizer)
+            if suppress_numerals
+            else [-1]
+        )
+        transcript_segments, info = self.whisper_model.transcribe(
+            audio_waveform,
+            language,
+            suppress_tokens=suppress_tokens,
+            vad_filter=True,
+            word_timestamps=word_timestamps,
+        )
+
+        # segments are generated lazily
+        segments = []
+        for segment in transcript_segments:
+            segments.append(segment)
+            if progress is not None:
+                progress(
+                    {
+                        "stage": "whisper",
+                        "status": "progress",
+                        "segments": len(segments),
+                        "processed_seconds": round(segment.end, 2),
+                        "total_seconds": round(info.duration, 2),
+                    }
+                )
+
+        full_transcript = "".join(segment.text for segment in segments)
+        words = None
+        if word_timestamps:
+            words = whisper_word_timestamps(
+                {
+                    "word": word.word,
+                    "start": word.start,
+                    "end": word.end,
+                    "probability": word.probability,
+                }
+                for segment in segments
+                for word in segment.words or []
+            )
+        return (
+            full_transcript,
+            info.language,
+            words,
+            [(segment.start, segment.end, segment.text) for segment in segments],
+        )
+
+    def _checkpoint(self, key, compute, arrays=False):
+        """Load the stage artifact stored under `key`, or compute and store it."""
+        store = self.array_artifacts if arrays else self.artifacts
+        if store is None:
+            return compute()
+        artifact = store.get(key)
+        if artifact is not None:
+            return artifact
+        artifact = compute()
+        store.put(key, artifact)
+        return artifact
+
+    def _input_key(self, audio_path, stemming):
+        return make_cache_key(hash_file(audio_path), stemming=stemming)
+
+    def _whisper_key(
+        self, input_key, language, suppress_numerals, batched=False, word_timestamps=False
+    ):
+        return make_cache_key(
+            input_key,
+            stage="whisper",
+            model=self.model_name,
+            language=language,
+            suppress_numerals=suppress_numerals,
+            batch_size=self.batch_size,
+            batched=batched,
+            word_timestamps=word_timestamps,
+        )
+
+    def _vad_key(self, input_key):
+        return make_cache_key(input_key, stage="vad", onset=VAD_ONSET, offset=VAD_OFFSET)
+
+    def _generate_emissions(self, audio_waveform):
+        # every window batch is split by the adaptive size, and split again
+        # when it runs out of memory
+        emissions, stride = generate_emissions(
+            AdaptiveForward(self.alignment_model, self._batch_sizes("alignment")),
+            torch.from_numpy(audio_waveform)
+            .to(self.alignment_model.dtype)
+            .to(self.alignment_model.device),
+            batch_size=self.batch_sizer.maximum,
+        )
+        return {"emissions": emissions.float().cpu().numpy(), "stride": np.array(stride)}
+
+    def _align(self, emissions, full_transcript, language):
+        stride = int(emissions["stride"])
+        emissions = torch.from_numpy(emissions["emissions"])
+
+        tokens_starred, text_starred = preprocess_text(
+            full_transcript,
+            romanize=True,
+            language=langs_to_iso[language],
+        )
+
+        segments, scores, blank_token = get_alignments(
+            emissions,
+            tokens_starred,
+            self.alignment_tokenizer,
+        )
+
+        spans = get_spans(tokens_starred, segments, blank_token)
+
+        return postprocess_results(text_starred, spans, stride, scores)
+
+    def _transcribe_files(
+        self, files, language, suppress_numerals, progress=None, word_timestamps=False
+    ):
+        """
+        Transcribe several decoded files at once. The VAD chunks of all files
+        are pooled and decoded in shared batches (per language) by
+        `transcribe_batches`, which prepares the next batch's features while
+        the current one decodes. Batches are sized by the adaptive Whisper
+        batch size, and one that runs out of memory is decoded again in
+        smaller pieces. Returns one `(full_transcript, language, words)` per
+        file, where `words` are None unless `word_timestamps` is set, and
+        leaves each file's chunk texts in `file["texts"]`; each progress
+        event carries the batch's timings.
+        """
+        model = self.whisper_model
+        options, _ = get_transcription_options(
+            model,
+            {
+                "suppress_tokens": find_numeral_symbol_tokens(model.hf_tokenizer)
+                if suppress_numerals
+                else [-1]
+            },
+        )
+        sizes = self._batch_sizes("whisper")
+
+        chunks_by_language = {}
+        # chunks encoded during language detection, decoded without encoding again
+        encoded_by_language = {}
+        texts = []
+        chunk_words = []
+        for file_idx, file in enumerate(files):
+            encoded = []
+            if language is not None:
+                file_language = language
+            elif not model.model.is_multilingual:
+                file_language = "en"
+            else:
+                file_language, _, encoded = detect_chunk_language(
+                    model,
+                    [
+                        file["waveform"][
+                            int(chunk["start"] * SAMPLE_RATE) : int(chunk["end"] * SAMPLE_RATE)
+                        ]
+                        for chunk in file["vad_segments"][:3]
+                    ],
+                )
+                file_language = file_language or "en"
+            file["language"] = file_language
+            texts.append([""] * len(file["vad_segments"]))
+            chunk_words.append([[] for _ in file["vad_segments"]])
+            encoded_by_language.setdefault(file_language, []).extend(
+                ((file_idx, chunk_idx), output) for chunk_idx, output in enumerate(encoded)
+            )
+            skipped = len(encoded)
+            for chunk_idx, chunk in enumerate(file["vad_segments"][skipped:], skipped):
+                chunks_by_language.setdefault(file_language, []).append(
+                    (file_idx, chunk_idx, chunk["start"], chunk["end"])
+                )
+
+        total_chunks = sum(len(file["vad_segments"]) for file in files)
+        decoded_chunks = 0
+        batch_timings = []
+        for chunk_language in {**encoded_by_language, **chunks_by_language}:
+            chunks = chunks_by_language.get(chunk_language, [])
+            encoded = encoded_by_language.get(chunk_language, [])
+            tokenizer = Tokenizer(
+                model.hf_tokenizer,
+                model.model.is_multilingual,
+                task="transcribe",
+                language=chunk_language,
+            )
+            # `transcribe_batches` yields the encoded chunks of all files
+            # first, stacked into batches of `encoded_batch_size`; the other
+            # batches are cut as they are needed, at the batch size of the moment
+            encoded_batch_size = sizes.size()
+            batches = collections.deque(
+                [(*key, None, None) for key, _ in encoded[i : i + encoded_batch_size]]
+                for i in range(0, len(encoded), encoded_batch_size)
+            )
+
+            def audio_batches(chunks=chunks):
+                offset = 0
+                while offset < len(chunks):
+                    batch = chunks[offset : offset + sizes.size()]
+                    offset += len(batch)
+                    batches.append(batch)
+                    yield [
+                        files[file_idx]["waveform"][
+                            int(start * SAMPLE_RATE) : int(end * SAMPLE_RATE)
+                        ]
+                        for file_idx, _, start, end in batch
+                    ]
+
+            def retry(audio, error, tokenizer=tokenizer):
+                if len(audio) == 1 or not is_oom(error):
+                    raise error
+                sizes.failed(len(audio))
+                parts = sizes.run(
+                    audio,
+                    lambda part: next(
+                        transcribe_batches(
+                            model,
+                            [part],
+                            tokenizer,
+                            options,
+                            word_timestamps=word_timestamps,
+                        )
+                    ),
+                )
+                return [text for part in parts for text in part]
+
+            decoded = transcribe_batches(
+                model,
+                audio_batches(),
+                tokenizer,
+                options,
+                timings=batch_timings,
+                encoded=[output for _, output in encoded],
+                on_error=retry,
+                word_timestamps=word_timestamps,
+                encoded_batch_size=encoded_batch_size,
+            )
+            for batch_texts in decoded:
+                batch = batches.popleft()
+                for (file_idx, chunk_idx, _, _), text in zip(batch, batch_texts):
+                    if word_timestamps:
+                        text, chunk_words[file_idx][chunk_idx] = text
+                    texts[file_idx][chunk_idx] = text.strip()
+                timing = batch_timings[-1]
+                if not (timing.get("reused") or timing.get("retried")):
+                    sizes.succeeded(timing["size"])
+
+                decoded_chunks += len(batch)
+                if progress is not None:
+                    progress(
+                        {
+                            "stage": "whisper",
+                            "status": "progress",
+                            "batch": len(batch_timings),
+                            "chunks": decoded_chunks,
+                            "total_chunks": total_chunks,
+                            **timing,
+                        }
+                    )
+        if batch_timings:
+            totals = {
+                key: round(sum(t[key] for t in batch_timings), 3)
+                for key in ("features", "encode", "decode")
+            }
+            logging.debug(
+                f"Whisper batch timings over {len(batch_timings)} batches: {totals}"
+            )
+
+        results = []
+        for file, file_texts, file_words in zip(files, texts, chunk_words):
+            file["texts"] = file_texts
+            words = None
+            if word_timestamps:
+                # word timings are relative to their VAD chunk
+                words = whisper_word_timestamps(
+                    {
+                        **word,
+                        "start": chunk["start"] + word["start"],
+                        "end": chunk["start"] + word["end"],
+                    }
+                    for chunk, words_of_chunk in zip(file["vad_segments"], file_words)
+                    for word in words_of_chunk
+                )
+            results.append(
+                (" ".join(text for text in file_texts if text), file["language"], words)
+            )
+        return results
+
+    def _detect_speech(self, audio_waveform):
+        # a (channel, time) view of the decoded waveform, pyannote doesn't
+        # have to read and resample the file again
+        segmentation_raw = self.vad_pipeline(
+            {
+                "waveform": Pyannote.preprocess_audio(audio_waveform),
+                "sample_rate": SAMPLE_RATE,
+            }
+        )
+
+        segmentation_output = Pyannote.merge_chunks(
+            segmentation_raw, chunk_size=30, onset=VAD_ONSET, offset=VAD_OFFSET
+        )
+        print(f"[DEBUG] Number of VAD segments: {len(segmentation_output)}")
+        return segmentation_output
+
+    def _write_vad_manifest(self, segmentation_output, mono_file_path, workspace, uniq_id):
+        pyannote_manifest = os.path.join(workspace, "pyannote_manifest.json")
+        with open(pyannote_manifest, "w") as f:
+            for speech in segmentation_output:
+                for start, end in speech["segments"]:
+                    segment = {
+                        "audio_filepath": mono_file_path,
+                        "offset": start,
+                        "duration": end - start,
+                        "label": "speech",
+                        "uniq_id": uniq_id,
+                    }
+                    f.write(f"{json.dumps(segment)}\n")
+        return pyannote_manifest
+
+    def _restore_punctuation(self, wsm, language):
+        if language not in punct_model_langs:
+            logging.warning(
+                f"Punctuation restoration is not available for {language} language."
+                " Using the original punctuation."
+            )
+            return wsm
+
+        # restoring punctuation in the transcript to help realign the sentences
+        words_list = list(map(lambda x: x["word"], wsm))
+
+        labled_words = self.punct_model.predict(words_list, chunk_size=230)
+
+        ending_puncts = ".?!"
+        model_puncts = ".,;:!?"
+
+        # We don't want to punctuate U.S.A. with a period. Right?
+        is_acronym = lambda x: re.fullmatch(r"\b(?:[a-zA-Z]\.){2,}", x)
+
+        for word_dict, labeled_tuple in zip(wsm, labled_words):
+            word = word_dict["word"]
+            if (
+                word
+                and labeled_tuple[1] in ending_puncts
+                and (word[-1] not in model_puncts or is_acronym(word))
+            ):
+                word += labeled_tuple[1]
+                if word.endswith(".."):
+                    word = word.rstrip(".")
+                word_dict["word"] = word
+        return wsm
+
+
+PIPELINE_ARGS = set(inspect.signature(DiarizationPipeline).parameters) - {"registry"}
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+
+
+def run(audio_path: str, options: dict = None) -> dict:
+    """
+    Diarize `audio_path` and return the structured result of
+    `DiarizationPipeline.diarize` (words, sentences, speakers, timings...).
+
+    `options` may hold any `DiarizationPipeline` argument (model_name,
+    device, batch_size...) and any `diarize` argument (stemming, language,
+    progress...). Pipelines are reused across calls with the same
+    configuration, and all of them share the models of `default_registry`.
+    """
+    options = dict(options or {})
+    pipeline_options = {
+        name: options.pop(name) for name in list(options) if name in PIPELINE_ARGS
+    }
+    key = json.dumps(pipeline_options, sort_keys=True, default=str)
+    with _pipelines_lock:
+        if key not in _pipelines:
+            _pipelines[key] = DiarizationPipeline(**pipeline_options)
+        pipeline = _pipelines[key]
+    return pipeline.diarize(audio_path, **options)
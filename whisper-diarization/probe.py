@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+
+# MediaRecorder uploads are ~32 kbps Opus; only used when ffprobe can't tell
+FALLBACK_BYTES_PER_SECOND = 4000
+
+
+def probe_duration(path, timeout=10):
+    """
+    Cheap estimate of an audio file's duration in seconds.
+
+    Reads the container header with ffprobe instead of decoding. Browser
+    recordings (WebM from MediaRecorder) usually carry no duration, in which
+    case it is estimated from the file size and the stream bit rate.
+    """
+    size = os.path.getsize(path)
+    cmd = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-show_entries",
+        "format=duration,bit_rate",
+        "-of",
+        "json",
+        path,
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True, timeout=timeout).stdout
+        info = json.loads(out).get("format", {})
+    except (OSError, subprocess.SubprocessError, ValueError):
+        info = {}
+
+    try:
+        return float(info["duration"])
+    except (KeyError, ValueError):
+        pass
+    try:
+        bytes_per_second = float(info["bit_rate"]) / 8
+    except (KeyError, ValueError):
+        bytes_per_second = 0
+    if not bytes_per_second > 0:
+        # missing, "0" or "N/A"
+        bytes_per_second = FALLBACK_BYTES_PER_SECOND
+    return size / bytes_per_second
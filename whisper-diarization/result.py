@@ -0,0 +1,96 @@
+import json
+import struct
+import sys
+from array import array
+
+MAGIC = b"DRZ1"
+# per-word columns of the binary form, see `DiarizationResult.to_bytes`
+WORD_COLUMNS = (
+    ("start_time", "I"),
+    ("end_time", "I"),
+    ("speaker", "H"),
+    ("sentence", "I"),
+    ("score", "f"),
+)
+
+
+def _column(typecode, values):
+    column = array(typecode, values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+def _read_column(typecode, data, offset, count):
+    column = array(typecode)
+    column.frombytes(data[offset : offset + count * column.itemsize])
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tolist(), offset + count * column.itemsize
+
+
+class DiarizationResult(dict):
+    """
+    What `DiarizationPipeline.diarize` returns: a plain dict (so it pickles
+    and indexes like before) with the transcript and SRT text, the words
+    with their start/end in ms, CTC alignment score, speaker and sentence
+    index, the sentences, speaker turns and per-stage timings.
+
+    `to_json` serializes all of it. `to_bytes` is a compact form for
+    transcripts with many words: a JSON header with everything but the
+    words, followed by the words as little-endian columns (scores as
+    float32) and their text as NUL-separated UTF-8.
+    """
+
+    def to_json(self, **kwargs):
+        return json.dumps(self, ensure_ascii=False, **kwargs)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls(json.loads(text))
+
+    def to_bytes(self):
+        words = self.get("words", [])
+        header = {key: value for key, value in self.items() if key != "words"}
+        header["word_count"] = len(words)
+        header = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+        parts = [MAGIC, struct.pack("<I", len(header)), header]
+        for name, typecode in WORD_COLUMNS:
+            default = float("nan") if typecode == "f" else 0
+            parts.append(
+                _column(
+                    typecode,
+                    (
+                        default if word.get(name) is None else word[name]
+                        for word in words
+                    ),
+                )
+            )
+        parts.append("\0".join(word["word"] for word in words).encode("utf-8"))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if data[:4] != MAGIC:
+            raise ValueError("Not a serialized DiarizationResult")
+        (header_size,) = struct.unpack_from("<I", data, 4)
+        offset = 8 + header_size
+        result = cls(json.loads(data[8:offset].decode("utf-8")))
+        count = result.pop("word_count")
+
+        columns = {}
+        for name, typecode in WORD_COLUMNS:
+            columns[name], offset = _read_column(typecode, data, offset, count)
+        texts = data[offset:].decode("utf-8").split("\0") if count else []
+        result["words"] = [
+            {
+                "word": text,
+                **{name: columns[name][i] for name, _ in WORD_COLUMNS},
+            }
+            for i, text in enumerate(texts)
+        ]
+        for word in result["words"]:
+            if word["score"] != word["score"]:  # NaN, the word had no score
+                word["score"] = None
+        return result
@@ -0,0 +1,177 @@
+import av
+import numpy as np
+import torch
+import torchaudio
+from demucs.apply import apply_model
+from demucs.pretrained import get_model
+
+from cache import hash_file, make_cache_key
+
+SAMPLE_RATE = 16000
+
+# "auto" stemming thresholds: speech over a quiet background has ~30 dB
+# between its loud and quiet frames; music or heavy noise fills the pauses
+MIN_DYNAMIC_RANGE_DB = 20.0
+# spectral flatness of the pauses, tonal backgrounds (music) are below this
+MAX_MUSIC_FLATNESS = 0.2
+
+
+def detect_background(waveform, sample_seconds=60, frame_size=512, hop=256):
+    """
+    Cheap check for background music or heavy noise in a 16 kHz mono
+    waveform, used by the "auto" stemming mode.
+
+    Looks at up to `sample_seconds` of audio taken as short excerpts spread
+    over the recording. Clean speech has near-silent pauses, so a small
+    range between the loud and quiet frames means something fills them;
+    if the quiet frames are tonal (low spectral flatness) it's music,
+    otherwise noise. Returns `(separate, reason, stats)`.
+    """
+    excerpt = 3 * SAMPLE_RATE
+    num_excerpts = max(1, min(sample_seconds * SAMPLE_RATE // excerpt, len(waveform) // excerpt))
+    starts = np.linspace(0, max(len(waveform) - excerpt, 0), num_excerpts).astype(int)
+    sample = np.concatenate([waveform[start : start + excerpt] for start in starts])
+    if len(sample) < frame_size:
+        return False, "too short", {}
+
+    num_frames = 1 + (len(sample) - frame_size) // hop
+    frames = np.lib.stride_tricks.sliding_window_view(sample, frame_size)[::hop][:num_frames]
+    power = np.abs(np.fft.rfft(frames * np.hanning(frame_size), axis=1)) ** 2 + 1e-12
+    energy = power.mean(axis=1)
+    flatness = np.exp(np.log(power).mean(axis=1)) / energy
+
+    loud, quiet = np.percentile(energy, [95, 10])
+    stats = {
+        "dynamic_range_db": round(float(10 * np.log10(loud / quiet)), 2),
+        "pause_flatness": round(float(np.median(flatness[energy <= quiet])), 3),
+        "sampled_seconds": round(len(sample) / SAMPLE_RATE, 2),
+    }
+    if loud < 1e-8:
+        return False, "silent", stats
+    if stats["dynamic_range_db"] >= MIN_DYNAMIC_RANGE_DB:
+        return False, "clean", stats
+    if stats["pause_flatness"] < MAX_MUSIC_FLATNESS:
+        return True, "music", stats
+    return True, "noise", stats
+
+
+class VocalSeparator:
+    """
+    Demucs vocal separation that stays loaded between jobs.
+
+    The upload is decoded as a stream and separated in windows of
+    `chunk_seconds` that overlap by `overlap_seconds`, so memory stays
+    bounded by the window size instead of growing with the recording. Each
+    window's vocals are downmixed and resampled to the 16 kHz mono waveform
+    the rest of the pipeline uses and cross-faded with the previous window.
+    Separated vocals can be kept in an `ArrayCache` by content hash.
+    """
+
+    def __init__(
+        self,
+        device,
+        model_name="htdemucs",
+        chunk_seconds=60,
+        overlap_seconds=2,
+    ):
+        self.device = device
+        self.model_name = model_name
+        self.chunk_seconds = chunk_seconds
+        self.overlap_seconds = overlap_seconds
+        self.model = get_model(model_name).to(device).eval()
+        self.vocals_index = self.model.sources.index("vocals")
+
+    def separate(self, audio_path, cache=None):
+        """Return the vocals of `audio_path` as a 16 kHz mono float32 array."""
+        cache_key = None
+        if cache is not None:
+            cache_key = make_cache_key(
+                hash_file(audio_path), model=self.model_name, sample_rate=SAMPLE_RATE
+            )
+            vocals = cache.get(cache_key)
+            if vocals is not None:
+                return vocals
+
+        parts = list(self.stream(audio_path))
+        vocals = np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+
+        if cache is not None:
+            cache.put(cache_key, vocals)
+        return vocals
+
+    def stream(self, audio_path):
+        """
+        Yield the vocals of `audio_path` as consecutive 16 kHz mono chunks,
+        one per separated window, without holding the whole recording.
+        """
+        overlap = self.overlap_seconds * SAMPLE_RATE
+        fade_in = np.linspace(0.0, 1.0, overlap, dtype=np.float32)
+        tail = None
+        for window in self._windows(audio_path):
+            vocals = self._separate_window(window)
+            if tail is not None:
+                n = min(len(tail), len(vocals))
+                vocals[:n] = tail[:n] * (1 - fade_in[:n]) + vocals[:n] * fade_in[:n]
+            # hold back the overlap, the next window cross-fades into it
+            yield vocals[:-overlap]
+            tail = vocals[-overlap:]
+        if tail is not None:
+            yield tail
+
+    def _windows(self, audio_path):
+        sample_rate = self.model.samplerate
+        window = self.chunk_seconds * sample_rate
+        hop = window - self.overlap_seconds * sample_rate
+
+        # frames are copied once, into the window being filled
+        buffer = np.zeros((self.model.audio_channels, window), dtype=np.float32)
+        filled = 0
+        emitted = False
+        for frame in self._decode(audio_path, sample_rate):
+            while frame.shape[1]:
+                taken = min(window - filled, frame.shape[1])
+                buffer[:, filled : filled + taken] = frame[:, :taken]
+                filled += taken
+                frame = frame[:, taken:]
+                if filled < window:
+                    break
+                yield buffer
+                emitted = True
+                # the next window starts with this one's overlap
+                previous = buffer
+                buffer = np.zeros_like(previous)
+                filled = window - hop
+                buffer[:, :filled] = previous[:, hop:]
+        # the last overlap is already covered by the previous window
+        if not emitted or filled > window - hop:
+            yield buffer[:, :filled]
+
+    def _decode(self, audio_path, sample_rate):
+        resampler = av.audio.resampler.AudioResampler(
+            format="fltp", layout="stereo", rate=sample_rate
+        )
+        with av.open(audio_path, metadata_errors="ignore") as container:
+            for frame in container.decode(audio=0):
+                for resampled in resampler.resample(frame):
+                    yield resampled.to_ndarray()
+            for resampled in resampler.resample(None):
+                yield resampled.to_ndarray()
+
+    def _separate_window(self, window):
+        mix = torch.from_numpy(np.ascontiguousarray(window)).to(self.device)
+        ref = mix.mean(0)
+        mean, std = ref.mean(), ref.std() + 1e-8
+        with torch.inference_mode():
+            sources = apply_model(
+                self.model,
+                ((mix - mean) / std)[None],
+                device=self.device,
+                split=True,
+                overlap=0.25,
+                progress=False,
+            )[0]
+            vocals = (sources[self.vocals_index] * std + mean).mean(0)
+            vocals = torchaudio.functional.resample(
+                vocals, self.model.samplerate, SAMPLE_RATE
+            )
+        return vocals.float().cpu().numpy()
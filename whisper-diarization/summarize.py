@@ -0,0 +1,239 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import make_cache_key
+from metrics import OZWELL_ERRORS, OZWELL_REQUEST_SECONDS, STAGE_SECONDS
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+SUMMARY_PROMPT = "Provide a clear, concise summary of the following conversation:\n\n{transcript}"
+# chunk prompts must not depend on the chunk's position, or inserting one
+# chunk would invalidate the cached summaries of all the following ones
+CHUNK_PROMPT = (
+    "The following is one part of a longer conversation. "
+    "Summarize this part, keeping every fact, complaint, finding, decision "
+    "and instruction along with who said it:\n\n{transcript}"
+)
+REDUCE_PROMPT = (
+    "The following are summaries of consecutive parts of one conversation. "
+    "Combine them into a single clear, concise summary of the whole "
+    "conversation:\n\n{summaries}"
+)
+
+
+def split_transcript(transcript, max_chars=12000, min_chars=4000):
+    """
+    Split a speaker-aware transcript (see `get_speaker_aware_transcript`) into
+    chunks of whole speaker turns.
+
+    Chunk boundaries are content-defined: a chunk may end after any turn
+    whose hash hits a fixed pattern once it holds `min_chars`, and must end
+    before it would exceed `max_chars`. An edit therefore only moves the
+    boundaries around it and the other chunks stay byte-identical, which
+    keeps their cached summaries valid. Turns longer than `max_chars` are
+    split at sentence ends.
+    """
+    turns = []
+    for turn in transcript.strip().split("\n\n"):
+        turn = turn.strip()
+        while len(turn) > max_chars:
+            cut = turn.rfind(". ", 0, max_chars)
+            cut = cut + 1 if cut > 0 else max_chars
+            turns.append(turn[:cut].strip())
+            turn = turn[cut:].strip()
+        if turn:
+            turns.append(turn)
+
+    chunks, current, size = [], [], 0
+    for turn in turns:
+        if current and size + len(turn) > max_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(turn)
+        size += len(turn) + 2
+        turn_hash = int(hashlib.sha256(turn.encode("utf-8")).hexdigest()[:8], 16)
+        if size >= min_chars and turn_hash % 4 == 0:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class OzwellError(RuntimeError):
+    """Raised when the Ozwell API can't produce a completion."""
+
+
+class OzwellClient:
+    """
+    Thin client for the Ozwell completion API.
+
+    Uses one pooled keep-alive `requests.Session`, (connect, read) timeouts
+    on every call and retries connection errors, timeouts and 429/5xx
+    responses with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        base_url="https://ai.bluehive.com/api/v1",
+        timeout=(5, 120),
+        max_retries=3,
+        backoff=1.0,
+        pool_size=8,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(
+            {
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            }
+        )
+
+    def post(self, path, **kwargs):
+        """POST to `path` with retries; returns the last `requests.Response`."""
+        path = path.lstrip("/")
+        url = f"{self.base_url}/{path}"
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                OZWELL_ERRORS.inc(path=path, reason=type(e).__name__)
+                if attempt == self.max_retries:
+                    OZWELL_REQUEST_SECONDS.observe(time.perf_counter() - start, path=path)
+                    raise
+                time.sleep(self.backoff * 2**attempt)
+                continue
+
+            if not response.ok:
+                OZWELL_ERRORS.inc(path=path, reason=str(response.status_code))
+            if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                OZWELL_REQUEST_SECONDS.observe(time.perf_counter() - start, path=path)
+                return response
+
+            retry_after = response.headers.get("Retry-After", "")
+            time.sleep(
+                float(retry_after) if retry_after.isdigit() else self.backoff * 2**attempt
+            )
+
+    def complete(self, prompt, system_message, temperature=0.0, max_tokens=500):
+        payload = {
+            "prompt": prompt,
+            "systemMessage": system_message,
+            "temperature": temperature,
+            "maxTokens": max_tokens,
+        }
+        try:
+            response = self.post("completion", json=payload)
+        except requests.RequestException as e:
+            raise OzwellError(f"Ozwell request failed: {e}") from e
+
+        if not response.ok:
+            raise OzwellError(
+                f"Ozwell returned {response.status_code}: {response.text[:200]}"
+            )
+        try:
+            return response.json()["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError) as e:
+            raise OzwellError(f"Unexpected Ozwell response: {e}") from e
+
+
+class SummaryService:
+    """
+    Runs transcript summarization on its own small thread pool so it never
+    holds up the diarization workers. Summaries are cached per transcript
+    hash and system prompt.
+
+    Transcripts longer than `chunk_chars` are summarized map-reduce style:
+    the chunks from `split_transcript` are summarized in parallel on a
+    separate pool of `chunk_concurrency` threads and a final pass combines
+    them. Chunk summaries are cached individually, so re-summarizing an
+    edited transcript only recomputes the chunks that changed.
+    """
+
+    def __init__(
+        self,
+        client,
+        cache=None,
+        max_workers=2,
+        chunk_chars=12000,
+        chunk_concurrency=4,
+    ):
+        self.client = client
+        self.cache = cache
+        self.chunk_chars = chunk_chars
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="summary"
+        )
+        # chunks get their own pool so map tasks never wait behind the
+        # summaries that are waiting for them
+        self.chunk_executor = ThreadPoolExecutor(
+            max_workers=chunk_concurrency, thread_name_prefix="summary-chunk"
+        )
+
+    def _cached_complete(self, prompt, system_message, max_tokens):
+        cache_key = make_cache_key(
+            hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+            system_message=system_message,
+            max_tokens=max_tokens,
+        )
+        if self.cache is not None:
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                return entry["summary"]
+
+        summary = self.client.complete(prompt, system_message, max_tokens=max_tokens)
+        if self.cache is not None:
+            self.cache.put(cache_key, {"summary": summary})
+        return summary
+
+    def summarize(self, transcript, system_message, max_tokens=500):
+        start = time.perf_counter()
+        try:
+            return self._summarize(transcript, system_message, max_tokens)
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage="summary")
+
+    def _summarize(self, transcript, system_message, max_tokens):
+        if len(transcript) <= self.chunk_chars:
+            return self._cached_complete(
+                SUMMARY_PROMPT.format(transcript=transcript), system_message, max_tokens
+            )
+
+        chunks = split_transcript(
+            transcript, max_chars=self.chunk_chars, min_chars=self.chunk_chars // 3
+        )
+        futures = [
+            self.chunk_executor.submit(
+                self._cached_complete,
+                CHUNK_PROMPT.format(transcript=chunk),
+                system_message,
+                max_tokens,
+            )
+            for chunk in chunks
+        ]
+        summaries = "\n\n".join(
+            f"Part {i}:\n{future.result()}" for i, future in enumerate(futures, start=1)
+        )
+        return self._cached_complete(
+            REDUCE_PROMPT.format(summaries=summaries), system_message, max_tokens
+        )
+
+    def submit(self, transcript, system_message, max_tokens=500):
+        """Summarize in the background; returns a `Future` of the summary."""
+        return self.executor.submit(
+            self.summarize, transcript, system_message, max_tokens
+        )
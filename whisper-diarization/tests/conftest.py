@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules live flat in the project root, next to diarize.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
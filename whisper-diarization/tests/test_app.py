@@ -0,0 +1,55 @@
+import pytest
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    cache_dir = tmp_path_factory.mktemp("cache")
+    with pytest.MonkeyPatch.context() as patch:
+        # importing the app creates its caches
+        patch.setenv("SUMMARY_CACHE_DIR", str(cache_dir / "summaries"))
+        patch.setenv("RESULT_CACHE_DIR", str(cache_dir / "results"))
+        yield pytest.importorskip("app")
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("auto", "auto"),
+        (" AUTO ", "auto"),
+        ("true", True),
+        ("1", True),
+        ("Yes", True),
+        ("false", False),
+        ("0", False),
+        ("no", False),
+    ],
+)
+def test_parse_stemming(app, value, expected):
+    parsed = app.parse_stemming(value)
+    assert parsed == expected and type(parsed) is type(expected)
+
+
+def test_parse_stemming_rejects_other_values(app):
+    with pytest.raises(ValueError):
+        app.parse_stemming("maybe")
+    with pytest.raises(ValueError):
+        app.parse_stemming("")
+
+
+def test_default_pipeline_options(app):
+    assert app.PIPELINE_OPTIONS["stemming"] == "auto"
+    assert app.PIPELINE_OPTIONS["alignment"] == "ctc"
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("ctc", "ctc"), ("whisper", "whisper"), (" Whisper\n", "whisper")],
+)
+def test_parse_alignment(app, value, expected):
+    assert app.parse_alignment(value) == expected
+
+
+@pytest.mark.parametrize("value", ["wav2vec2", "", "true"])
+def test_parse_alignment_rejects_other_values(app, value):
+    with pytest.raises(ValueError):
+        app.parse_alignment(value)
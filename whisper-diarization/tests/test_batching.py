@@ -0,0 +1,174 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+import batching  # noqa: E402
+from batching import GROW_AFTER, AdaptiveForward, BatchSizer, is_oom  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def plenty_of_memory(monkeypatch):
+    monkeypatch.setattr(batching, "free_memory", lambda device: None)
+
+
+class OutOfMemoryAbove:
+    """A batch function that runs out of memory on batches above `limit`."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.sizes = []
+
+    def __call__(self, batch):
+        self.sizes.append(len(batch))
+        if len(batch) > self.limit:
+            raise RuntimeError("CUDA failed with error out of memory")
+        return list(batch)
+
+
+def test_is_oom():
+    assert is_oom(RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB"))
+    assert is_oom(RuntimeError("CUDA failed with error out of memory"))
+    assert is_oom(MemoryError())
+    assert not is_oom(RuntimeError("shape mismatch"))
+    assert not is_oom(ValueError("out of memory"))
+
+
+def test_oom_halves_the_size_and_retries_the_batch(tmp_path):
+    sizer = BatchSizer(str(tmp_path / "sizes.json"), initial=16)
+    sizes = sizer.get("whisper", model_name="tiny", device="cpu")
+    fn = OutOfMemoryAbove(5)
+    results = sizes.run(list(range(40)), fn)
+
+    assert [item for batch in results for item in batch] == list(range(40))
+    assert fn.sizes[:3] == [16, 8, 4]
+    assert sizes.state["ceiling"] <= 8
+    # the backoff is saved right away
+    with open(tmp_path / "sizes.json") as f:
+        assert list(json.load(f).values())[0]["ceiling"] == sizes.state["ceiling"]
+
+
+def test_grows_after_full_batches_but_stays_below_the_ceiling():
+    sizer = BatchSizer(None, initial=2, maximum=64)
+    sizes = sizer.get("whisper", device="cpu")
+    fn = OutOfMemoryAbove(5)
+    sizes.run(list(range(400)), fn)
+    assert fn.sizes[: GROW_AFTER + 1] == [2] * GROW_AFTER + [4]
+    # a size that ran out of memory is never tried again, and the size
+    # settles on the largest one that fits
+    for i, size in enumerate(fn.sizes):
+        if size > fn.limit:
+            assert all(later < size for later in fn.sizes[i + 1 :])
+    assert sizes.current == fn.limit
+
+
+def test_never_above_maximum():
+    sizes = BatchSizer(None, initial=4, maximum=8).get("whisper", device="cpu")
+    fn = OutOfMemoryAbove(100)
+    sizes.run(list(range(200)), fn)
+    assert max(fn.sizes) > 5
+
+
+def test_other_errors_and_single_items_are_raised():
+    sizes = BatchSizer(None, initial=4).get("whisper", device="cpu")
+
+    def fail(batch):
+        raise RuntimeError("shape mismatch")
+
+    with pytest.raises(RuntimeError, match="shape mismatch"):
+        sizes.run([1, 2, 3], fail)
+    with pytest.raises(RuntimeError, match="out of memory"):
+        sizes.run([1, 2, 3], OutOfMemoryAbove(0))
+
+
+def test_capped_by_free_memory(monkeypatch):
+    monkeypatch.setattr(batching, "free_memory", lambda device: 10 * 2**30)
+    sizes = BatchSizer(None, initial=64, maximum=64).get("whisper", device="cpu")
+    # 80% of 10 GiB at the default 256 MiB per item
+    assert sizes.size() == 32
+    sizes.succeeded(32, item_bytes=2**30)
+    assert sizes.size() == 8
+
+
+def test_best_size_is_kept_across_runs(tmp_path):
+    path = str(tmp_path / "sizes.json")
+    sizer = BatchSizer(path, initial=4)
+    sizer.get("alignment", device="cpu").run(list(range(100)), OutOfMemoryAbove(100))
+    sizer.save()
+    best = sizer.stats()[next(iter(sizer.stats()))]["best"]
+    assert best > 4
+
+    reloaded = BatchSizer(path, initial=4).get("alignment", device="cpu")
+    assert reloaded.current == best
+    assert BatchSizer(path, initial=4).get("alignment", device="cuda:1").current == 4
+
+
+def test_adaptive_forward_splits_and_concatenates():
+    class Model:
+        dtype = torch.float32
+
+        def __call__(self, batch):
+            return SimpleNamespace(logits=batch * 2)
+
+    sizes = BatchSizer(None, initial=3).get("alignment", device="cpu")
+    forward = AdaptiveForward(Model(), sizes)
+    batch = torch.arange(10, dtype=torch.float32).reshape(10, 1)
+    assert torch.equal(forward(batch).logits, batch * 2)
+    assert forward.dtype == torch.float32
+
+
+def test_old_ceiling_is_raised_again(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(batching.time, "time", lambda: clock[0])
+    sizes = BatchSizer(None, initial=2, maximum=64).get("whisper", device="cpu")
+    fn = OutOfMemoryAbove(5)
+    sizes.run(list(range(400)), fn)
+    ceiling = sizes.state["ceiling"]
+    assert ceiling is not None
+
+    # the memory got freed, but the ceiling holds until it expires
+    fn.limit = 100
+    fn.sizes = []
+    sizes.run(list(range(400)), fn)
+    assert max(fn.sizes) < ceiling
+
+    clock[0] += batching.CEILING_TTL + 1
+    fn.sizes = []
+    sizes.run(list(range(1000)), fn)
+    assert max(fn.sizes) > ceiling
+    assert sizes.state["ceiling"] is None
+
+
+def test_expired_ceiling_from_an_earlier_run(tmp_path):
+    path = tmp_path / "sizes.json"
+    key = 'whisper:{"device": "cpu"}'
+    entry = {"best": 4, "ceiling": 5, "item_bytes": None}
+    path.write_text(json.dumps({key: {**entry, "ceiling_at": 0}}))
+    sizes = BatchSizer(str(path)).get("whisper", device="cpu")
+    fn = OutOfMemoryAbove(100)
+    sizes.run(list(range(100)), fn)
+    assert max(fn.sizes) > 5
+
+
+def test_save_merges_with_other_processes(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(batching.time, "time", lambda: clock[0])
+    path = str(tmp_path / "sizes.json")
+    first, second = BatchSizer(path, initial=4), BatchSizer(path, initial=4)
+    first.get("whisper", device="cpu").run(list(range(8)), OutOfMemoryAbove(100))
+    first.save()
+    clock[0] += 1
+    second.get("whisper", device="cpu").failed(4)
+    second.get("alignment", device="cpu").run(list(range(8)), OutOfMemoryAbove(100))
+    second.save()
+    clock[0] += 1
+    # an earlier process saving again doesn't drop the newer out of memory error
+    first.save()
+
+    with open(path) as f:
+        saved = json.load(f)
+    assert set(saved) == {'whisper:{"device": "cpu"}', 'alignment:{"device": "cpu"}'}
+    assert saved['whisper:{"device": "cpu"}']["ceiling"] == 4
+    assert first.get("whisper", device="cpu").state["ceiling"] == 4
@@ -0,0 +1,133 @@
+import os
+import time
+
+import numpy as np
+
+from cache import ArrayCache, ResultCache, hash_file, make_cache_key
+
+
+def age(cache, key, seconds_ago):
+    path = cache._path(key)
+    mtime = time.time() - seconds_ago
+    os.utime(path, (mtime, mtime))
+
+
+def test_hash_file_matches_content(tmp_path):
+    a, b, c = tmp_path / "a", tmp_path / "b", tmp_path / "c"
+    a.write_bytes(b"audio" * 1000)
+    b.write_bytes(b"audio" * 1000)
+    c.write_bytes(b"audio" * 999)
+    assert hash_file(str(a), chunk_size=7) == hash_file(str(b))
+    assert hash_file(str(a)) != hash_file(str(c))
+
+
+def test_cache_key_ignores_param_order():
+    assert make_cache_key("abc", model="medium", language="en") == make_cache_key(
+        "abc", language="en", model="medium"
+    )
+    assert make_cache_key("abc", model="medium") != make_cache_key(
+        "abd", model="medium"
+    )
+    assert make_cache_key("abc", model="medium") != make_cache_key("abc", model="large")
+
+
+def test_result_round_trip(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = make_cache_key("abc")
+    assert cache.get(key) is None
+    cache.put(key, {"transcript": "hello", "words": [1, 2]})
+    assert cache.get(key) == {"transcript": "hello", "words": [1, 2]}
+    assert not [
+        name
+        for _, _, names in os.walk(tmp_path)
+        for name in names
+        if name.endswith(".tmp")
+    ]
+
+
+def test_evicts_least_recently_used(tmp_path):
+    entry = {"text": "x" * 1000}
+    cache = ResultCache(str(tmp_path), max_bytes=2500)
+    keys = [make_cache_key(str(i)) for i in range(3)]
+    cache.put(keys[0], entry)
+    cache.put(keys[1], entry)
+    age(cache, keys[0], 20)
+    age(cache, keys[1], 10)
+    # reading the oldest entry makes it the most recently used
+    assert cache.get(keys[0]) == entry
+    cache.put(keys[2], entry)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == entry
+    assert cache.get(keys[2]) == entry
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = make_cache_key("abc")
+    cache.put(key, {"a": 1})
+    with open(cache._path(key), "w") as f:
+        f.write("{not json")
+    assert cache.get(key) is None
+
+
+def test_clear(tmp_path):
+    cache = ResultCache(str(tmp_path / "results"))
+    key = make_cache_key("abc")
+    cache.put(key, {"a": 1})
+    cache.clear()
+    assert cache.get(key) is None
+    assert os.path.isdir(tmp_path / "results")
+
+
+def test_array_round_trip(tmp_path):
+    cache = ArrayCache(str(tmp_path))
+    emissions = np.random.default_rng(0).standard_normal((50, 32)).astype(np.float32)
+    cache.put("a" * 64, emissions)
+    loaded = cache.get("a" * 64)
+    assert loaded.dtype == np.float32
+    np.testing.assert_array_equal(loaded, emissions)
+
+    stems = {"vocals": np.ones((2, 8), dtype=np.float32), "rate": np.array(16000)}
+    cache.put("b" * 64, stems)
+    loaded = cache.get("b" * 64)
+    assert sorted(loaded) == ["rate", "vocals"]
+    np.testing.assert_array_equal(loaded["vocals"], stems["vocals"])
+    assert int(loaded["rate"]) == 16000
+
+
+def test_directory_is_only_walked_when_over_budget(tmp_path, monkeypatch):
+    walks = []
+    walk = os.walk
+    monkeypatch.setattr("cache.os.walk", lambda root: walks.append(root) or walk(root))
+    entry = {"text": "x" * 1000}
+    cache = ResultCache(str(tmp_path), max_bytes=5500)
+    for i in range(5):
+        cache.put(make_cache_key(str(i)), entry)
+        age(cache, make_cache_key(str(i)), 10 - i)
+    # the first put counts what is already there, the others add up
+    assert len(walks) == 1
+    # replacing an entry doesn't grow the store
+    cache.put(make_cache_key("0"), entry)
+    assert len(walks) == 1
+    cache.put(make_cache_key("5"), entry)
+    assert len(walks) == 2
+    assert cache.get(make_cache_key("1")) is None
+    assert cache.get(make_cache_key("0")) == entry
+
+
+def test_rescans_for_entries_written_by_other_processes(tmp_path):
+    entry = {"text": "x" * 1000}
+    cache = ResultCache(str(tmp_path), max_bytes=2500)
+    other = ResultCache(str(tmp_path), max_bytes=2500)
+    cache.rescan_every = 3
+    cache.put(make_cache_key("a"), entry)
+    age(cache, make_cache_key("a"), 30)
+    for i in range(3):
+        other.put(make_cache_key(str(i)), entry)
+        age(cache, make_cache_key(str(i)), 20 - i)
+    cache.put(make_cache_key("b"), entry)
+    cache.put(make_cache_key("c"), entry)
+    # the third put recounts and evicts down to the budget
+    names = [name for _, _, names in os.walk(tmp_path) for name in names]
+    assert len(names) == 2
+    assert cache.get(make_cache_key("c")) == entry
@@ -0,0 +1,318 @@
+import collections
+import contextlib
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from cache import make_cache_key
+
+pipeline = pytest.importorskip("pipeline")
+
+ALL_STAGES = {"emissions", "alignment", "vad", "msdd", "punctuation", "write"}
+
+
+class FakeMSDD:
+    def __init__(self, count):
+        self.count = count
+        self._cfg = SimpleNamespace(diarizer=SimpleNamespace())
+
+    def diarize(self):
+        self.count("msdd")
+        out_dir = self._cfg.diarizer.out_dir
+        os.makedirs(os.path.join(out_dir, "pred_rttms"), exist_ok=True)
+        rttm_path = os.path.join(
+            out_dir, "pred_rttms", f"{os.path.basename(out_dir)}.rttm"
+        )
+        with open(rttm_path, "w") as f:
+            f.write("SPEAKER x 1 0.000 1.000 <NA> <NA> speaker_0 <NA> <NA>\n")
+
+
+def whisper_words(transcript):
+    return [
+        {"text": word, "start": i, "end": i + 0.5}
+        for i, word in enumerate(transcript.split())
+    ]
+
+
+class FakeRegistry:
+    def __init__(self, models):
+        self.models = models
+
+    def get(self, kind, **params):
+        return self.models[kind]
+
+    def lock(self, kind, **params):
+        return contextlib.nullcontext()
+
+    def stats(self):
+        return {}
+
+
+class StubbedPipeline:
+    """
+    A `DiarizationPipeline` whose stages are stubs that count their calls.
+    """
+
+    def __init__(self, tmp_path, monkeypatch, batch_size=8, artifacts=True):
+        self.tmp_path = tmp_path
+        self.calls = collections.Counter()
+        self.fail = set()
+        self.msdd = FakeMSDD(self._count)
+        diarizer = pipeline.DiarizationPipeline(
+            model_name="tiny",
+            device="cpu",
+            batch_size=batch_size,
+            punct_model_name="punctuation",
+            artifact_dir=str(tmp_path / "artifacts") if artifacts else None,
+            stem_cache_dir=None,
+            registry=FakeRegistry({"msdd": self.msdd}),
+        )
+        diarizer._write_vad_manifest = lambda *args: "manifest.json"
+        diarizer._generate_emissions = self._counted(
+            "emissions",
+            lambda waveform: {
+                "emissions": np.ones((4, 3), dtype=np.float32),
+                "stride": np.array(20),
+            },
+        )
+        diarizer._align = self._counted(
+            "alignment",
+            lambda emissions, transcript, language: [
+                {"text": word, "start": i, "end": i + 1}
+                for i, word in enumerate(transcript.split())
+            ],
+        )
+        diarizer._detect_speech = self._counted("vad", lambda waveform: [[0.0, 1.0]])
+        diarizer._restore_punctuation = self._counted(
+            "punctuation", lambda wsm, language: wsm
+        )
+        self.diarizer = diarizer
+
+        monkeypatch.setattr(
+            pipeline,
+            "get_words_speaker_mapping",
+            lambda words, speaker_ts, anchor: [
+                {"word": word["text"], "anchor": anchor, "speaker": 0} for word in words
+            ],
+        )
+        monkeypatch.setattr(pipeline, "write_wav", lambda *args: None)
+        monkeypatch.setattr(
+            pipeline, "read_speaker_timestamps", lambda path: [[0, 1000, 0]]
+        )
+        monkeypatch.setattr(
+            pipeline, "get_realigned_ws_mapping_with_punctuation", lambda wsm: wsm
+        )
+        monkeypatch.setattr(
+            pipeline,
+            "get_sentences_speaker_mapping",
+            self._counted("write", lambda wsm, speaker_ts: []),
+        )
+        monkeypatch.setattr(
+            pipeline, "get_speaker_aware_transcript", lambda ssm, f: None
+        )
+        monkeypatch.setattr(pipeline, "write_srt", lambda ssm, f: None)
+
+    def _count(self, stage):
+        self.calls[stage] += 1
+        if stage in self.fail:
+            raise RuntimeError(f"{stage} failed")
+
+    def _counted(self, stage, fn):
+        def run(*args):
+            self._count(stage)
+            return fn(*args)
+
+        return run
+
+    def run(
+        self,
+        transcript="hello there",
+        audio_hash="audio",
+        word_anchor="start",
+        alignment="ctc",
+    ):
+        self.calls.clear()
+        workspace = self.tmp_path / "workspace"
+        workspace.mkdir(exist_ok=True)
+        input_key = make_cache_key(audio_hash, stemming=False)
+        return self.diarizer._diarize_transcript(
+            str(self.tmp_path / "audio.wav"),
+            str(workspace),
+            {},
+            np.zeros(16000, dtype=np.float32),
+            lambda: (
+                (transcript, "en")
+                if alignment == "ctc"
+                else (transcript, "en", whisper_words(transcript))
+            ),
+            None,
+            {
+                "input": input_key,
+                "whisper": make_cache_key(
+                    input_key, stage="transcript", transcript=transcript
+                ),
+            },
+            word_anchor=word_anchor,
+            alignment=alignment,
+        )
+
+    @property
+    def computed(self):
+        return {stage for stage, count in self.calls.items() if count}
+
+
+@pytest.fixture
+def stubbed(tmp_path, monkeypatch):
+    return StubbedPipeline(tmp_path, monkeypatch)
+
+
+def test_rerun_loads_every_stage(stubbed):
+    first = stubbed.run()
+    assert stubbed.computed == ALL_STAGES
+    second = stubbed.run()
+    # only the outputs are written again
+    assert stubbed.computed == {"write"}
+    assert second["words"] == first["words"]
+    assert second["speaker_ts"] == first["speaker_ts"]
+
+
+def test_downstream_parameter_only_recomputes_downstream(stubbed):
+    stubbed.run(word_anchor="start")
+    result = stubbed.run(word_anchor="mid")
+    assert stubbed.computed == {"punctuation", "write"}
+    assert result["words"][0]["anchor"] == "mid"
+
+
+def test_new_transcript_keeps_emissions_and_speakers(stubbed):
+    stubbed.run(transcript="hello there")
+    result = stubbed.run(transcript="hello again")
+    assert stubbed.computed == {"alignment", "punctuation", "write"}
+    assert [word["word"] for word in result["words"]] == ["hello", "again"]
+
+
+def test_new_audio_recomputes_everything(stubbed):
+    stubbed.run(audio_hash="audio")
+    stubbed.run(audio_hash="other audio")
+    assert stubbed.computed == ALL_STAGES
+
+
+def test_failed_run_resumes_after_the_last_finished_stage(stubbed):
+    stubbed.fail.add("msdd")
+    with pytest.raises(RuntimeError, match="msdd failed"):
+        stubbed.run()
+    stubbed.fail.clear()
+    stubbed.run()
+    assert stubbed.computed == {"msdd", "punctuation", "write"}
+
+
+def test_batch_size_invalidates_emissions(tmp_path, monkeypatch):
+    StubbedPipeline(tmp_path, monkeypatch, batch_size=8).run()
+    stubbed = StubbedPipeline(tmp_path, monkeypatch, batch_size=16)
+    stubbed.run()
+    assert stubbed.computed == {"emissions", "alignment", "punctuation", "write"}
+
+
+def test_whisper_key_chains_from_the_input_key(stubbed):
+    diarizer = stubbed.diarizer
+    input_key = make_cache_key("audio", stemming=False)
+    key = diarizer._whisper_key(input_key, "en", False)
+    assert key == diarizer._whisper_key(input_key, "en", False)
+    assert key != diarizer._whisper_key(
+        make_cache_key("audio", stemming=True), "en", False
+    )
+    assert key != diarizer._whisper_key(input_key, "en", True)
+    assert key != diarizer._whisper_key(input_key, "en", False, word_timestamps=True)
+    assert diarizer._vad_key(input_key) != diarizer._vad_key(
+        make_cache_key("audio", stemming=True)
+    )
+
+
+def test_whisper_word_timings_skip_the_ctc_stages(stubbed):
+    result = stubbed.run(alignment="whisper")
+    assert stubbed.computed == {"vad", "msdd", "punctuation", "write"}
+    assert [word["word"] for word in result["words"]] == ["hello", "there"]
+    # the words are part of the Whisper checkpoint, a CTC run doesn't reuse them
+    stubbed.run(alignment="whisper")
+    assert stubbed.computed == {"write"}
+    stubbed.run(alignment="ctc")
+    assert stubbed.computed == {"emissions", "alignment", "punctuation", "write"}
+
+
+def test_no_artifact_dir_computes_every_time(tmp_path, monkeypatch):
+    stubbed = StubbedPipeline(tmp_path, monkeypatch, artifacts=False)
+    stubbed.run()
+    stubbed.run()
+    assert stubbed.computed == ALL_STAGES
+
+
+def test_single_file_transcription_decodes_the_vad_chunks(stubbed):
+    diarizer = stubbed.diarizer
+    diarizer.batch_sizer.path = None
+    audio_path = stubbed.tmp_path / "audio.wav"
+    audio_path.write_bytes(b"audio")
+    diarizer._prepare = lambda path, timings, stemming, progress: (
+        np.zeros(16000, dtype=np.float32),
+        None,
+    )
+    diarizer._detect_speech = stubbed._counted(
+        "vad", lambda waveform: [{"start": 0.0, "end": 1.0, "segments": [[0.0, 1.0]]}]
+    )
+    decoded = []
+
+    def transcribe_files(files, language, suppress_numerals, progress, word_timestamps):
+        decoded.append([file["vad_segments"] for file in files])
+        for file in files:
+            file["texts"] = ["hello there"]
+        return [("hello there", "en", None)]
+
+    diarizer._transcribe_files = transcribe_files
+    result = diarizer.diarize(str(audio_path), stemming=False)
+    # VAD runs once and its chunks go through the batched Whisper loop
+    assert stubbed.calls["vad"] == 1
+    assert decoded == [[[{"start": 0.0, "end": 1.0, "segments": [[0.0, 1.0]]}]]]
+    assert [word["word"] for word in result["words"]] == ["hello", "there"]
+    assert (stubbed.tmp_path / "audio_whisper_segments.txt").read_text() == (
+        "0.00 --> 1.00: hello there\n"
+    )
+
+    stubbed.calls.clear()
+    diarizer.diarize(str(audio_path), stemming=False)
+    assert stubbed.computed == {"write"}
+    assert len(decoded) == 1
+
+
+def test_batch_files_report_their_own_total(stubbed, monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(pipeline.time, "perf_counter", lambda: clock[0])
+    diarizer = stubbed.diarizer
+    diarizer.batch_sizer.path = None
+
+    def prepare(path, timings, stemming, progress):
+        clock[0] += 10
+        return np.zeros(16000, dtype=np.float32), None
+
+    def transcribe_files(files, language, suppress_numerals, progress, word_timestamps):
+        clock[0] += 5
+        return [("hello there", "en", None) for _ in files]
+
+    diarizer._prepare = prepare
+    diarizer._transcribe_files = transcribe_files
+    paths = []
+    for name in ("a", "b"):
+        path = stubbed.tmp_path / f"{name}.wav"
+        path.write_bytes(name.encode())
+        paths.append(str(path))
+
+    results = dict(diarizer.diarize_batch(paths, stemming=False))
+    for path in paths:
+        assert results[path]["timings"]["total"] == 15
+    assert results[paths[-1]]["timings"]["batch_total"] == 25
+
+
+def test_unknown_alignment_is_rejected(stubbed):
+    with pytest.raises(ValueError, match="alignment"):
+        stubbed.diarizer.diarize("missing.wav", alignment="wav2vec2")
+    with pytest.raises(ValueError, match="alignment"):
+        list(stubbed.diarizer.diarize_batch(["missing.wav"], alignment="wav2vec2"))
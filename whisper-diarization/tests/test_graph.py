@@ -0,0 +1,87 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from graph import StageGraph
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+def test_results_flow_to_dependents_in_order(executor):
+    graph = StageGraph(executor)
+    graph.add("a", lambda: 2)
+    graph.add("b", lambda: 3)
+    graph.add("c", lambda a, b: a - b, deps=("a", "b"))
+    graph.add("d", lambda b, a: b - a, deps=("b", "a"))
+    assert graph.run() == {"a": 2, "b": 3, "c": -1, "d": 1}
+
+
+def test_unknown_dependency():
+    graph = StageGraph(None)
+    with pytest.raises(ValueError):
+        graph.add("a", lambda x: x, deps=("missing",))
+
+
+def test_independent_branches_overlap(executor):
+    both_running = threading.Barrier(2, timeout=5)
+    graph = StageGraph(executor)
+    graph.add("whisper", lambda: both_running.wait())
+    graph.add("vad", lambda: both_running.wait())
+    graph.run()
+
+
+def test_single_worker_runs_in_order():
+    calls = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        graph = StageGraph(executor)
+        graph.add("a", lambda: calls.append("a"))
+        graph.add("b", lambda a: calls.append("b"), deps=("a",))
+        graph.add("c", lambda: calls.append("c"))
+        graph.run()
+    assert calls == ["a", "c", "b"]
+
+
+def test_error_waits_for_the_other_branch_and_skips_dependents(executor):
+    finished = []
+
+    def fail():
+        raise RuntimeError("msdd failed")
+
+    def slow():
+        time.sleep(0.1)
+        finished.append("slow")
+
+    graph = StageGraph(executor)
+    graph.add("msdd", fail)
+    graph.add("whisper", slow)
+    graph.add(
+        "punctuation",
+        lambda a, b: finished.append("punctuation"),
+        deps=("msdd", "whisper"),
+    )
+    graph.add(
+        "after_whisper", lambda a: finished.append("after_whisper"), deps=("whisper",)
+    )
+    with pytest.raises(RuntimeError, match="msdd failed"):
+        graph.run()
+    # the running branch finished, nothing new started after the error
+    assert finished == ["slow"]
+    assert "msdd" in graph.spans and "punctuation" not in graph.spans
+
+
+def test_critical_path_follows_the_last_dependency(executor):
+    graph = StageGraph(executor)
+    graph.add("fast", lambda: time.sleep(0.01))
+    graph.add("slow", lambda: time.sleep(0.1))
+    graph.add("join", lambda a, b: None, deps=("fast", "slow"))
+    graph.run()
+    path = graph.critical_path()
+    assert [name for name, _ in path] == ["slow", "join"]
+    assert path[0][1] >= 0.1
+    assert StageGraph(executor).critical_path() == []
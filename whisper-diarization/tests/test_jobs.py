@@ -0,0 +1,174 @@
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import jobs
+from jobs import JobQueue, QueueFullError, gather
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class Recorder:
+    """Handler that records job order; the job with `block=True` holds the worker."""
+
+    def __init__(self):
+        self.order = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, job, context):
+        if job.params.get("block"):
+            self.started.set()
+            self.release.wait(5)
+        else:
+            self.order.append(job.params["name"])
+        return job.params.get("name")
+
+
+def occupy(queue, recorder):
+    job = queue.submit(block=True)
+    recorder.started.wait(5)
+    return job
+
+
+def test_shortest_job_first():
+    recorder = Recorder()
+    queue = JobQueue(recorder, aging_rate=0)
+    occupy(queue, recorder)
+    submitted = [
+        queue.submit(cost=cost, name=name)
+        for name, cost in (("long", 300), ("short", 10), ("mid", 60))
+    ]
+    recorder.release.set()
+    wait_until(lambda: all(job.finished for job in submitted))
+    assert recorder.order == ["short", "mid", "long"]
+    assert [job.result for job in submitted] == ["long", "short", "mid"]
+    assert all(job.queue_wait >= 0 for job in submitted)
+
+
+def test_equal_costs_run_in_submission_order():
+    recorder = Recorder()
+    queue = JobQueue(recorder, aging_rate=0)
+    occupy(queue, recorder)
+    submitted = [queue.submit(cost=5, name=str(i)) for i in range(5)]
+    assert all(job.status == "queued" for job in submitted)
+    recorder.release.set()
+    wait_until(lambda: all(job.finished for job in submitted))
+    assert recorder.order == ["0", "1", "2", "3", "4"]
+    assert queue.get(submitted[0].id) is submitted[0]
+
+
+@pytest.mark.parametrize(
+    "aging_rate, expected", [(0, ["short", "long"]), (1.0, ["long", "short"])]
+)
+def test_waiting_jobs_age(monkeypatch, aging_rate, expected):
+    clock = [1000.0]
+    monkeypatch.setattr(jobs.time, "time", lambda: clock[0])
+    recorder = Recorder()
+    queue = JobQueue(recorder, aging_rate=aging_rate)
+    occupy(queue, recorder)
+    long_job = queue.submit(cost=100, name="long")
+    # the long job has waited 95 s when a 10 s one arrives
+    clock[0] += 95
+    short_job = queue.submit(cost=10, name="short")
+    recorder.release.set()
+    wait_until(lambda: long_job.finished and short_job.finished)
+    assert recorder.order == expected
+
+
+def test_full_queue_rejects_with_retry_after():
+    recorder = Recorder()
+    queue = JobQueue(recorder, max_queue_size=2)
+    occupy(queue, recorder)
+    queue.submit(name="a")
+    queue.submit(name="b")
+    with pytest.raises(QueueFullError) as error:
+        queue.submit(name="c")
+    # no job has finished yet, so there is no average to go by
+    assert error.value.retry_after == 30
+    assert queue.depth == 2
+
+    recorder.release.set()
+    wait_until(lambda: queue.in_flight == 0 and queue.retry_after() < 30)
+    assert queue.depth == 0
+    assert queue.retry_after() >= 1
+    queue.submit(name="c")
+
+
+def test_failed_job_keeps_error_and_worker_survives():
+    def handler(job, context):
+        if job.params["fail"]:
+            raise ValueError("bad audio")
+        return "ok"
+
+    queue = JobQueue(handler)
+    failed = queue.submit(fail=True)
+    done = queue.submit(fail=False)
+    wait_until(lambda: failed.finished and done.finished)
+    assert failed.status == "failed"
+    assert failed.error["message"] == "bad audio"
+    assert done.status == "done" and done.result == "ok"
+    assert [event["status"] for event in failed.follow()] == ["running", "failed"]
+
+
+def test_every_worker_gets_its_own_context():
+    contexts = itertools.count(1)
+
+    def handler(job, context):
+        time.sleep(0.05)
+        return context
+
+    queue = JobQueue(handler, worker_factory=lambda: next(contexts), num_workers=2)
+    submitted = [queue.submit() for _ in range(4)]
+    wait_until(lambda: all(job.finished for job in submitted))
+    assert {job.result for job in submitted} == {1, 2}
+
+
+def test_future_results_finish_the_job_later():
+    future = Future()
+    queue = JobQueue(lambda job, context: future)
+    job = queue.submit()
+    wait_until(lambda: job.status == "running" and queue.depth == 0)
+    assert not job.finished
+    future.set_result({"transcript": "hi"})
+    wait_until(lambda: job.finished)
+    assert job.result == {"transcript": "hi"}
+    assert queue.in_flight == 0
+
+
+def test_tracked_jobs_expose_their_partial_result():
+    future = Future()
+    queue = JobQueue(lambda job, context: None)
+    job = queue.track(future, result={"transcript": "hi"})
+    assert queue.get(job.id) is job
+    assert job.status == "running" and job.result == {"transcript": "hi"}
+    assert queue.in_flight == 1
+    future.set_exception(RuntimeError("summary failed"))
+    assert job.status == "failed"
+    assert job.error["message"] == "summary failed"
+    assert queue.in_flight == 0
+
+
+def test_gather():
+    futures = [Future() for _ in range(3)]
+    gathered = gather(futures)
+    for value, future in reversed(list(enumerate(futures))):
+        assert not gathered.done()
+        future.set_result(value)
+    assert gathered.result() == [0, 1, 2]
+    assert gather([]).result() == []
+
+    failing = [Future(), Future()]
+    gathered = gather(failing)
+    failing[0].set_exception(RuntimeError("boom"))
+    failing[1].set_result(1)
+    with pytest.raises(RuntimeError):
+        gathered.result()
@@ -0,0 +1,136 @@
+import wave
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+live = pytest.importorskip("live")
+
+RATE = live.SAMPLE_RATE
+
+
+def pcm(seconds, level):
+    return (np.full(int(seconds * RATE), level * 32767)).astype(np.int16).tobytes()
+
+
+class FakeWhisper:
+    def __init__(self):
+        self.calls = []
+
+    def transcribe(self, audio, language, initial_prompt=None, **kwargs):
+        self.calls.append((audio.shape[0], initial_prompt))
+        text = "positive" if audio.mean() > 0 else "negative"
+        return [SimpleNamespace(text=f" {text}")], SimpleNamespace(language="en")
+
+
+class FakePipeline:
+    """Non-silent runs are speech, the sign of the audio picks the speaker."""
+
+    def __init__(self):
+        self.whisper_model = FakeWhisper()
+        self.diarized = None
+
+    def _detect_speech(self, audio):
+        speech = np.flatnonzero(np.abs(audio) > 0.01)
+        if not speech.size:
+            return []
+        breaks = np.flatnonzero(np.diff(speech) > 1)
+        starts = np.concatenate([[speech[0]], speech[breaks + 1]])
+        ends = np.concatenate([speech[breaks], [speech[-1]]]) + 1
+        return [
+            {
+                "start": start / RATE,
+                "end": end / RATE,
+                "segments": [[start / RATE, end / RATE]],
+            }
+            for start, end in zip(starts, ends)
+        ]
+
+    def _speaker_embeddings(self, audio, turns):
+        vector = [1.0, 0.0] if audio.mean() > 0 else [0.0, 1.0]
+        return [(0, vector)]
+
+    def diarize_transcribed(self, audio_path, audio, transcript, language, **kwargs):
+        self.diarized = (audio.shape[0], transcript, language, kwargs["vad_segments"])
+        return {"transcript": transcript}
+
+
+def test_finished_regions_get_transcribed_with_speakers():
+    pipeline = FakePipeline()
+    session = live.LiveSession(pipeline)
+    assert session.add_audio(pcm(1, 0.5)) == []
+    [first] = session.add_audio(pcm(1, 0))
+    assert first == {
+        "start": 0.0,
+        "end": 1.0,
+        "speaker": "Speaker 0",
+        "text": "positive",
+    }
+    assert session.language == "en"
+
+    session.add_audio(pcm(1, -0.5))
+    [second] = session.add_audio(pcm(1, 0))
+    assert second == {
+        "start": 2.0,
+        "end": 3.0,
+        "speaker": "Speaker 1",
+        "text": "negative",
+    }
+
+    session.add_audio(pcm(1, 0.5))
+    [third] = session.add_audio(pcm(1, 0))
+    assert third["speaker"] == "Speaker 0"
+    # each region is transcribed once, with the previous text as context
+    assert pipeline.whisper_model.calls == [
+        (RATE, None),
+        (RATE, "positive"),
+        (RATE, "negative"),
+    ]
+
+
+def test_open_region_waits_for_silence():
+    pipeline = FakePipeline()
+    session = live.LiveSession(pipeline)
+    assert session.add_audio(pcm(2, 0.5)) == []
+    assert session.add_audio(pcm(2, 0.5)) == []
+    assert pipeline.whisper_model.calls == []
+    [segment] = session.add_audio(pcm(2, 0))
+    assert (segment["start"], segment["end"]) == (0.0, 4.0)
+
+
+def test_buffer_grows_past_a_minute():
+    session = live.LiveSession(FakePipeline(), step_seconds=1000)
+    for _ in range(7):
+        session.add_audio(pcm(10, 0.25))
+    assert session.samples == 70 * RATE
+    assert session.audio.shape[0] >= 70 * RATE
+    np.testing.assert_allclose(session.audio[: session.samples], 0.25, atol=1e-4)
+
+
+def test_finish_transcribes_the_rest_and_runs_the_pipeline(tmp_path):
+    pipeline = FakePipeline()
+    session = live.LiveSession(pipeline)
+    session.add_audio(pcm(1, 0.5))
+    session.add_audio(pcm(1, 0))
+    # still speaking when the recording stops
+    session.add_audio(pcm(1, -0.5))
+    path = str(tmp_path / "live.wav")
+    remaining, result = session.finish(path)
+
+    assert [segment["text"] for segment in remaining] == ["negative"]
+    assert result == {"transcript": "positive negative"}
+    samples, transcript, language, vad_segments = pipeline.diarized
+    assert samples == 3 * RATE and language == "en"
+    assert [(region["start"], region["end"]) for region in vad_segments] == [
+        (0, 1),
+        (2, 3),
+    ]
+    with wave.open(path) as f:
+        assert f.getnframes() == 3 * RATE and f.getframerate() == RATE
+
+
+def test_finish_without_speech():
+    session = live.LiveSession(FakePipeline())
+    session.add_audio(pcm(3, 0))
+    with pytest.raises(ValueError):
+        session.finish("unused.wav")
@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+
+longform = pytest.importorskip("longform")
+
+SAMPLE_RATE = longform.SAMPLE_RATE
+
+
+def chunked(signal, sizes):
+    start = 0
+    for size in sizes:
+        yield signal[start : start + size]
+        start += size
+    if start < signal.shape[0]:
+        yield signal[start:]
+
+
+def windows_of(seconds, chunk_sizes=(1000,), window_seconds=1.0, overlap_seconds=0.25):
+    signal = np.arange(int(seconds * SAMPLE_RATE), dtype=np.float32)
+    sizes = chunk_sizes * (signal.shape[0] // sum(chunk_sizes) + 1)
+    windows = list(
+        longform.iter_windows(chunked(signal, sizes), window_seconds, overlap_seconds)
+    )
+    return signal, windows
+
+
+@pytest.mark.parametrize("seconds", [0.3, 1.0, 1.5, 1.75, 2.5, 3.2, 10.0])
+@pytest.mark.parametrize("chunk_sizes", [(1000,), (16000,), (37, 20000, 3)])
+def test_windows_cover_the_signal(seconds, chunk_sizes):
+    signal, windows = windows_of(seconds, chunk_sizes)
+    window, hop = SAMPLE_RATE, int(0.75 * SAMPLE_RATE)
+
+    is_last = [is_last for _, _, is_last in windows]
+    assert is_last == [False] * (len(windows) - 1) + [True]
+    for i, (start, waveform, _) in enumerate(windows):
+        offset = round(start * SAMPLE_RATE)
+        assert offset == i * hop
+        expected = signal[offset : offset + waveform.shape[0]]
+        np.testing.assert_array_equal(waveform, expected)
+        if i < len(windows) - 1:
+            assert waveform.shape[0] == window
+    start, waveform, _ = windows[-1]
+    assert round(start * SAMPLE_RATE) + waveform.shape[0] == signal.shape[0]
+
+
+def test_tail_within_the_overlap_is_not_its_own_window():
+    # 1.75 s: the second full window ends exactly at the end
+    _, windows = windows_of(1.75)
+    assert [(start, waveform.shape[0]) for start, waveform, _ in windows] == [
+        (0.0, SAMPLE_RATE),
+        (0.75, SAMPLE_RATE),
+    ]
+
+
+def test_windows_do_not_share_buffers():
+    _, windows = windows_of(3.2)
+    first = windows[0][1].copy()
+    windows[1][1][:] = -1
+    np.testing.assert_array_equal(windows[0][1], first)
+
+
+def test_empty_stream():
+    assert list(longform.iter_windows(iter([]), 1.0, 0.25)) == []
+
+
+def test_owned_ranges_tile_the_recording():
+    window, overlap = 30.0, 5.0
+    starts = [0.0, 25.0, 50.0, 75.0]
+    ranges = [
+        longform.owned_range(start, window, overlap, i == 0, i == len(starts) - 1)
+        for i, start in enumerate(starts)
+    ]
+    assert ranges[0][0] == 0.0
+    assert ranges[-1][1] == float("inf")
+    # neighbours meet in the middle of their overlap
+    for (_, end), (start, _), next_start in zip(ranges, ranges[1:], starts[1:]):
+        assert end == start == next_start + overlap / 2
+    assert longform.owned_range(0.0, window, overlap, True, True) == (0.0, float("inf"))
+
+
+def test_merge_turns_joins_same_speaker_across_windows():
+    turns = [
+        [27000, 30000, 1],
+        [0, 12000, 0],
+        [12000, 27500, 1],
+        [30000, 31000, 0],
+        [40000, 41000, 0],
+    ]
+    assert longform.merge_turns(turns) == [
+        [0, 12000, 0],
+        [12000, 30000, 1],
+        [30000, 31000, 0],
+        [40000, 41000, 0],
+    ]
+
+
+def test_to_rttm():
+    assert longform.to_rttm([[1500, 4000, 2]], "job") == (
+        "SPEAKER job 1   1.500   2.500 <NA> <NA> speaker_2 <NA> <NA>\n"
+    )
+
+
+def test_speaker_linker_matches_embeddings_across_windows():
+    rng = np.random.default_rng(0)
+    alice, bob = rng.standard_normal(192), rng.standard_normal(192)
+    linker = longform.SpeakerLinker(threshold=0.6)
+
+    first = linker.link({0: alice, 1: bob}, [[0, 1000, 0], [1000, 2000, 1]])
+    assert first == {0: 0, 1: 1}
+    # MSDD numbers the speakers of the next window differently
+    noisy_bob = bob + 0.1 * rng.standard_normal(192)
+    second = linker.link({0: noisy_bob, 1: alice}, [[2000, 3000, 0], [3000, 4000, 1]])
+    assert second == {0: 1, 1: 0}
+
+    carol = rng.standard_normal(192)
+    assert linker.link({0: carol}, [[5000, 6000, 0]]) == {0: 2}
+
+
+def test_speaker_without_embedding_goes_to_the_overlapping_speaker():
+    rng = np.random.default_rng(1)
+    alice, bob = rng.standard_normal(192), rng.standard_normal(192)
+    linker = longform.SpeakerLinker()
+    linker.link({0: alice, 1: bob}, [[0, 25000, 0], [25000, 30000, 1]])
+
+    mapping = linker.link({0: None, 1: alice}, [[25000, 27000, 0], [27000, 50000, 1]])
+    assert mapping == {0: 1, 1: 0}
+    # nothing to overlap with: a new speaker
+    assert linker.link({0: None}, [[90000, 91000, 0]]) == {0: 2}
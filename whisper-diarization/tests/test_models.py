@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+
+models = pytest.importorskip("models")
+
+
+class FakeModel:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Registers a "fake" model kind and records its loads."""
+    loads = []
+
+    def load_fake(name, size=100, device="cpu", hf_token=None):
+        loads.append((name, device))
+        time.sleep(0.01)
+        return FakeModel(name, size)
+
+    monkeypatch.setitem(models.LOADERS, "fake", load_fake)
+    # a model's size is what it says, not what the process gained
+    monkeypatch.setattr(models, "_memory_in_use", lambda pool: None)
+    monkeypatch.setattr(models, "_module_bytes", lambda model: model.size)
+    return loads
+
+
+def test_models_are_shared(loads):
+    registry = models.ModelRegistry()
+    model = registry.get("fake", name="a", device="cpu")
+    assert registry.get("fake", device="cpu", name="a") is model
+    assert registry.get("fake", name="a", device="cuda") is not model
+    assert registry.get("fake", name="b", device="cpu") is not model
+    assert loads == [("a", "cpu"), ("a", "cuda"), ("b", "cpu")]
+    assert registry.load_time("fake", name="a", device="cpu") >= 0.01
+    assert registry.load_time("fake", name="c", device="cpu") is None
+
+
+def test_concurrent_gets_load_once(loads):
+    registry = models.ModelRegistry()
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(registry.get("fake", name="a")))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loads == [("a", "cpu")]
+    assert all(result is results[0] for result in results)
+
+
+def test_unload(loads):
+    registry = models.ModelRegistry()
+    model = registry.get("fake", name="a")
+    registry.unload("fake", name="a")
+    assert registry.load_time("fake", name="a") is None
+    assert registry.get("fake", name="a") is not model
+    assert len(loads) == 2
+
+
+def test_one_lock_per_model():
+    registry = models.ModelRegistry()
+    lock = registry.lock("msdd", device="cpu")
+    assert registry.lock("msdd", device="cpu") is lock
+    assert registry.lock("msdd", device="cuda") is not lock
+
+
+def test_least_recently_used_models_are_evicted_over_budget(loads):
+    registry = models.ModelRegistry(max_ram_bytes=250)
+    a = registry.get("fake", name="a")
+    registry.get("fake", name="b")
+    assert registry.get("fake", name="a") is a
+    registry.get("fake", name="c")
+    # "b" was used least recently
+    assert registry.get("fake", name="a") is a
+    assert loads == [("a", "cpu"), ("b", "cpu"), ("c", "cpu")]
+    registry.get("fake", name="b")
+    assert loads[-1] == ("b", "cpu")
+
+    stats = registry.stats()
+    assert stats["models"]["fake"]["evictions"] == 2
+    assert stats["models"]["fake"]["misses"] == 4
+    assert stats["models"]["fake"]["hits"] == 2
+    assert stats["resident_bytes"] == {"ram": 200, "vram": 0}
+    assert stats["budget_bytes"] == {"ram": 250, "vram": None}
+
+
+def test_a_model_larger_than_the_budget_stays_loaded(loads):
+    registry = models.ModelRegistry(max_ram_bytes=250)
+    registry.get("fake", name="a")
+    big = registry.get("fake", name="big", size=400)
+    assert registry.get("fake", name="big", size=400) is big
+    assert registry.stats()["resident_bytes"]["ram"] == 400
+    assert registry.load_time("fake", name="a") is None
+
+
+def test_pools_have_their_own_budgets(loads):
+    registry = models.ModelRegistry(max_ram_bytes=150, max_vram_bytes=None)
+    a = registry.get("fake", name="a")
+    registry.get("fake", name="a", device="cuda", size=1000)
+    registry.get("fake", name="b", device="cuda", size=1000)
+    assert registry.get("fake", name="a") is a
+    assert registry.stats()["resident_bytes"] == {"ram": 100, "vram": 2000}
+
+
+def test_tokens_are_redacted():
+    assert models._loggable({"device": "cuda", "hf_token": "hf_secret"}) == {
+        "device": "cuda",
+        "hf_token": "<redacted>",
+    }
+    # a missing token is still shown as missing
+    assert models._loggable({"hf_token": None}) == {"hf_token": None}
+
+
+def test_load_log_does_not_leak_the_token(loads, capsys):
+    models.ModelRegistry().get("fake", name="vad", hf_token="hf_secret")
+    out = capsys.readouterr().out
+    assert "Loaded fake" in out
+    assert "hf_secret" not in out
+    assert "<redacted>" in out
@@ -0,0 +1,46 @@
+import json
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+import probe
+from probe import FALLBACK_BYTES_PER_SECOND, probe_duration
+
+
+@pytest.fixture
+def audio(tmp_path):
+    path = tmp_path / "audio.webm"
+    path.write_bytes(b"\0" * 8000)
+    return str(path)
+
+
+def ffprobe_returns(monkeypatch, fmt):
+    def run(cmd, **kwargs):
+        return SimpleNamespace(stdout=json.dumps({"format": fmt}).encode())
+
+    monkeypatch.setattr(probe.subprocess, "run", run)
+
+
+def test_duration_from_the_header(monkeypatch, audio):
+    ffprobe_returns(monkeypatch, {"duration": "12.5", "bit_rate": "64000"})
+    assert probe_duration(audio) == 12.5
+
+
+def test_duration_from_the_bit_rate(monkeypatch, audio):
+    ffprobe_returns(monkeypatch, {"duration": "N/A", "bit_rate": "16000"})
+    assert probe_duration(audio) == 4.0
+
+
+@pytest.mark.parametrize("bit_rate", ["0", "N/A", None])
+def test_unusable_bit_rate_falls_back(monkeypatch, audio, bit_rate):
+    ffprobe_returns(monkeypatch, {} if bit_rate is None else {"bit_rate": bit_rate})
+    assert probe_duration(audio) == 8000 / FALLBACK_BYTES_PER_SECOND
+
+
+def test_ffprobe_failure_falls_back(monkeypatch, audio):
+    def run(cmd, **kwargs):
+        raise subprocess.CalledProcessError(1, cmd)
+
+    monkeypatch.setattr(probe.subprocess, "run", run)
+    assert probe_duration(audio) == 8000 / FALLBACK_BYTES_PER_SECOND
@@ -0,0 +1,74 @@
+import pickle
+
+import pytest
+
+from result import DiarizationResult
+
+
+def make_word(word, start_time, end_time, speaker, sentence, score):
+    return {
+        "word": word,
+        "start_time": start_time,
+        "end_time": end_time,
+        "speaker": speaker,
+        "sentence": sentence,
+        "score": score,
+    }
+
+
+def make_result():
+    return DiarizationResult(
+        transcript="Speaker 0: Hello, wörld.\n\nSpeaker 1: Hi.",
+        language="en",
+        words=[
+            make_word("Hello,", 0, 420, 0, 0, 0.5),
+            make_word("wörld.", 450, 900, 0, 0, -1.25),
+            make_word("Hi.", 1200, 1500, 1, 1, None),
+        ],
+        speakers=[{"speaker": "Speaker 0", "start_time": 0, "end_time": 900}],
+        timings={"whisper": 1.5},
+    )
+
+
+def test_bytes_round_trip():
+    result = make_result()
+    data = result.to_bytes()
+    assert data[:4] == b"DRZ1"
+    loaded = DiarizationResult.from_bytes(data)
+    assert isinstance(loaded, DiarizationResult)
+    assert loaded == result
+    assert "word_count" not in loaded
+
+
+def test_scores_are_float32():
+    result = DiarizationResult(words=[make_word("a", 0, 1, 0, 0, 0.1)])
+    (word,) = DiarizationResult.from_bytes(result.to_bytes())["words"]
+    assert word["score"] == pytest.approx(0.1, rel=1e-6)
+
+
+def test_no_words():
+    result = DiarizationResult(transcript="", words=[])
+    assert DiarizationResult.from_bytes(result.to_bytes()) == result
+    assert DiarizationResult.from_bytes(DiarizationResult().to_bytes()) == {"words": []}
+
+
+def test_bytes_smaller_than_json_for_many_words():
+    words = [
+        make_word("word", i * 300, i * 300 + 250, i % 3, i // 12, -0.5)
+        for i in range(5000)
+    ]
+    result = DiarizationResult(words=words)
+    assert len(result.to_bytes()) < len(result.to_json()) / 3
+    assert DiarizationResult.from_bytes(result.to_bytes()) == result
+
+
+def test_rejects_other_data():
+    with pytest.raises(ValueError):
+        DiarizationResult.from_bytes(b'{"words": []}')
+
+
+def test_json_round_trip_and_pickle():
+    result = make_result()
+    assert DiarizationResult.from_json(result.to_json()) == result
+    assert "wörld" in result.to_json()
+    assert pickle.loads(pickle.dumps(result)) == result
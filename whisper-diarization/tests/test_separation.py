@@ -0,0 +1,119 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from cache import ArrayCache
+
+separation = pytest.importorskip("separation")
+
+SAMPLE_RATE = separation.SAMPLE_RATE
+
+
+def stereo(seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-1, 1, (2, int(seconds * SAMPLE_RATE))).astype(np.float32)
+
+
+def make_separator(signal, frame_size=4000):
+    """
+    A `VocalSeparator` over `signal` without Demucs: the "vocals" of a
+    window are its downmix, so the stitched output must be the downmix of
+    the whole signal.
+    """
+    separator = separation.VocalSeparator.__new__(separation.VocalSeparator)
+    separator.device = "cpu"
+    separator.model_name = "htdemucs"
+    separator.chunk_seconds = 2
+    separator.overlap_seconds = 1
+    separator.model = SimpleNamespace(samplerate=SAMPLE_RATE, audio_channels=2)
+    separator.vocals_index = 0
+    separator.windows = []
+
+    def decode(audio_path, sample_rate):
+        for start in range(0, signal.shape[1], frame_size):
+            yield signal[:, start : start + frame_size]
+
+    def separate_window(window):
+        separator.windows.append(window.shape[1])
+        return window.mean(0)
+
+    separator._decode = decode
+    separator._separate_window = separate_window
+    return separator
+
+
+@pytest.mark.parametrize("seconds", [0.5, 2, 2.5, 3, 7.3])
+@pytest.mark.parametrize("frame_size", [1000, 4000, 50000])
+def test_windows_overlap_and_cover_the_recording(seconds, frame_size):
+    signal = stereo(seconds)
+    separator = make_separator(signal, frame_size)
+    window, hop = 2 * SAMPLE_RATE, SAMPLE_RATE
+    windows = [w.copy() for w in separator._windows("audio.wav")]
+    for i, w in enumerate(windows):
+        np.testing.assert_array_equal(w, signal[:, i * hop : i * hop + w.shape[1]])
+        if i < len(windows) - 1:
+            assert w.shape[1] == window
+    assert (len(windows) - 1) * hop + windows[-1].shape[1] == signal.shape[1]
+
+
+@pytest.mark.parametrize("seconds", [0.5, 2, 3, 7.3])
+def test_stitched_vocals_match_the_recording(tmp_path, seconds):
+    signal = stereo(seconds)
+    audio_path = tmp_path / "audio.wav"
+    audio_path.write_bytes(b"audio")
+    vocals = make_separator(signal).separate(str(audio_path))
+    assert vocals.dtype == np.float32
+    np.testing.assert_allclose(vocals, signal.mean(0), atol=1e-6)
+
+
+def test_separated_vocals_are_cached(tmp_path):
+    signal = stereo(3)
+    audio_path = tmp_path / "audio.wav"
+    audio_path.write_bytes(b"audio")
+    cache = ArrayCache(str(tmp_path / "stems"))
+    separator = make_separator(signal)
+    first = separator.separate(str(audio_path), cache=cache)
+    separated = len(separator.windows)
+    second = separator.separate(str(audio_path), cache=cache)
+    assert len(separator.windows) == separated
+    np.testing.assert_array_equal(first, second)
+
+    # the key is the file's content, not its path
+    audio_path.write_bytes(b"other audio")
+    separator.separate(str(audio_path), cache=cache)
+    assert len(separator.windows) == 2 * separated
+    # without a cache every call separates
+    separator.separate(str(audio_path))
+    assert len(separator.windows) == 3 * separated
+
+
+def speech_like(seconds, seed=0):
+    """Bursts of noise separated by near-silent pauses."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    talking = (t % 1.0) < 0.6
+    return (rng.standard_normal(t.shape[0]) * np.where(talking, 0.3, 0.001)).astype(
+        np.float32
+    )
+
+
+def test_detect_background():
+    rng = np.random.default_rng(1)
+    t = np.arange(30 * SAMPLE_RATE) / SAMPLE_RATE
+    speech = speech_like(30)
+    music = (
+        0.2 * np.sin(2 * np.pi * 220 * t) + 0.1 * np.sin(2 * np.pi * 330 * t)
+    ).astype(np.float32)
+    noise = (0.2 * rng.standard_normal(t.shape[0])).astype(np.float32)
+
+    assert separation.detect_background(speech)[:2] == (False, "clean")
+    assert separation.detect_background(speech + music)[:2] == (True, "music")
+    assert separation.detect_background(speech + noise)[:2] == (True, "noise")
+    assert separation.detect_background(np.zeros_like(speech))[:2] == (False, "silent")
+    assert separation.detect_background(np.zeros(100, dtype=np.float32))[:2] == (
+        False,
+        "too short",
+    )
+    _, _, stats = separation.detect_background(speech, sample_seconds=9)
+    assert stats["sampled_seconds"] == 9
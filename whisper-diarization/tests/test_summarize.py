@@ -0,0 +1,198 @@
+import random
+import threading
+
+import pytest
+import requests
+
+import summarize
+from cache import ResultCache
+from summarize import OzwellClient, OzwellError, SummaryService, split_transcript
+
+
+def make_response(status_code, body=None, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response._content = b"" if body is None else body.encode("utf-8")
+    return response
+
+
+def completion(text):
+    return make_response(200, '{"choices": [{"message": {"content": "%s"}}]}' % text)
+
+
+class FakeSession:
+    """Returns (or raises) the queued outcomes in order and records every call."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def post(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(summarize.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def make_client(*outcomes, **kwargs):
+    client = OzwellClient("key", base_url="https://ozwell.test/api/", **kwargs)
+    client.session = FakeSession(*outcomes)
+    return client
+
+
+def test_complete(sleeps):
+    client = make_client(completion("a summary"))
+    assert client.complete("prompt", "system", max_tokens=100) == "a summary"
+    ((url, kwargs),) = client.session.calls
+    assert url == "https://ozwell.test/api/completion"
+    assert kwargs["timeout"] == (5, 120)
+    assert kwargs["json"]["maxTokens"] == 100
+    assert sleeps == []
+
+
+def test_retry_after_header_is_honoured(sleeps):
+    client = make_client(
+        make_response(429, headers={"Retry-After": "7"}), completion("done")
+    )
+    assert client.complete("prompt", "system") == "done"
+    assert sleeps == [7.0]
+
+
+def test_server_errors_back_off_exponentially(sleeps):
+    client = make_client(
+        make_response(503),
+        make_response(502, headers={"Retry-After": "soon"}),
+        requests.ConnectionError("reset"),
+        completion("done"),
+        backoff=0.5,
+    )
+    assert client.complete("prompt", "system") == "done"
+    assert sleeps == [0.5, 1.0, 2.0]
+
+
+def test_gives_up_after_max_retries(sleeps):
+    client = make_client(*[make_response(503, "busy")] * 3, max_retries=2)
+    with pytest.raises(OzwellError, match="503"):
+        client.complete("prompt", "system")
+    assert len(client.session.calls) == 3
+    assert len(sleeps) == 2
+
+    client = make_client(*[requests.Timeout("slow")] * 3, max_retries=2)
+    with pytest.raises(OzwellError, match="request failed"):
+        client.complete("prompt", "system")
+
+
+def test_client_errors_are_not_retried(sleeps):
+    client = make_client(make_response(401, "bad key"))
+    with pytest.raises(OzwellError, match="401"):
+        client.complete("prompt", "system")
+    assert len(client.session.calls) == 1
+    assert sleeps == []
+
+
+def test_unexpected_response(sleeps):
+    client = make_client(make_response(200, '{"choices": []}'))
+    with pytest.raises(OzwellError, match="Unexpected"):
+        client.complete("prompt", "system")
+
+
+def make_transcript(turns=200, seed=0):
+    rng = random.Random(seed)
+    words = "patient reports pain since monday and the doctor orders an x-ray".split()
+    return "\n\n".join(
+        f"Speaker {i % 2}: "
+        + " ".join(rng.choice(words) for _ in range(rng.randint(5, 60)))
+        + "."
+        for i in range(turns)
+    )
+
+
+class FakeClient:
+    def __init__(self):
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    def complete(self, prompt, system_message, max_tokens=500):
+        with self.lock:
+            self.prompts.append(prompt)
+        return f"summary {len(prompt)}"
+
+
+def test_summaries_are_cached(tmp_path):
+    client = FakeClient()
+    service = SummaryService(client, cache=ResultCache(str(tmp_path)))
+    summary = service.submit("Speaker 0: hello.", "system").result()
+    assert service.summarize("Speaker 0: hello.", "system") == summary
+    assert len(client.prompts) == 1
+    service.summarize("Speaker 0: hello.", "another system prompt")
+    service.summarize("Speaker 0: hello.", "system", max_tokens=100)
+    assert len(client.prompts) == 3
+
+
+def test_chunks_keep_whole_turns_and_bounds():
+    transcript = make_transcript()
+    chunks = split_transcript(transcript, max_chars=3000, min_chars=1000)
+    assert len(chunks) > 1
+    assert "\n\n".join(chunks) == transcript
+    assert all(len(chunk) <= 3000 for chunk in chunks)
+    # a chunk ends short of `min_chars` only when the next turn doesn't fit
+    for chunk, following in zip(chunks, chunks[1:]):
+        next_turn = following.split("\n\n")[0]
+        assert len(chunk) >= 1000 or len(chunk) + 2 + len(next_turn) > 3000
+
+
+def test_long_turns_split_at_sentence_ends():
+    turn = "Speaker 0: " + " ".join(f"Sentence number {i} is here." for i in range(100))
+    chunks = split_transcript(turn, max_chars=500, min_chars=100)
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert all(chunk.endswith(".") for chunk in chunks)
+    assert " ".join(chunks) == turn
+
+
+def test_edit_only_changes_nearby_chunks():
+    transcript = make_transcript(turns=400)
+    turns = transcript.split("\n\n")
+    turns[200] = "Speaker 0: an edited turn in the middle."
+    edited = "\n\n".join(turns)
+
+    before = split_transcript(transcript, max_chars=3000, min_chars=1000)
+    after = split_transcript(edited, max_chars=3000, min_chars=1000)
+    unchanged = set(before) & set(after)
+    assert len(unchanged) >= len(before) - 3
+    # the chunks before the edit and most after it are the same
+    assert before[0] == after[0] and before[-1] == after[-1]
+
+
+def test_short_transcript_is_one_chunk():
+    assert split_transcript("Speaker 0: hello.\n\nSpeaker 1: hi.") == [
+        "Speaker 0: hello.\n\nSpeaker 1: hi."
+    ]
+
+
+def test_resummarizing_an_edit_reuses_chunk_summaries(tmp_path):
+    client = FakeClient()
+    service = SummaryService(client, cache=ResultCache(str(tmp_path)), chunk_chars=3000)
+    transcript = make_transcript(turns=400)
+    service.summarize(transcript, "system")
+    first_calls = len(client.prompts)
+    assert first_calls > 2
+
+    turns = transcript.split("\n\n")
+    turns[200] = "Speaker 0: an edited turn in the middle."
+    client.prompts.clear()
+    service.summarize("\n\n".join(turns), "system")
+    # the changed chunks and the final combining pass
+    assert 2 <= len(client.prompts) <= 4
+
+    client.prompts.clear()
+    service.summarize("\n\n".join(turns), "system")
+    assert client.prompts == []
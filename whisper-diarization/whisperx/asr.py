@@ -1,5 +1,6 @@
-import os
-from typing import List, Optional, Union
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Union
 from dataclasses import replace
 
 import ctranslate2
@@ -7,14 +8,20 @@ import faster_whisper
 import numpy as np
 import torch
 from faster_whisper.tokenizer import Tokenizer
-from faster_whisper.transcribe import TranscriptionOptions, get_ctranslate2_storage
-from transformers import Pipeline
-from transformers.pipelines.pt_utils import PipelineIterator
+from faster_whisper.transcribe import (
+    TranscriptionOptions,
+    get_ctranslate2_storage,
+    merge_punctuations,
+)
 
-from whisperx.audio import N_SAMPLES, SAMPLE_RATE, load_audio, log_mel_spectrogram
+from whisperx.audio import HOP_LENGTH, N_SAMPLES, SAMPLE_RATE, MelFrontend, load_audio
 from whisperx.types import SingleSegment, TranscriptionResult
 from whisperx.vads import Vad, Silero, Pyannote
 
+# faster-whisper's defaults for attaching punctuation to the words around it
+PREPEND_PUNCTUATIONS = "\"'“¿([{-"
+APPEND_PUNCTUATIONS = "\"'.。,，!！?？:：”)]}、"
+
 
 def find_numeral_symbol_tokens(tokenizer):
     numeral_symbol_tokens = []
@@ -29,6 +36,7 @@ class WhisperModel(faster_whisper.WhisperModel):
     '''
     FasterWhisperModel provides batched inference for faster-whisper.
     Currently only works in non-timestamp mode and fixed prompt for all samples in batch.
+    Word timings come from the cross-attention instead, see `word_timings`.
     '''
 
     def generate_segment_batched(
@@ -37,6 +45,8 @@ class WhisperModel(faster_whisper.WhisperModel):
         tokenizer: Tokenizer,
         options: TranscriptionOptions,
         encoder_output=None,
+        word_timestamps: bool = False,
+        num_frames: Optional[List[int]] = None,
     ):
         batch_size = features.shape[0]
         all_tokens = []
@@ -54,7 +64,8 @@ class WhisperModel(faster_whisper.WhisperModel):
             hotwords=options.hotwords
         )
 
-        encoder_output = self.encode(features)
+        if encoder_output is None:
+            encoder_output = self.encode(features)
 
         max_initial_timestamp_index = int(
             round(options.max_initial_timestamp / self.time_precision)
@@ -81,26 +92,299 @@ class WhisperModel(faster_whisper.WhisperModel):
             return tokenizer.tokenizer.decode_batch(res)
 
         text = decode_batch(tokens_batch)
+        if not word_timestamps:
+            return text
+
+        # `num_frames` are the mel frames of each chunk before padding
+        num_frames = num_frames or [features.shape[-1]] * batch_size
+        return text, self.word_timings(tokenizer, tokens_batch, encoder_output, num_frames)
+
+    def word_timings(
+        self,
+        tokenizer: Tokenizer,
+        tokens_batch: List[List[int]],
+        encoder_output: ctranslate2.StorageView,
+        num_frames: List[int],
+        median_filter_width: int = 7,
+    ) -> List[List[dict]]:
+        """
+        Word timings of each decoded chunk, in seconds from its start, from
+        the cross-attention of the alignment heads over the encoder output
+        (dynamic time warping in CTranslate2, as faster-whisper does for
+        `word_timestamps=True`). Punctuation is attached to its word.
+        """
+        text_tokens = [[token for token in tokens if token < tokenizer.eot] for tokens in tokens_batch]
+        results = self.model.align(
+            encoder_output,
+            tokenizer.sot_sequence,
+            text_tokens,
+            num_frames,
+            median_filter_width=median_filter_width,
+        )
 
-        return text
+        words_batch = []
+        for result, tokens in zip(results, text_tokens):
+            words, word_tokens = tokenizer.split_to_word_tokens(tokens + [tokenizer.eot])
+            if len(word_tokens) <= 1:
+                words_batch.append([])
+                continue
+            word_boundaries = np.pad(np.cumsum([len(t) for t in word_tokens[:-1]]), (1, 0))
+            text_indices = np.array([pair[0] for pair in result.alignments])
+            time_indices = np.array([pair[1] for pair in result.alignments])
+            # a word starts where the path first moves on to its first token
+            jumps = np.pad(np.diff(text_indices), (1, 0), constant_values=1).astype(bool)
+            jump_times = time_indices[jumps] / self.tokens_per_second
+            token_probs = result.text_token_probs
+
+            alignment = [
+                {
+                    "word": word,
+                    "tokens": word_token_ids,
+                    "start": float(jump_times[start]),
+                    "end": float(jump_times[end]),
+                    "probability": float(np.mean(token_probs[start:end])),
+                }
+                for word, word_token_ids, start, end in zip(
+                    words, word_tokens, word_boundaries[:-1], word_boundaries[1:]
+                )
+            ]
+            merge_punctuations(alignment, PREPEND_PUNCTUATIONS, APPEND_PUNCTUATIONS)
+            words_batch.append(
+                [
+                    {key: word[key] for key in ("word", "start", "end", "probability")}
+                    for word in alignment
+                    if word["word"]
+                ]
+            )
+        return words_batch
+
+    @property
+    def mel_frontend(self) -> MelFrontend:
+        """Batched feature extraction on the device the encoder runs on."""
+        if getattr(self, "_mel_frontend", None) is None:
+            if self.model.device == "cuda" and len(self.model.device_index) == 1:
+                device = f"cuda:{self.model.device_index[0]}"
+            else:
+                device = "cpu"
+            self._mel_frontend = MelFrontend(
+                self.feat_kwargs.get("feature_size") or 80, device=device
+            )
+        return self._mel_frontend
 
-    def encode(self, features: np.ndarray) -> ctranslate2.StorageView:
+    def encode(self, features: Union[np.ndarray, torch.Tensor]) -> ctranslate2.StorageView:
         # When the model is running on multiple GPUs, the encoder output should be moved
         # to the CPU since we don't know which GPU will handle the next job.
         to_cpu = self.model.device == "cuda" and len(self.model.device_index) > 1
         # unsqueeze if batch size = 1
         if len(features.shape) == 2:
-            features = np.expand_dims(features, 0)
+            features = features[None]
+        if torch.is_tensor(features) and features.is_cuda:
+            # CTranslate2 reads CUDA tensors in place, `features` outlives the call
+            features = features.contiguous()
+            return self.model.encode(
+                ctranslate2.StorageView.from_array(features), to_cpu=to_cpu
+            )
+        if torch.is_tensor(features):
+            features = features.numpy()
         features = get_ctranslate2_storage(features)
 
         return self.model.encode(features, to_cpu=to_cpu)
 
-class FasterWhisperPipeline(Pipeline):
+def detect_chunk_language(
+    model: WhisperModel,
+    chunks: List[np.ndarray],
+    max_windows: int = 3,
+    threshold: float = 0.8,
+):
     """
-    Huggingface Pipeline wrapper for FasterWhisperModel.
+    Detect the language from the first VAD chunks (speech, rather than the
+    first 30 s of the file, which may be silence or music).
+
+    Chunks are encoded one at a time and the language probabilities are
+    averaged over them; this stops as soon as the leading language reaches
+    `threshold`, or after `max_windows` chunks. Returns `(language,
+    probability, encoded)` where `encoded` holds the `(chunk, features,
+    encoder_output)` of the chunks that were looked at, in order, for
+    `transcribe_batches` to decode without encoding them again.
+    """
+    totals = {}
+    encoded = []
+    for chunk in chunks[:max_windows]:
+        features = model.mel_frontend([chunk])
+        encoder_output = model.encode(features)
+        encoded.append((chunk, features, encoder_output))
+        for token, probability in model.model.detect_language(encoder_output)[0]:
+            totals[token] = totals.get(token, 0.0) + probability
+        token = max(totals, key=totals.get)
+        if totals[token] / len(encoded) >= threshold:
+            break
+    if not encoded:
+        return None, 0.0, encoded
+    probability = totals[token] / len(encoded)
+    print(
+        f"Detected language: {token[2:-2]} ({probability:.2f}) "
+        f"in {len(encoded)} speech window(s)..."
+    )
+    return token[2:-2], probability, encoded
+
+
+def stack_encoded(encoded):
+    """
+    Join the `(chunk, features, encoder_output)` of single chunks into one
+    batch. Returns the chunks, the features and the stacked encoder output,
+    plus the array backing it, which has to outlive the StorageView.
+    """
+    chunks = [chunk for chunk, _, _ in encoded]
+    features = torch.cat([features for _, features, _ in encoded])
+    outputs = [encoder_output for _, _, encoder_output in encoded]
+    if len(outputs) == 1:
+        return chunks, features, outputs[0], None
+    if outputs[0].device == "cuda":
+        stacked = torch.cat(
+            [torch.as_tensor(output, device=f"cuda:{output.device_index}") for output in outputs]
+        )
+    else:
+        stacked = np.concatenate([np.asarray(output) for output in outputs])
+    return chunks, features, ctranslate2.StorageView.from_array(stacked), stacked
+
+
+def transcribe_batches(
+    model: WhisperModel,
+    batches: Iterable[List[np.ndarray]],
+    tokenizer: Tokenizer,
+    options: TranscriptionOptions,
+    timings: Optional[list] = None,
+    encoded: Optional[list] = None,
+    on_error=None,
+    word_timestamps: bool = False,
+    encoded_batch_size: int = 8,
+):
+    """
+    Decode batches of 16 kHz audio chunks (up to 30 s each) and yield the
+    texts of every batch in order.
+
+    The log-mel features of batch N+1 are computed on a worker thread while
+    batch N is encoded and decoded; both torch and CTranslate2 release the
+    GIL, so the feature extraction is hidden behind the GPU (or the other
+    CPU threads). If given, `timings` gets a dict per batch with its size
+    and the seconds spent on features, encoding and decoding.
+
+    `encoded` are chunks already run through the encoder, as returned by
+    `detect_chunk_language` (possibly for several files); they are decoded
+    first, with their encoder outputs stacked into batches of
+    `encoded_batch_size`, and their timings are marked `reused`.
+
+    If a batch raises (e.g. runs out of memory), `on_error(batch, error)`
+    is called with its audio chunks and returns the texts instead, or
+    raises itself.
+
+    With `word_timestamps`, every text comes as a `(text, words)` pair, see
+    `WhisperModel.word_timings`.
+    """
+
+    def decode(batch, features, encoder_output):
+        output = model.generate_segment_batched(
+            features,
+            tokenizer,
+            options,
+            encoder_output=encoder_output,
+            word_timestamps=word_timestamps,
+            num_frames=[min(len(chunk), N_SAMPLES) // HOP_LENGTH for chunk in batch],
+        )
+        return list(zip(*output)) if word_timestamps else output
+
+    def retry(batch, error, reused=False):
+        if on_error is None:
+            raise error
+        start = time.perf_counter()
+        texts = on_error(batch, error)
+        if timings is not None:
+            timings.append(
+                {
+                    "size": len(batch),
+                    "features": 0.0,
+                    "encode": 0.0,
+                    "decode": round(time.perf_counter() - start, 4),
+                    "retried": True,
+                    **({"reused": True} if reused else {}),
+                }
+            )
+        return texts
+
+    frontend = model.mel_frontend
+
+    def extract(batch):
+        start = time.perf_counter()
+        features = frontend(batch)
+        if features.is_cuda:
+            # wait here, on the worker thread, rather than in the encoder
+            torch.cuda.synchronize(features.device)
+        return features, time.perf_counter() - start
+
+    batches = iter(batches)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper-features") as executor:
+        def submit():
+            batch = next(batches, None)
+            return None if batch is None else (batch, executor.submit(extract, batch))
+
+        pending = submit()
+        # the next batch is prepared while these decode
+        encoded = encoded or []
+        for i in range(0, len(encoded), max(encoded_batch_size, 1)):
+            start = time.perf_counter()
+            group = encoded[i : i + max(encoded_batch_size, 1)]
+            batch = [chunk for chunk, _, _ in group]
+            try:
+                _, features, encoder_output, _stacked = stack_encoded(group)
+                texts = decode(batch, features, encoder_output)
+            except Exception as error:
+                yield retry(batch, error, reused=True)
+                continue
+            del encoder_output, _stacked
+            if timings is not None:
+                timings.append(
+                    {
+                        "size": features.shape[0],
+                        "features": 0.0,
+                        "encode": 0.0,
+                        "decode": round(time.perf_counter() - start, 4),
+                        "reused": True,
+                    }
+                )
+            yield texts
+
+        while pending is not None:
+            batch, future = pending
+            pending = submit()
+            try:
+                features, feature_seconds = future.result()
+                start = time.perf_counter()
+                encoder_output = model.encode(features)
+                encode_done = time.perf_counter()
+                texts = decode(batch, features, encoder_output)
+            except Exception as error:
+                features = encoder_output = None
+                yield retry(batch, error)
+                continue
+            if timings is not None:
+                timings.append(
+                    {
+                        "size": features.shape[0],
+                        "features": round(feature_seconds, 4),
+                        "encode": round(encode_done - start, 4),
+                        "decode": round(time.perf_counter() - encode_done, 4),
+                    }
+                )
+            yield texts
+
+
+class FasterWhisperPipeline:
+    """
+    Batched transcription of VAD chunks with a FasterWhisperModel, see
+    `transcribe_batches`. The per-batch timings of the last call to
+    `transcribe` are kept in `batch_timings`.
     """
     # TODO:
-    # - add support for timestamp mode
     # - add support for custom inference kwargs
 
     def __init__(
@@ -122,69 +406,19 @@ class FasterWhisperPipeline(Pipeline):
         self.preset_language = language
         self.suppress_numerals = suppress_numerals
         self._batch_size = kwargs.pop("batch_size", None)
-        self._num_workers = 1
-        self._preprocess_params, self._forward_params, self._postprocess_params = self._sanitize_parameters(**kwargs)
-        self.call_count = 0
         self.framework = framework
-        if self.framework == "pt":
-            if isinstance(device, torch.device):
-                self.device = device
-            elif isinstance(device, str):
-                self.device = torch.device(device)
-            elif device < 0:
-                self.device = torch.device("cpu")
-            else:
-                self.device = torch.device(f"cuda:{device}")
-        else:
+        if isinstance(device, torch.device):
             self.device = device
+        elif isinstance(device, str):
+            self.device = torch.device(device)
+        elif device < 0:
+            self.device = torch.device("cpu")
+        else:
+            self.device = torch.device(f"cuda:{device}")
 
-        super(Pipeline, self).__init__()
         self.vad_model = vad
         self._vad_params = vad_params
-
-    def _sanitize_parameters(self, **kwargs):
-        preprocess_kwargs = {}
-        if "tokenizer" in kwargs:
-            preprocess_kwargs["maybe_arg"] = kwargs["maybe_arg"]
-        return preprocess_kwargs, {}, {}
-
-    def preprocess(self, audio):
-        audio = audio['inputs']
-        model_n_mels = self.model.feat_kwargs.get("feature_size")
-        features = log_mel_spectrogram(
-            audio,
-            n_mels=model_n_mels if model_n_mels is not None else 80,
-            padding=N_SAMPLES - audio.shape[0],
-        )
-        return {'inputs': features}
-
-    def _forward(self, model_inputs):
-        outputs = self.model.generate_segment_batched(model_inputs['inputs'], self.tokenizer, self.options)
-        return {'text': outputs}
-
-    def postprocess(self, model_outputs):
-        return model_outputs
-
-    def get_iterator(
-        self,
-        inputs,
-        num_workers: int,
-        batch_size: int,
-        preprocess_params: dict,
-        forward_params: dict,
-        postprocess_params: dict,
-    ):
-        dataset = PipelineIterator(inputs, self.preprocess, preprocess_params)
-        if "TOKENIZERS_PARALLELISM" not in os.environ:
-            os.environ["TOKENIZERS_PARALLELISM"] = "false"
-        # TODO hack by collating feature_extractor and image_processor
-
-        def stack(items):
-            return {'inputs': torch.stack([x['inputs'] for x in items])}
-        dataloader = torch.utils.data.DataLoader(dataset, num_workers=num_workers, batch_size=batch_size, collate_fn=stack)
-        model_iterator = PipelineIterator(dataloader, self.forward, forward_params, loader_batch_size=batch_size)
-        final_iterator = PipelineIterator(model_iterator, self.postprocess, postprocess_params)
-        return final_iterator
+        self.batch_timings = []
 
     def transcribe(
         self,
@@ -197,17 +431,11 @@ class FasterWhisperPipeline(Pipeline):
         print_progress=False,
         combined_progress=False,
         verbose=False,
+        word_timestamps=False,
     ) -> TranscriptionResult:
         if isinstance(audio, str):
             audio = load_audio(audio)
 
-        def data(audio, segments):
-            for seg in segments:
-                f1 = int(seg['start'] * SAMPLE_RATE)
-                f2 = int(seg['end'] * SAMPLE_RATE)
-                # print(f2-f1)
-                yield {'inputs': audio[f1:f2]}
-
         # Pre-process audio and merge chunks as defined by the respective VAD child class 
         # In case vad_model is manually assigned (see 'load_model') follow the functionality of pyannote toolkit
         if issubclass(type(self.vad_model), Vad):
@@ -224,8 +452,15 @@ class FasterWhisperPipeline(Pipeline):
             onset=self._vad_params["vad_onset"],
             offset=self._vad_params["vad_offset"],
         )
+        chunks = [
+            audio[int(seg['start'] * SAMPLE_RATE):int(seg['end'] * SAMPLE_RATE)]
+            for seg in vad_segments
+        ]
+        encoded = []
         if self.tokenizer is None:
-            language = language or self.detect_language(audio)
+            if language is None:
+                language, _, encoded = detect_chunk_language(self.model, chunks)
+                language = language or "en"
             task = task or "transcribe"
             self.tokenizer = Tokenizer(
                 self.model.hf_tokenizer,
@@ -253,16 +488,31 @@ class FasterWhisperPipeline(Pipeline):
             self.options = replace(self.options, suppress_tokens=new_suppressed_tokens)
 
         segments: List[SingleSegment] = []
-        batch_size = batch_size or self._batch_size
+        batch_size = max(batch_size or self._batch_size or 1, 1)
         total_segments = len(vad_segments)
-        for idx, out in enumerate(self.__call__(data(audio, vad_segments), batch_size=batch_size, num_workers=num_workers)):
+        self.batch_timings = []
+        # the chunks encoded for language detection are decoded as they are
+        batches = transcribe_batches(
+            self.model,
+            (
+                chunks[i:i + batch_size]
+                for i in range(len(encoded), total_segments, batch_size)
+            ),
+            self.tokenizer,
+            self.options,
+            timings=self.batch_timings,
+            encoded=encoded,
+            word_timestamps=word_timestamps,
+            encoded_batch_size=batch_size,
+        )
+        texts = (text for batch_texts in batches for text in batch_texts)
+        for idx, text in enumerate(texts):
+            if word_timestamps:
+                text, words = text
             if print_progress:
                 base_progress = ((idx + 1) / total_segments) * 100
                 percent_complete = base_progress / 2 if combined_progress else base_progress
                 print(f"Progress: {percent_complete:.2f}%...")
-            text = out['text']
-            if batch_size in [0, 1, None]:
-                text = text[0]
             if verbose:
                 print(f"Transcript: [{round(vad_segments[idx]['start'], 3)} --> {round(vad_segments[idx]['end'], 3)}] {text}")
             segments.append(
@@ -272,6 +522,22 @@ class FasterWhisperPipeline(Pipeline):
                     "end": round(vad_segments[idx]['end'], 3)
                 }
             )
+            if word_timestamps:
+                segments[-1]["words"] = [
+                    {
+                        "word": word["word"],
+                        "start": round(vad_segments[idx]['start'] + word["start"], 3),
+                        "end": round(vad_segments[idx]['start'] + word["end"], 3),
+                        "score": word["probability"],
+                    }
+                    for word in words
+                ]
+        if verbose and self.batch_timings:
+            totals = {
+                key: round(sum(t[key] for t in self.batch_timings), 3)
+                for key in ("features", "encode", "decode")
+            }
+            print(f"Batch timings over {len(self.batch_timings)} batches: {totals}")
 
         # revert the tokenizer if multilingual inference is enabled
         if self.preset_language is None:
@@ -284,12 +550,10 @@ class FasterWhisperPipeline(Pipeline):
         return {"segments": segments, "language": language}
 
     def detect_language(self, audio: np.ndarray) -> str:
+        """Language of the first 30 s, see `detect_chunk_language` for VAD chunks."""
         if audio.shape[0] < N_SAMPLES:
             print("Warning: audio is shorter than 30s, language detection may be inaccurate.")
-        model_n_mels = self.model.feat_kwargs.get("feature_size")
-        segment = log_mel_spectrogram(audio[: N_SAMPLES],
-                                      n_mels=model_n_mels if model_n_mels is not None else 80,
-                                      padding=0 if audio.shape[0] >= N_SAMPLES else N_SAMPLES - audio.shape[0])
+        segment = self.model.mel_frontend([audio[: N_SAMPLES]])
         encoder_output = self.model.encode(segment)
         results = self.model.model.detect_language(encoder_output)
         language_token, language_probability = results[0][0]
@@ -298,6 +562,48 @@ class FasterWhisperPipeline(Pipeline):
         return language
 
 
+def get_transcription_options(model: WhisperModel, asr_options: Optional[dict] = None):
+    """Build the batched-inference TranscriptionOptions, returns (options, suppress_numerals)."""
+    default_asr_options =  {
+        "beam_size": 5,
+        "best_of": 5,
+        "patience": 1,
+        "length_penalty": 1,
+        "repetition_penalty": 1,
+        "no_repeat_ngram_size": 0,
+        "temperatures": [0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
+        "compression_ratio_threshold": 2.4,
+        "log_prob_threshold": -1.0,
+        "no_speech_threshold": 0.6,
+        "condition_on_previous_text": False,
+        "prompt_reset_on_temperature": 0.5,
+        "initial_prompt": None,
+        "prefix": None,
+        "suppress_blank": True,
+        "suppress_tokens": [-1],
+        "without_timestamps": True,
+        "max_initial_timestamp": 0.0,
+        "word_timestamps": False,
+        "prepend_punctuations": "\"'“¿([{-",
+        "append_punctuations": "\"'.。,，!！?？:：”)]}、",
+        "multilingual": model.model.is_multilingual,
+        "suppress_numerals": False,
+        "max_new_tokens": None,
+        "clip_timestamps": None,
+        "hallucination_silence_threshold": None,
+        "hotwords": None,
+    }
+
+    if asr_options is not None:
+        default_asr_options.update(asr_options)
+
+    suppress_numerals = default_asr_options["suppress_numerals"]
+    del default_asr_options["suppress_numerals"]
+
+    default_asr_options = TranscriptionOptions(**default_asr_options)
+    return default_asr_options, suppress_numerals
+
+
 def load_model(
     whisper_arch: str,
     device: str,
@@ -346,43 +652,7 @@ def load_model(
         print("No language specified, language will be first be detected for each audio file (increases inference time).")
         tokenizer = None
 
-    default_asr_options =  {
-        "beam_size": 5,
-        "best_of": 5,
-        "patience": 1,
-        "length_penalty": 1,
-        "repetition_penalty": 1,
-        "no_repeat_ngram_size": 0,
-        "temperatures": [0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
-        "compression_ratio_threshold": 2.4,
-        "log_prob_threshold": -1.0,
-        "no_speech_threshold": 0.6,
-        "condition_on_previous_text": False,
-        "prompt_reset_on_temperature": 0.5,
-        "initial_prompt": None,
-        "prefix": None,
-        "suppress_blank": True,
-        "suppress_tokens": [-1],
-        "without_timestamps": True,
-        "max_initial_timestamp": 0.0,
-        "word_timestamps": False,
-        "prepend_punctuations": "\"'“¿([{-",
-        "append_punctuations": "\"'.。,，!！?？:：”)]}、",
-        "multilingual": model.model.is_multilingual,
-        "suppress_numerals": False,
-        "max_new_tokens": None,
-        "clip_timestamps": None,
-        "hallucination_silence_threshold": None,
-        "hotwords": None,
-    }
-
-    if asr_options is not None:
-        default_asr_options.update(asr_options)
-
-    suppress_numerals = default_asr_options["suppress_numerals"]
-    del default_asr_options["suppress_numerals"]
-
-    default_asr_options = TranscriptionOptions(**default_asr_options)
+    default_asr_options, suppress_numerals = get_transcription_options(model, asr_options)
 
     default_vad_options = {
         "chunk_size": 30, # needed by silero since binarization happens before merge_chunks
@@ -109,6 +109,55 @@ def mel_filters(device, n_mels: int) -> torch.Tensor:
         return torch.from_numpy(f[f"mel_{n_mels}"]).to(device)
 
 
+@lru_cache(maxsize=None)
+def stft_buffers(device, n_mels: int, dtype: torch.dtype = torch.float32):
+    """The Hann window and mel filterbank on `device` in `dtype`, loaded once."""
+    window = torch.hann_window(N_FFT, device=device, dtype=dtype)
+    return window, mel_filters(device, n_mels).to(dtype)
+
+
+class MelFrontend:
+    """
+    Log-mel features for a batch of audio chunks in one go.
+
+    Every chunk (16 kHz, at most 30 s) is zero-padded to 30 s and the batch
+    goes through a single stacked STFT on `device`, with the window and
+    filterbank cached per device and dtype by `stft_buffers`. The result is a
+    `(batch, n_mels, 3000)` tensor left on `device`; `WhisperModel.encode`
+    takes it as is, so on CUDA the features never go back to the host.
+    """
+
+    def __init__(
+        self,
+        n_mels: int = 80,
+        device: Optional[Union[str, torch.device]] = None,
+        dtype: torch.dtype = torch.float32,
+    ):
+        self.n_mels = n_mels
+        self.device = torch.device(
+            device or ("cuda" if torch.cuda.is_available() else "cpu")
+        )
+        self.dtype = dtype
+
+    def __call__(self, chunks) -> torch.Tensor:
+        batch = np.zeros((len(chunks), N_SAMPLES), dtype=np.float32)
+        for i, chunk in enumerate(chunks):
+            chunk = chunk[:N_SAMPLES]
+            batch[i, : chunk.shape[0]] = chunk
+        window, filters = stft_buffers(self.device, self.n_mels, self.dtype)
+
+        with torch.inference_mode():
+            audio = torch.from_numpy(batch).to(self.device, self.dtype)
+            stft = torch.stft(audio, N_FFT, HOP_LENGTH, window=window, return_complex=True)
+            magnitudes = stft[..., :-1].abs() ** 2
+            log_spec = torch.clamp(filters @ magnitudes, min=1e-10).log10()
+            # the dynamic range is clipped per chunk, as in `log_mel_spectrogram`
+            log_spec = torch.maximum(
+                log_spec, log_spec.amax(dim=(-2, -1), keepdim=True) - 8.0
+            )
+            return ((log_spec + 4.0) / 4.0).float()
+
+
 def log_mel_spectrogram(
     audio: Union[str, np.ndarray, torch.Tensor],
     n_mels: int,
@@ -146,11 +195,10 @@ def log_mel_spectrogram(
         audio = audio.to(device)
     if padding > 0:
         audio = F.pad(audio, (0, padding))
-    window = torch.hann_window(N_FFT).to(audio.device)
+    window, filters = stft_buffers(audio.device, n_mels)
     stft = torch.stft(audio, N_FFT, HOP_LENGTH, window=window, return_complex=True)
     magnitudes = stft[..., :-1].abs() ** 2
 
-    filters = mel_filters(audio.device, n_mels)
     mel_spec = filters @ magnitudes
 
     log_spec = torch.clamp(mel_spec, min=1e-10).log10()
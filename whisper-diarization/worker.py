@@ -0,0 +1,332 @@
+import multiprocessing as mp
+import queue
+import threading
+import time
+import traceback
+
+
+class WorkerError(RuntimeError):
+    """Raised when the diarization worker fails to load or to process a job."""
+
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details
+
+
+def _serve(conn, pipeline_kwargs):
+    # Heavy imports (NeMo, pyannote, transformers) only happen in the worker.
+    from pipeline import DiarizationPipeline
+
+    try:
+        pipeline = DiarizationPipeline(**pipeline_kwargs)
+        pipeline.load_models()
+    except Exception:
+        conn.send({"status": "error", "error": traceback.format_exc()})
+        return
+
+    print(f"[INFO] Diarization worker ready, model load timings: {pipeline.load_timings}")
+    conn.send({"status": "ready", "load_timings": pipeline.load_timings})
+    send_lock = threading.Lock()
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        def progress(event):
+            # stages may report from several threads at once
+            with send_lock:
+                conn.send({"status": "progress", "event": event})
+
+        try:
+            if "audio_paths" in job:
+                for audio_path, result in pipeline.diarize_batch(**job, progress=progress):
+                    if isinstance(result, Exception):
+                        error = "".join(traceback.format_exception(result))
+                        conn.send(
+                            {"status": "file", "audio_path": audio_path, "error": error}
+                        )
+                    else:
+                        conn.send(
+                            {"status": "file", "audio_path": audio_path, "result": result}
+                        )
+                conn.send({"status": "done", "result": None})
+            else:
+                result = pipeline.diarize(**job, progress=progress)
+                conn.send({"status": "done", "result": result})
+        except Exception:
+            conn.send({"status": "error", "error": traceback.format_exc()})
+
+
+def _serve_live(conn, pipeline_kwargs):
+    from live import LiveSession
+    from pipeline import DiarizationPipeline
+
+    try:
+        pipeline = DiarizationPipeline(**pipeline_kwargs)
+        pipeline.load_models()
+    except Exception:
+        conn.send({"status": "error", "error": traceback.format_exc()})
+        return
+
+    print(f"[INFO] Live worker ready, model load timings: {pipeline.load_timings}")
+    conn.send({"status": "ready", "load_timings": pipeline.load_timings})
+    send_lock = threading.Lock()
+    inbox = queue.Queue()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def process():
+        # one thread runs every session, the models are used one call at a time
+        sessions = {}
+        while True:
+            message = inbox.get()
+            if message is None:
+                break
+            session_id = message["session"]
+            try:
+                if message["type"] == "start":
+                    sessions[session_id] = LiveSession(pipeline, **message["options"])
+                elif message["type"] == "audio" and session_id in sessions:
+                    for segment in sessions[session_id].add_audio(message["data"]):
+                        send({"session": session_id, "status": "partial", "segment": segment})
+                elif message["type"] == "stop" and session_id in sessions:
+                    session = sessions.pop(session_id)
+                    remaining, result = session.finish(
+                        message["audio_path"],
+                        progress=lambda event: send(
+                            {"session": session_id, "status": "progress", "event": event}
+                        ),
+                        **message["options"],
+                    )
+                    for segment in remaining:
+                        send({"session": session_id, "status": "partial", "segment": segment})
+                    send({"session": session_id, "status": "done", "result": result})
+                elif message["type"] == "cancel":
+                    sessions.pop(session_id, None)
+            except Exception:
+                sessions.pop(session_id, None)
+                send({"session": session_id, "status": "error", "error": traceback.format_exc()})
+
+    processor = threading.Thread(target=process, daemon=True)
+    processor.start()
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            message = None
+        inbox.put(message)
+        if message is None:
+            break
+    processor.join()
+
+
+class DiarizationWorker:
+    """
+    Long-lived process that owns a `DiarizationPipeline`.
+
+    The process loads every model once on start-up and then serves jobs sent
+    over a pipe, so requests no longer pay for interpreter start-up, imports
+    and model loading. Jobs are processed one at a time; if the process dies
+    (e.g. a CUDA crash) it is restarted on the next job.
+    """
+
+    def __init__(self, **pipeline_kwargs):
+        self.pipeline_kwargs = pipeline_kwargs
+        self.load_timings = None
+        self._ctx = mp.get_context("spawn")
+        self._lock = threading.Lock()
+        self._process = None
+        self._conn = None
+        self._start()
+
+    def _start(self):
+        self._conn, child_conn = self._ctx.Pipe()
+        self._process = self._ctx.Process(
+            target=_serve, args=(child_conn, self.pipeline_kwargs), daemon=True
+        )
+        self._process.start()
+        self._started_at = time.perf_counter()
+        self.load_timings = None
+
+    def _wait_ready(self):
+        if self.load_timings is not None:
+            return
+        message = self._recv()
+        if message["status"] != "ready":
+            raise WorkerError("Diarization worker failed to load models", message["error"])
+        self.load_timings = message["load_timings"]
+        self.load_timings["startup"] = round(time.perf_counter() - self._started_at, 3)
+
+    def _recv(self):
+        try:
+            return self._conn.recv()
+        except EOFError:
+            raise WorkerError(
+                "Diarization worker exited unexpectedly",
+                f"exit code {self._process.exitcode}",
+            )
+
+    def run(self, audio_path, progress=None, **options):
+        """
+        Diarize `audio_path` in the worker process and return its result.
+        Stage progress events are forwarded to `progress` as they arrive.
+        """
+        return self._call({"audio_path": audio_path, **options}, progress)
+
+    def run_batch(self, audio_paths, on_result, progress=None, **options):
+        """
+        Diarize several files in one pass of the worker, sharing Whisper
+        batches between them. `on_result(audio_path, result, error)` is called
+        for each file as soon as it is finished.
+        """
+        self._call(
+            {"audio_paths": list(audio_paths), **options},
+            progress,
+            on_file=lambda message: on_result(
+                message["audio_path"],
+                message.get("result"),
+                WorkerError("Diarization failed", message["error"])
+                if "error" in message
+                else None,
+            ),
+        )
+
+    def _call(self, job, progress=None, on_file=None):
+        with self._lock:
+            if not self._process.is_alive():
+                self._start()
+            self._wait_ready()
+
+            self._conn.send(job)
+            while True:
+                message = self._recv()
+                if message["status"] == "progress":
+                    if progress is not None:
+                        progress(message["event"])
+                elif message["status"] == "file":
+                    on_file(message)
+                else:
+                    break
+            if message["status"] != "done":
+                raise WorkerError("Diarization failed", message["error"])
+            return message["result"]
+
+    def close(self):
+        with self._lock:
+            if self._process.is_alive():
+                self._conn.send(None)
+                self._process.join(timeout=10)
+
+
+class LiveWorker:
+    """
+    Long-lived process that owns a `DiarizationPipeline` for live sessions.
+
+    Unlike `DiarizationWorker` it serves many sessions at once, so a live
+    recording never waits behind queued uploads: messages are tagged with
+    the session id and a reader thread hands every message from the process
+    to the callback of its session. If the process dies, its open sessions
+    fail and it is restarted when the next session opens.
+    """
+
+    def __init__(self, **pipeline_kwargs):
+        self.pipeline_kwargs = pipeline_kwargs
+        self.load_timings = None
+        self._ctx = mp.get_context("spawn")
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._sessions = {}
+        self._process = None
+        self._start()
+
+    def _start(self):
+        self._conn, child_conn = self._ctx.Pipe()
+        self._process = self._ctx.Process(
+            target=_serve_live, args=(child_conn, self.pipeline_kwargs), daemon=True
+        )
+        self._process.start()
+        self._started_at = time.perf_counter()
+        self.load_timings = None
+        self._error = None
+        self._ready = threading.Event()
+        threading.Thread(target=self._read, args=(self._conn,), daemon=True).start()
+
+    def _read(self, conn):
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            if message["status"] == "ready":
+                self.load_timings = message["load_timings"]
+                self.load_timings["startup"] = round(
+                    time.perf_counter() - self._started_at, 3
+                )
+                self._ready.set()
+                continue
+            if "session" not in message:
+                self._error = WorkerError("Live worker failed to load models", message["error"])
+                break
+            callback = self._sessions.get(message["session"])
+            if message["status"] in ("done", "error"):
+                self._sessions.pop(message["session"], None)
+            if callback is not None:
+                callback(message)
+
+        self._error = self._error or WorkerError(
+            "Live worker exited unexpectedly", f"exit code {self._process.exitcode}"
+        )
+        self._ready.set()
+        for session_id in list(self._sessions):
+            callback = self._sessions.pop(session_id, None)
+            if callback is not None:
+                callback({"session": session_id, "status": "error", "error": self._error.details})
+
+    def open(self, session_id, on_message, **options):
+        """
+        Start a session. `on_message` gets the worker's messages for it:
+        "partial" segments, "progress" events and finally "done" or "error".
+        """
+        with self._lock:
+            if not self._process.is_alive():
+                self._start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        self._sessions[session_id] = on_message
+        self._send({"session": session_id, "type": "start", "options": options})
+
+    def send_audio(self, session_id, pcm):
+        """Feed 16 kHz mono PCM16 bytes to the session."""
+        self._send({"session": session_id, "type": "audio", "data": pcm})
+
+    def stop(self, session_id, audio_path, **options):
+        """End the recording, the full result is written next to `audio_path`."""
+        self._send(
+            {"session": session_id, "type": "stop", "audio_path": audio_path, "options": options}
+        )
+
+    def cancel(self, session_id):
+        self._sessions.pop(session_id, None)
+        try:
+            self._send({"session": session_id, "type": "cancel"})
+        except WorkerError:
+            pass  # a dead worker has no session left to cancel
+
+    def _send(self, message):
+        with self._send_lock:
+            try:
+                self._conn.send(message)
+            except (OSError, EOFError) as e:
+                raise WorkerError("Live worker is not running", str(e))
+
+    def close(self):
+        with self._lock:
+            if self._process.is_alive():
+                self._send(None)
+                self._process.join(timeout=10)